@@ -18,6 +18,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from .cache import ParseCache
 from .html_tags import (
     BaseHTMLRenderTreeParser,
     BaseHTMLTag,
@@ -26,7 +27,7 @@ from .html_tags import (
     ParagraphTag,
 )
 from .tags import BaseTag, ErrorText, RawText, SimpleTag, TagCategory
-from .tree_parser import BaseTreeParser
+from .tree_parser import BaseTreeParser, ParseLimits, ParserPool
 
 __version__ = "2.0.0"
 
@@ -37,6 +38,9 @@ __all__ = [
     "SimpleTag",
     "TagCategory",
     "BaseTreeParser",
+    "ParseLimits",
+    "ParserPool",
+    "ParseCache",
     "HTMLText",
     "BaseHTMLTag",
     "HtmlSimpleTag",
@@ -0,0 +1,120 @@
+# Copyright (c) 2017 Conde Nast Britain
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import functools
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from bbcondeparser.tree_parser import ParserPool
+
+DEFAULT_SIZE_THRESHOLD = 8192
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+class AsyncRenderer(object):
+    """Parses and renders from within an asyncio event loop without
+        blocking it on large documents.
+
+        Texts shorter than `size_threshold` characters are handled directly
+        on the loop, as handing them off would cost more than it saves.
+        Anything larger is run in `executor` (a thread pool of
+        `max_concurrency` threads by default), with at most
+        `max_concurrency` documents being handled at once per event loop.
+        Either way the output is exactly that of the parser itself.
+    """
+
+    def __init__(
+        self,
+        executor=None,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        size_threshold=DEFAULT_SIZE_THRESHOLD,
+    ):
+        self._executor = executor
+        self.max_concurrency = max_concurrency
+        self.size_threshold = size_threshold
+
+        # Semaphores belong to a loop, so keep one per loop we're used from.
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_concurrency)
+            return self._executor
+
+    def _get_semaphore(self, loop):
+        try:
+            return self._semaphores[loop]
+        except KeyError:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+            return semaphore
+
+    async def _run(self, text, func):
+        if len(text) < self.size_threshold:
+            return func()
+
+        loop = asyncio.get_event_loop()
+        async with self._get_semaphore(loop):
+            return await loop.run_in_executor(self.executor, func)
+
+    async def aparse(self, text, parser_cls, **kwargs):
+        """returns a `parser_cls` instance for `text`
+            `kwargs` are passed through to the parser's __init__.
+        """
+        return await self._run(text, functools.partial(parser_cls, text, **kwargs))
+
+    async def arender(self, text, parser_cls, ctx=None, **kwargs):
+        """returns `text` rendered by `parser_cls`
+            `kwargs` are passed through to the parser's __init__.
+        """
+        return await self._run(
+            text, functools.partial(_render, parser_cls, text, ctx, kwargs)
+        )
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait)
+                self._executor = None
+
+
+_render_pool = ParserPool()
+
+
+def _render(parser_cls, text, ctx, kwargs):
+    return _render_pool.parse(parser_cls, text, **kwargs).render(ctx)
+
+
+_default_renderer = AsyncRenderer()
+
+
+async def aparse(text, parser_cls, **kwargs):
+    """`AsyncRenderer.aparse` using a shared default AsyncRenderer"""
+    return await _default_renderer.aparse(text, parser_cls, **kwargs)
+
+
+async def arender(text, parser_cls, ctx=None, **kwargs):
+    """`AsyncRenderer.arender` using a shared default AsyncRenderer"""
+    return await _default_renderer.arender(text, parser_cls, ctx, **kwargs)
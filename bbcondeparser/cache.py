@@ -0,0 +1,176 @@
+# Copyright (c) 2017 Conde Nast Britain
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+from .tags import BaseTag
+
+DEFAULT_MAX_SIZE = 32 * 1024 * 1024
+
+# A rough size for a node in a parsed tree, in bytes, for sizing cached trees.
+NODE_SIZE = 300
+
+HTML_ENTRY = "html"
+TREE_ENTRY = "tree"
+
+
+def text_digest(text):
+    """returns the sha1 hex digest of `text`"""
+    return hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class ParseCache(object):
+    """An in-process cache of rendered text (and optionally parsed trees),
+        evicting the least recently used entries once their approximate
+        size exceeds `max_size` bytes.
+
+        Entries are keyed by the parser's `fingerprint()`, the arguments
+        given to the parser (e.g. `newline_behaviour`, `convert_paragraphs`)
+        and the sha1 of the text.
+
+        Renders with a context aren't cached, as the context can change
+        the output, but if `cache_trees` is set they reuse a cached parse.
+        Cached parsers are shared by everything that gets them from the
+        cache, so must not be changed (e.g. by `reset` or `reparse`).
+
+        Can be used as a class decorator to set a parser's `parse_cache`:
+            @ParseCache(max_size=...)
+            class MyParser(BaseTreeParser):
+                ...
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, cache_trees=False):
+        self.max_size = max_size
+        self.cache_trees = cache_trees
+
+        # {(entry type, key): (value, size)}, least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return "{}({} entries, {} bytes, {} hits, {} misses, {} evictions)".format(
+            self.__class__.__name__,
+            len(self),
+            self.size,
+            self.hits,
+            self.misses,
+            self.evictions,
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __call__(self, parser_cls):
+        """Set this as `parser_cls`'s parse_cache.
+            (returns `parser_cls` so could be used as a class decorator)
+        """
+        parser_cls.parse_cache = self
+        return parser_cls
+
+    def make_key(self, parser_cls, text, **kwargs):
+        return (
+            parser_cls.fingerprint(),
+            tuple(sorted(kwargs.items())),
+            text_digest(text),
+        )
+
+    def get(self, entry_type, key):
+        """returns the cached value, or None if there isn't one"""
+        with self._lock:
+            try:
+                value, _ = self._entries[entry_type, key]
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end((entry_type, key))
+            self.hits += 1
+            return value
+
+    def put(self, entry_type, key, value, size):
+        with self._lock:
+            old = self._entries.pop((entry_type, key), None)
+            if old is not None:
+                self.size -= old[1]
+
+            if size > self.max_size:
+                return
+
+            self._entries[entry_type, key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def parse(self, parser_cls, text, **kwargs):
+        """returns a `parser_cls` instance for `text`, from the cache if
+            `cache_trees` is set.
+            `kwargs` are passed through to the parser's __init__.
+        """
+        if not self.cache_trees:
+            return parser_cls(text, **kwargs)
+
+        key = self.make_key(parser_cls, text, **kwargs)
+        parser = self.get(TREE_ENTRY, key)
+        if parser is None:
+            parser = parser_cls(text, **kwargs)
+            self.put(TREE_ENTRY, key, parser, tree_size(parser))
+        return parser
+
+    def render(self, parser_cls, text, ctx=None, **kwargs):
+        """returns `text` rendered by `parser_cls`, from the cache if it's
+            there. `kwargs` are passed through to the parser's __init__.
+        """
+        if ctx:
+            return self.parse(parser_cls, text, **kwargs).render(ctx)
+
+        key = self.make_key(parser_cls, text, **kwargs)
+        html = self.get(HTML_ENTRY, key)
+        if html is None:
+            html = self.parse(parser_cls, text, **kwargs).render()
+            self.put(HTML_ENTRY, key, html, sys.getsizeof(html))
+        return html
+
+
+def tree_size(parser):
+    """returns the approximate size in bytes of `parser`'s parsed text"""
+    nodes = 1
+    stack = [parser.root_node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, BaseTag):
+            nodes += len(node.tree)
+            stack.extend(node.tree)
+    return sys.getsizeof(parser.raw_text) + nodes * NODE_SIZE
@@ -0,0 +1,662 @@
+# Copyright (c) 2017 Conde Nast Britain
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from array import array
+
+from .html_tags import (
+    BaseHTMLTag,
+    HTMLNewlineText,
+    HTMLText,
+    HtmlSimpleTag,
+    ParagraphTag,
+    escape_html,
+)
+from .tags import (
+    NEWLINE_STR,
+    BaseNode,
+    BaseTag,
+    BaseText,
+    NewlineText,
+    RootTag,
+    SimpleTag,
+    Source,
+    register_render_table,
+)
+
+TEXT_NODE = 0
+TAG_NODE = 1
+
+# Attributes held in the columns rather than the per node state.
+_COLUMN_ATTRS = frozenset(
+    [
+        "_parent_node",
+        "_start",
+        "_end",
+        "_text",
+        "_source",
+        "_tree",
+        "_start_text",
+        "_end_text",
+        # not part of the tree, just worked out from it and kept
+        "_render_cache",
+        "_contains",
+        "_index",
+    ]
+)
+
+# The names of CompactTree's columns
+COLUMNS = (
+    "kinds",
+    "class_ids",
+    "parents",
+    "first_children",
+    "next_siblings",
+    "starts",
+    "ends",
+    "body_starts",
+    "body_ends",
+    "state_ids",
+)
+
+# How a node's class can be rendered without creating the node.
+_RENDER_TEXT = 1
+_RENDER_HTML_TEXT = 2
+_RENDER_NEWLINE = 3
+_RENDER_HTML_NEWLINE = 4
+_RENDER_CHILDREN = 5
+_RENDER_TEMPLATE = 6
+_RENDER_HTML_TEMPLATE = 7
+_RENDER_PARAGRAPH = 8
+# Those which don't render any children (None being to create the node).
+_NODE_METHODS = frozenset(
+    [None, _RENDER_TEXT, _RENDER_HTML_TEXT, _RENDER_NEWLINE, _RENDER_HTML_NEWLINE]
+)
+
+# Class attributes the fast paths read, which an instance mustn't override.
+_RENDER_ATTRS = frozenset(["template", "replace_text", "trim_whitespace"])
+
+
+class CompactTree(object):
+    """A parsed tree held as columns of integers rather than as node objects,
+        for keeping many parsed documents in memory.
+
+        Node `0` is the root; nodes are numbered in document order, so the
+        descendants of a node are the nodes numbered after it up to its
+        next sibling (or that of its closest ancestor to have one).
+        Text and tag start/end text is sliced from `source` when needed.
+        Anything else the nodes carry (attrs, errors, error reasons and
+        any attributes set by the tag classes) is kept in a side table of
+        node states, shared between nodes where equal.
+
+        `render` gives the same result as rendering the original tree.
+        Nodes whose rendering is known (text, newlines, template tags,
+        root and null tags) are rendered straight from the columns, other
+        tags are recreated (with their children) as they're reached.
+        Nodes recreated while rendering see their ancestors as nodes with
+        the same attributes but an empty `tree`.
+    """
+
+    def __init__(self, root_node, source):
+        """`source` is the text `root_node` was parsed from"""
+        self.source = source
+        self._shared_source = Source(source)
+
+        self.kinds = array("b")
+        self.class_ids = array("i")
+        self.parents = array("i")
+        self.first_children = array("i")
+        self.next_siblings = array("i")
+        # (start, end) is the node's location in `source`, -1 if it has
+        # none. For tags, (body_start, body_end) is the location between
+        # its start and end text.
+        self.starts = array("i")
+        self.ends = array("i")
+        self.body_starts = array("i")
+        self.body_ends = array("i")
+        self.state_ids = array("i")
+
+        self.classes = []
+        self.states = []
+
+        self._class_ids = {}
+        self._state_ids = {}
+
+        self._add_tree(root_node)
+
+        del self._class_ids
+        del self._state_ids
+
+    @classmethod
+    def from_parser(cls, parser):
+        """returns a CompactTree of `parser`'s parsed text"""
+        return cls(parser.root_node, parser.raw_text)
+
+    @classmethod
+    def from_columns(cls, source, columns, classes, states):
+        """returns a CompactTree made from the parts of another.
+            `columns` is a dict of {name: array} for each of `COLUMNS`.
+        """
+        tree = cls.__new__(cls)
+        tree.source = source
+        tree._shared_source = Source(source)
+        for name in COLUMNS:
+            setattr(tree, name, columns[name])
+        tree.classes = classes
+        tree.states = states
+        return tree
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def _add_tree(self, root_node):
+        last_children = {}
+        indexes = {}
+        states = []
+        stack = [(root_node, -1)]
+
+        while stack:
+            node, parent = stack.pop()
+            index = self._add_node(node, parent)
+            indexes[id(node)] = index
+            states.append(self._get_node_state(node))
+
+            if parent != -1:
+                last_child = last_children.get(parent)
+                if last_child is None:
+                    self.first_children[parent] = index
+                else:
+                    self.next_siblings[last_child] = index
+                last_children[parent] = index
+
+            if self.kinds[index] == TAG_NODE:
+                stack.extend((child, index) for child in reversed(node.tree))
+
+        # Now every node has an index, references from one node to another
+        # can be kept as indexes.
+        for state in states:
+            for key, value in state.items():
+                state[key] = _to_refs(value, indexes)
+            self.state_ids.append(self._get_state_id(state))
+
+    def _add_node(self, node, parent):
+        index = len(self.kinds)
+        start = end = body_start = body_end = -1
+        if node.location is not None:
+            start, end = node.location
+            if isinstance(node, BaseTag):
+                body_start = start + len(node.start_text)
+                body_end = end - len(node.end_text)
+
+        self.kinds.append(TAG_NODE if isinstance(node, BaseTag) else TEXT_NODE)
+        self.class_ids.append(self._get_class_id(type(node)))
+        self.parents.append(parent)
+        self.first_children.append(-1)
+        self.next_siblings.append(-1)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.body_starts.append(body_start)
+        self.body_ends.append(body_end)
+
+        return index
+
+    def _get_node_state(self, node):
+        """returns the attributes of `node` which can't be found from
+            the columns
+        """
+        state = dict(
+            (key, value)
+            for key, value in get_node_attrs(node).items()
+            if key not in _COLUMN_ATTRS
+        )
+
+        source = self.source
+        location = node.location
+        if isinstance(node, BaseTag):
+            if location is not None:
+                start, end = location
+                body_start = start + len(node.start_text)
+                body_end = end - len(node.end_text)
+
+            if (
+                location is None
+                or body_start > body_end
+                or source[start:body_start] != node.start_text
+                or source[body_end:end] != node.end_text
+            ):
+                state["start_text"] = node.start_text
+                state["end_text"] = node.end_text
+
+        elif location is None or source[location[0] : location[1]] != node.text:
+            state["text"] = node.text
+
+        return state
+
+    def _get_class_id(self, node_cls):
+        try:
+            return self._class_ids[node_cls]
+        except KeyError:
+            class_id = self._class_ids[node_cls] = len(self.classes)
+            self.classes.append(node_cls)
+            return class_id
+
+    def _get_state_id(self, state):
+        if not state:
+            return -1
+
+        try:
+            key = _freeze(state)
+            return self._state_ids[key]
+        except TypeError:
+            # Unhashable somewhere within, so can't be shared.
+            key = None
+        except KeyError:
+            pass
+
+        state_id = len(self.states)
+        self.states.append(state)
+        if key is not None:
+            self._state_ids[key] = state_id
+        return state_id
+
+    def get_children(self, index):
+        """returns the indexes of the children of node `index`"""
+        children = []
+        child = self.first_children[index]
+        while child != -1:
+            children.append(child)
+            child = self.next_siblings[child]
+        return children
+
+    def get_state(self, index):
+        """returns the state of node `index`. References to other nodes
+            are given as `NodeRef`s.
+        """
+        state_id = self.state_ids[index]
+        if state_id == -1:
+            return {}
+        return self.states[state_id]
+
+    def get_location(self, index):
+        if self.starts[index] == -1:
+            return None
+        return (self.starts[index], self.ends[index])
+
+    def get_text(self, index):
+        state_id = self.state_ids[index]
+        if state_id != -1:
+            try:
+                return self.states[state_id]["text"]
+            except KeyError:
+                pass
+        return self.source[self.starts[index] : self.ends[index]]
+
+    def node(self, index=0, parent=None):
+        """returns node `index` (and its children) as node objects,
+            with `parent` as its parent node.
+        """
+        made = {}
+        stack = [(index, parent)]
+        while stack:
+            node_index, node_parent = stack.pop()
+            node = made[node_index] = self._make_node(node_index, node_parent)
+            if node_parent is not None and node_index != index:
+                node_parent.tree.append(node)
+
+            if self.kinds[node_index] == TAG_NODE:
+                stack.extend(
+                    (child, node)
+                    for child in reversed(self.get_children(node_index))
+                )
+
+        for node_index, node in made.items():
+            self._set_state(node, node_index, made)
+
+        return made[index]
+
+    def _make_node(self, index, parent):
+        """returns node `index` without its children or state"""
+        node_cls = self.classes[self.class_ids[index]]
+        node = node_cls.__new__(node_cls)
+
+        node._parent_node = parent
+        node._source = None
+        node.location = self.get_location(index)
+
+        # Nodes take their text from the source, unless their state says
+        # otherwise, when the setters for the text will undo this.
+        if node.location is None:
+            if self.kinds[index] == TAG_NODE:
+                node._start_text = node._end_text = ""
+            else:
+                node._text = ""
+        else:
+            node._source = self._shared_source
+            if self.kinds[index] == TAG_NODE:
+                node._start_text = self.body_starts[index] - self.starts[index]
+                node._end_text = self.ends[index] - self.body_ends[index]
+            else:
+                node._text = None
+
+        if self.kinds[index] == TAG_NODE:
+            node._tree = []
+            node._render_cache = None
+            node._contains = None
+
+        return node
+
+    def _set_state(self, node, index, made):
+        """Set the state of node `index` on `node`, with references to other
+            nodes resolved from `made` (or else created).
+        """
+
+        def get_node(ref_index):
+            try:
+                return made[ref_index]
+            except KeyError:
+                ref_node = made[ref_index] = self.node(ref_index)
+                return ref_node
+
+        for key, value in self.get_state(index).items():
+            setattr(node, key, _from_refs(value, get_node))
+
+    def render(self, ctx=None):
+        """returns the rendering of the tree, with `ctx` as the context
+            (as given to `BaseTreeParser.render`)
+        """
+        return _Renderer(self, ctx).render(0)
+
+
+class _Renderer(object):
+    """The state of one `CompactTree.render` call"""
+
+    def __init__(self, tree, ctx):
+        self.tree = tree
+        self.ctx = ctx or {}
+        self.shells = {}
+        # {(class id, state id): render method}
+        self.methods = {}
+
+    def get_context(self):
+        return self.ctx
+
+    def get_shell(self, index):
+        """returns node `index` without its children, for recreated nodes
+            to use as their parent.
+        """
+        if index == -1:
+            return self
+
+        try:
+            return self.shells[index]
+        except KeyError:
+            parent = self.get_shell(self.tree.parents[index])
+            shell = self.shells[index] = self.tree._make_node(index, parent)
+            self.tree._set_state(shell, index, {})
+            return shell
+
+    def get_method(self, index):
+        key = (self.tree.class_ids[index], self.tree.state_ids[index])
+        try:
+            return self.methods[key]
+        except KeyError:
+            method = get_render_method(self.tree.classes[key[0]])
+            if not _RENDER_ATTRS.isdisjoint(self.tree.get_state(index)):
+                method = None
+            self.methods[key] = method
+            return method
+
+    def render(self, index):
+        """returns the rendering of node `index`, walking the tree with a
+            stack rather than recursing, so deep trees can be rendered.
+        """
+        tree = self.tree
+        first_children = tree.first_children
+        next_siblings = tree.next_siblings
+
+        method = self.get_method(index)
+        if method in _NODE_METHODS:
+            return self.render_node(index, method)
+
+        # [(node index, its method, the renderings of its children so far)]
+        stack = [(index, method, [])]
+        child = first_children[index]
+        while True:
+            if child != -1:
+                method = self.get_method(child)
+                if method in _NODE_METHODS:
+                    stack[-1][2].append(self.render_node(child, method))
+                    child = next_siblings[child]
+                else:
+                    stack.append((child, method, []))
+                    child = first_children[child]
+                continue
+
+            node_index, method, parts = stack.pop()
+            text = self.render_tag(node_index, method, "".join(parts))
+            if not stack:
+                return text
+            stack[-1][2].append(text)
+            child = next_siblings[node_index]
+
+    def render_node(self, index, method):
+        """returns the rendering of node `index`, which is either text or
+            rendered by recreating it (`method` is None).
+        """
+        tree = self.tree
+        if method is None:
+            parent = self.get_shell(tree.parents[index])
+            return tree.node(index, parent).render()
+
+        if method == _RENDER_TEXT:
+            return tree.get_text(index)
+
+        if method == _RENDER_HTML_TEXT:
+            return escape_html(tree.get_text(index))
+
+        if method == _RENDER_NEWLINE:
+            count = tree.get_state(index).get("count", 1)
+            if count == 1:
+                return NEWLINE_STR
+            return tree.classes[tree.class_ids[index]].DOUBLE_NEWLINE
+
+        # _RENDER_HTML_NEWLINE
+        render_mode = tree.get_state(index).get("render_mode", "html")
+        if render_mode == "html":
+            return "<br />"
+        elif render_mode == "raw":
+            return tree.get_text(index)
+        else:
+            return ""
+
+    def render_tag(self, index, method, children):
+        """returns the rendering of tag `index`, given that of its children"""
+        if method == _RENDER_CHILDREN:
+            return children
+
+        tree = self.tree
+        node_cls = tree.classes[tree.class_ids[index]]
+        if method == _RENDER_PARAGRAPH:
+            text = "<p>{children}</p>".format(children=children)
+        elif node_cls._template_parts is None:
+            text = node_cls.template.replace(node_cls.replace_text, children)
+        elif len(node_cls._template_parts) == 1:
+            text = node_cls._template_parts[0]
+        else:
+            text = children.join(node_cls._template_parts)
+
+        if method != _RENDER_TEMPLATE and node_cls.trim_whitespace:
+            text = text.strip()
+
+        return text
+
+
+_slot_names = {}
+
+
+def get_slot_names(node_cls):
+    """returns a list of the names of the slots of `node_cls`"""
+    try:
+        return _slot_names[node_cls]
+    except KeyError:
+        names = []
+        for klass in node_cls.__mro__:
+            slots = klass.__dict__.get("__slots__", ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            names.extend(
+                name for name in slots if name not in ("__dict__", "__weakref__")
+            )
+        _slot_names[node_cls] = names
+        return names
+
+
+def get_node_attrs(node):
+    """returns a dict of the attributes set on `node`, whether held in
+        slots or its __dict__
+    """
+    names = get_slot_names(type(node))
+
+    attrs = {}
+    for name in names:
+        try:
+            attrs[name] = getattr(node, name)
+        except AttributeError:
+            # An unset slot
+            pass
+    attrs.update(getattr(node, "__dict__", ()))
+    return attrs
+
+
+_render_methods = register_render_table({})
+
+
+def get_render_method(node_cls):
+    """returns how `node_cls` nodes can be rendered by a CompactTree
+        without creating them, or None if they need creating.
+    """
+    try:
+        return _render_methods[node_cls]
+    except KeyError:
+        method = _render_methods[node_cls] = _find_render_method(node_cls)
+        return method
+
+
+def _find_render_method(node_cls):
+    render = node_cls.render
+    _render = getattr(node_cls, "_render", None)
+
+    if issubclass(node_cls, BaseText):
+        if render is BaseNode.render and _render is BaseText._render:
+            return _RENDER_TEXT
+        if render is HTMLText.render and _render is BaseText._render:
+            return _RENDER_HTML_TEXT
+        if render is BaseNode.render and _render is NewlineText._render:
+            return _RENDER_NEWLINE
+        if (
+            render is BaseNode.render
+            and _render is HTMLNewlineText._render
+            and node_cls.render_raw is BaseText.render_raw
+        ):
+            return _RENDER_HTML_NEWLINE
+        return None
+
+    if not issubclass(node_cls, BaseTag):
+        return None
+
+    if node_cls.render_children is not BaseTag.render_children:
+        return None
+
+    if node_cls.__dict__.get("null_class") is node_cls and "render" in vars(
+        node_cls
+    ):
+        return _RENDER_CHILDREN
+
+    # (templates which aren't plain strings, e.g. properties, have no parts)
+    has_parts = getattr(node_cls, "_template_parts", None) is not None
+
+    if render is BaseNode.render:
+        if _render is RootTag._render:
+            return _RENDER_CHILDREN
+        if _render is SimpleTag._render and has_parts:
+            return _RENDER_TEMPLATE
+
+    if render is BaseHTMLTag.render:
+        if _render is HtmlSimpleTag._render and has_parts:
+            return _RENDER_HTML_TEMPLATE
+        if _render is ParagraphTag._render:
+            return _RENDER_PARAGRAPH
+
+    return None
+
+
+def _freeze(value):
+    """returns a hashable equivalent of `value`, raising TypeError if there
+        isn't one.
+    """
+    if isinstance(value, dict):
+        return (dict, tuple((key, _freeze(val)) for key, val in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(_freeze(item) for item in value))
+    hash(value)
+    return (type(value), value)
+
+
+class NodeRef(object):
+    """A reference, within a CompactTree's node states, to node `index`"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, NodeRef) and self.index == other.index
+
+    def __hash__(self):
+        return hash((NodeRef, self.index))
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.index)
+
+
+def _to_refs(value, indexes):
+    """returns `value` with the nodes in it (also in lists, tuples or dict
+        values) replaced by `NodeRef`s using `indexes`, a dict of
+        {id(node): index}. Nodes without an index are left as they are.
+    """
+    if isinstance(value, BaseNode):
+        index = indexes.get(id(value))
+        return value if index is None else NodeRef(index)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_refs(item, indexes) for item in value)
+    if isinstance(value, dict):
+        return dict((key, _to_refs(val, indexes)) for key, val in value.items())
+    return value
+
+
+def _from_refs(value, get_node):
+    """returns `value` with `NodeRef`s replaced using `get_node`. States are
+        shared, so lists and dicts are always copied.
+    """
+    if isinstance(value, NodeRef):
+        return get_node(value.index)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_from_refs(item, get_node) for item in value)
+    if isinstance(value, dict):
+        return dict((key, _from_refs(val, get_node)) for key, val in value.items())
+    return value
@@ -0,0 +1,167 @@
+# Copyright (c) 2017 Conde Nast Britain
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sqlite3
+import threading
+
+from .cache import text_digest
+
+# sqlite limits the number of parameters in a query, so bulk gets are done
+# in batches of this many texts.
+BATCH_SIZE = 500
+
+_CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS renders (
+        fingerprint TEXT NOT NULL,
+        params TEXT NOT NULL,
+        digest TEXT NOT NULL,
+        html TEXT NOT NULL,
+        PRIMARY KEY (fingerprint, params, digest)
+    ) WITHOUT ROWID
+"""
+
+
+class DiskRenderCache(object):
+    """A cache of rendered text kept in an sqlite database at `path`,
+        so that it outlives the process.
+
+        Entries are keyed by the parser's `fingerprint()` (so are not used
+        once the parser, its tags or the library change), the arguments
+        given to the parser (e.g. `newline_behaviour`) and the sha1 of the
+        text. Renders with a context aren't cached.
+
+        The cache may be used from several threads and processes at once,
+        each thread (of each process) having its own connection.
+        `timeout` is how long to wait for another writer, in seconds.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute(_CREATE_TABLE)
+
+    def _connect(self):
+        """returns this thread's connection, making one if needed"""
+        pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        # Connections can't be carried across a fork.
+        if conn is None or self._local.pid != pid:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = pid
+        return conn
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    @staticmethod
+    def _params(kwargs):
+        return repr(sorted(kwargs.items()))
+
+    def get(self, parser_cls, text, **kwargs):
+        """returns the cached rendering of `text`, or None"""
+        return self.get_many(parser_cls, [text], **kwargs)[0]
+
+    def get_many(self, parser_cls, texts, **kwargs):
+        """returns a list of the cached rendering of each of `texts`,
+            None for those not in the cache.
+        """
+        fingerprint = parser_cls.fingerprint()
+        params = self._params(kwargs)
+        digests = [text_digest(text) for text in texts]
+
+        found = {}
+        conn = self._connect()
+        for start in range(0, len(digests), BATCH_SIZE):
+            batch = list(set(digests[start : start + BATCH_SIZE]))
+            query = (
+                "SELECT digest, html FROM renders"
+                " WHERE fingerprint = ? AND params = ? AND digest IN ({})".format(
+                    ", ".join("?" * len(batch))
+                )
+            )
+            found.update(conn.execute(query, [fingerprint, params] + batch))
+
+        return [found.get(digest) for digest in digests]
+
+    def put(self, parser_cls, text, html, **kwargs):
+        """Cache `html` as the rendering of `text`"""
+        self.put_many(parser_cls, [(text, html)], **kwargs)
+
+    def put_many(self, parser_cls, items, **kwargs):
+        """Cache each (text, html) pair of `items` in one transaction"""
+        fingerprint = parser_cls.fingerprint()
+        params = self._params(kwargs)
+        rows = [
+            (fingerprint, params, text_digest(text), html) for text, html in items
+        ]
+
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO renders (fingerprint, params, digest, html)"
+                " VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def render(self, parser_cls, text, **kwargs):
+        """returns `text` rendered by `parser_cls`, from the cache if it's
+            there. `kwargs` are passed through to the parser's __init__.
+        """
+        return self.render_many(parser_cls, [text], **kwargs)[0]
+
+    def render_many(self, parser_cls, texts, **kwargs):
+        """returns a list of each of `texts` rendered by `parser_cls`,
+            rendering and caching those which aren't already cached.
+        """
+        texts = list(texts)
+        results = self.get_many(parser_cls, texts, **kwargs)
+
+        missing = [index for index, html in enumerate(results) if html is None]
+        if missing:
+            missing_texts = [texts[index] for index in missing]
+            rendered = list(parser_cls.render_many(missing_texts, **kwargs))
+            for index, html in zip(missing, rendered):
+                results[index] = html
+            self.put_many(parser_cls, zip(missing_texts, rendered), **kwargs)
+
+        return results
+
+    def purge(self, parser_cls=None):
+        """Delete everything cached for `parser_cls`, or everything if
+            it's None.
+        """
+        with self._connect() as conn:
+            if parser_cls is None:
+                conn.execute("DELETE FROM renders")
+            else:
+                conn.execute(
+                    "DELETE FROM renders WHERE fingerprint = ?",
+                    (parser_cls.fingerprint(),),
+                )
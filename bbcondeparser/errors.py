@@ -21,3 +21,23 @@
 
 class BBCondeParseError(Exception):
     pass
+
+
+class ParseLimitExceeded(BBCondeParseError):
+    """Raised when parsing goes over one of the `ParseLimits` set on a parser
+        `limit` is the name of the limit, e.g. 'max_depth'
+        `location` is the index in the source text at which it was exceeded
+    """
+
+    def __init__(self, limit, location):
+        super(ParseLimitExceeded, self).__init__(
+            "parse limit {} exceeded at {}".format(limit, location)
+        )
+        self.limit = limit
+        self.location = location
+
+
+class TreeLoadError(BBCondeParseError):
+    """Raised when a dumped tree can't be loaded, either because the data
+        is malformed or because it doesn't fit the parser it's loaded for.
+    """
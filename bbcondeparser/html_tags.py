@@ -23,6 +23,7 @@ from collections import namedtuple
 from html import escape
 
 from .tags import (
+    _UNKNOWN,
     BaseNode,
     BaseTag,
     BaseTagMeta,
@@ -30,6 +31,9 @@ from .tags import (
     NewlineText,
     RawText,
     RootTag,
+    _render_state,
+    get_template_parts,
+    render_template,
 )
 from .tree_parser import BaseTreeParser
 
@@ -87,6 +91,8 @@ def escape_html(text):
 class HTMLNewlineText(NewlineText):
     """HTML version of NewlineText."""
 
+    __slots__ = ("render_mode",)
+
     def __init__(self, *args, **kwargs):
         super(HTMLNewlineText, self).__init__(*args, **kwargs)
         self.render_mode = "html"
@@ -112,6 +118,8 @@ class HTMLNewlineText(NewlineText):
 class HTMLText(RawText):
     """HTML version of RawText."""
 
+    __slots__ = ()
+
     def render(self):
         """Render the text.
 
@@ -265,6 +273,8 @@ class BaseHTMLTag(BaseTag, metaclass=BaseHTMLTagMeta):
             be True, False or None.
     """
 
+    __slots__ = ()
+
     tag_display = "inline"
     newline_behaviour = None
     convert_paragraphs = None
@@ -281,6 +291,13 @@ class BaseHTMLTag(BaseTag, metaclass=BaseHTMLTagMeta):
 
         return child_text
 
+    @property
+    def text_block(self):
+        """Block tags are kept apart from the text around them by
+        `render_text`.
+        """
+        return is_block_tag(self)
+
     def get_context(self):
         return apply_ctx(
             super(BaseHTMLTag, self).get_context().copy(),
@@ -292,6 +309,8 @@ class BaseHTMLTag(BaseTag, metaclass=BaseHTMLTagMeta):
 
 
 class RootHTMLTag(RootTag):
+    __slots__ = ()
+
     newline_behaviour = None
     convert_paragraphs = None
     trim_whitespace = None
@@ -305,29 +324,37 @@ class HtmlSimpleTag(BaseHTMLTag):
         template (str): basic template
     """
 
+    __slots__ = ()
+
     template = None
     replace_text = "{{ body }}"
     convert_paragraphs = False
 
     def _render(self):
-        rendered_children = self.render_children()
+        return render_template(self)
 
-        if self.template is None:
-            return rendered_children
-
-        else:
-            return self.template.replace(self.replace_text, rendered_children)
+    def _get_render_parts(self):
+        parts = get_template_parts(self)
+        if parts is None or len(parts) != 2:
+            return None
+        return (parts[0], parts[1], self.trim_whitespace)
 
 
 class ParagraphTag(BaseHTMLTag):
+    __slots__ = ()
+
     tag_name = "p"
     # It is block but has the behaviour of an inline
     tag_display = "inline"
     convert_paragraphs = False
+    text_block = True
 
     def _render(self):
         return "<p>{children}</p>".format(children=self.render_children())
 
+    def _get_render_parts(self):
+        return ("<p>", "</p>", self.trim_whitespace)
+
 
 class BaseHTMLRenderTreeParser(BaseTreeParser):
     """I've been intensely thinking about how the paragraphs and newline
@@ -384,22 +411,49 @@ class BaseHTMLRenderTreeParser(BaseTreeParser):
     convert_paragraphs = None
 
     def __init__(self, text, newline_behaviour=None, convert_paragraphs=None):
-        super(BaseHTMLRenderTreeParser, self).__init__(text)
-
-        newline_behaviour = get_newline_behaviour(
+        self.newline_behaviour = get_newline_behaviour(
             self.newline_behaviour, newline_behaviour
         )
-        convert_paragraphs = get_convert_paragraphs(
+        self.convert_paragraphs = get_convert_paragraphs(
             self.convert_paragraphs, convert_paragraphs
         )
 
-        self.root_node = amend_tree(
-            self.root_node,
-            newline_behaviour,
-            convert_paragraphs,
+        super(BaseHTMLRenderTreeParser, self).__init__(text)
+
+    def build_tree(self, text):
+        root_node = super(BaseHTMLRenderTreeParser, self).build_tree(text)
+        root_node.set_parent_node(self)
+
+        return amend_tree(
+            root_node,
+            self.newline_behaviour,
+            self.convert_paragraphs,
             self.paragraph_tag_class,
         )
 
+    def amend_reparsed_node(self, node, path):
+        # When the tree was first amended, each node was amended before
+        # it (or its parents) could be moved into a paragraph, so the
+        # context it saw came from its parents as parsed. Recreate that
+        # while amending the new node.
+        parse_path = [path[0]] + [
+            ancestor for ancestor in path[1:] if ancestor.location
+        ] + [node]
+        parents = [(child, child._parent_node) for child in parse_path[1:]]
+        for parent, child in zip(parse_path, parse_path[1:]):
+            child.set_parent_node(parent)
+
+        try:
+            amend_tree(
+                node,
+                self.newline_behaviour,
+                self.convert_paragraphs,
+                self.paragraph_tag_class,
+            )
+        finally:
+            for child, parent in parents:
+                child.set_parent_node(parent)
+
 
 def amend_tree(
     root_node, newline_behaviour=None, convert_paragraphs=None, paragraph_tag_class=None
@@ -466,6 +520,8 @@ class _BaseHTMLRenderTreeParser(object):
         self._paragraph_tree = None
         self._tree = []
         self._node = None
+        # {id(tag): context} for the tags being handled
+        self.contexts = None
 
     def append_tree(self, item):
         self._tree.append(item)
@@ -486,6 +542,7 @@ class _BaseHTMLRenderTreeParser(object):
         self._paragraph_tree = None
         self._inside_paragraph = False
         ctx = self._node.get_context()
+        self.contexts[id(self._node)] = ctx
         self.newline_behaviour = get_newline_behaviour(
             self.newline_behaviour, ctx.get("newline_behaviour")
         )
@@ -494,7 +551,9 @@ class _BaseHTMLRenderTreeParser(object):
         )
 
     def stack_pop(self):
-        self.set_state(self.stack.pop())
+        stack_ctx = self.stack.pop()
+        del self.contexts[id(stack_ctx.node)]
+        self.set_state(stack_ctx)
 
     def set_state(self, stack_ctx):
         self._tree = stack_ctx.tree
@@ -556,8 +615,7 @@ class _BaseHTMLRenderTreeParser(object):
         self._inside_paragraph = False
 
     def handle_inline_tag(self):
-        self.handle_tree()
-
+        # (the tag's own tree has been handled)
         if self.is_converting_paragraphs:
             if not self.is_inside_paragraph:
                 self.open_paragraph()
@@ -567,11 +625,12 @@ class _BaseHTMLRenderTreeParser(object):
         else:
             self.append_tree(self._node)
 
-    def handle_block_tag(self):
+    def start_block_tag(self):
         if self.is_inside_paragraph and self._paragraph_tree:
             self.close_paragraph()
 
-        self.handle_tree()
+    def handle_block_tag(self):
+        # (the tag's own tree has been handled)
         self.append_tree(self._node)
 
     def handle_renderable_text(self):
@@ -626,24 +685,47 @@ class _BaseHTMLRenderTreeParser(object):
                     self.append_tree(self._node)
 
     def handle_tree(self):
-
+        """Amend the tree of `_node`, and those of the tags within it.
+            This walks the tree with a stack rather than recursing, so deep
+            trees can be amended: `children` holds an iterator over the
+            tree of each tag being handled.
+        """
         self.stack_push()
+        children = [iter(self._node.tree)]
 
-        for node in self._node.tree:
-            self._node = node
+        while children:
+            for node in children[-1]:
+                self._node = node
+
+                if is_inline_tag(node):
+                    self.stack_push()
+                    children.append(iter(node.tree))
+                    break
 
-            if is_inline_tag(self._node):
-                self.handle_inline_tag()
+                elif is_block_tag(node):
+                    self.start_block_tag()
+                    self.stack_push()
+                    children.append(iter(node.tree))
+                    break
 
-            elif is_block_tag(self._node):
-                self.handle_block_tag()
+                elif isinstance(node, RENDERABLE_TEXT):
+                    self.handle_renderable_text()
 
-            elif isinstance(self._node, RENDERABLE_TEXT):
-                self.handle_renderable_text()
+                elif isinstance(node, NewlineText):
+                    self.handle_newline()
 
-            elif isinstance(self._node, NewlineText):
-                self.handle_newline()
+            else:
+                children.pop()
+                self.close_tree()
+                if not children:
+                    break
+                if is_inline_tag(self._node):
+                    self.handle_inline_tag()
+                else:
+                    self.handle_block_tag()
 
+    def close_tree(self):
+        """Give the tag being handled the tree made for it"""
         if self.is_inside_paragraph and self._paragraph_tree:
             self.close_paragraph()
 
@@ -661,4 +743,16 @@ class _BaseHTMLRenderTreeParser(object):
         self._paragraph_tree = None
         self._inside_paragraph = False
 
-        self.handle_tree()
+        # Each tag's context is kept while its tree is handled, for those
+        # of the tags within it to be got from (see stack_push).
+        # Those of the tags above are worked out when first wanted.
+        outer_contexts = _render_state.contexts
+        self.contexts = _render_state.contexts = {}
+        node = self.root_node._parent_node
+        while isinstance(node, BaseTag):
+            self.contexts[id(node)] = _UNKNOWN
+            node = node._parent_node
+        try:
+            self.handle_tree()
+        finally:
+            _render_state.contexts = outer_contexts
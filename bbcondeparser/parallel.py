@@ -0,0 +1,176 @@
+# Copyright (c) 2017 Conde Nast Britain
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from bbcondeparser.tree_parser import ParserPool
+
+# `html` is the rendered text, or None if rendering failed, in which case
+# `error` is a description of what went wrong.
+RenderResult = namedtuple("RenderResult", ["html", "error"])
+
+WORKER_CRASHED = "worker process crashed"
+
+
+def render_parallel(
+    texts, parser_cls, workers=None, chunksize=16, max_in_flight=None, **kwargs
+):
+    """Render `texts` with `parser_cls` across a pool of worker processes,
+        yielding a `RenderResult` for each text in the order given.
+
+        `workers` - the number of processes (defaults to the cpu count)
+        `chunksize` - how many texts are sent to a worker at a time
+        `max_in_flight` - how many chunks may be queued or rendering at
+            once, bounding memory when `texts` is large or lazy.
+            (defaults to twice `workers`)
+        `kwargs` are passed through to the parser's __init__.
+
+        `parser_cls` must be importable by the worker processes (i.e.
+        defined at module level). An exception while rendering a text, or
+        a worker dying outright, gives an error result for that text only.
+    """
+    renderer = _ParallelRenderer(parser_cls, kwargs, workers, max_in_flight)
+    return renderer.render(texts, chunksize)
+
+
+# Set up in each worker process by _init_worker
+_worker_parser_cls = None
+_worker_parser_kwargs = None
+_worker_pool = ParserPool()
+
+
+def _init_worker(parser_cls, parser_kwargs):
+    global _worker_parser_cls, _worker_parser_kwargs
+    _worker_parser_cls = parser_cls
+    _worker_parser_kwargs = parser_kwargs
+    # Build the tag table up front rather than on the first document.
+    parser_cls.get_tag_table()
+
+
+def _render_chunk(texts):
+    results = []
+    for text in texts:
+        try:
+            parser = _worker_pool.parse(
+                _worker_parser_cls, text, **_worker_parser_kwargs
+            )
+            html = parser.render()
+        except Exception as e:
+            results.append(RenderResult(None, "{}: {}".format(type(e).__name__, e)))
+        else:
+            results.append(RenderResult(html, None))
+    return results
+
+
+def _iter_chunks(texts, chunksize):
+    chunk = []
+    for text in texts:
+        chunk.append(text)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _ParallelRenderer(object):
+    def __init__(self, parser_cls, parser_kwargs, workers=None, max_in_flight=None):
+        self.parser_cls = parser_cls
+        self.parser_kwargs = parser_kwargs
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or self.workers * 2
+
+        self.executor = None
+        # deque of (chunk, future)
+        self.pending = deque()
+
+    def render(self, texts, chunksize):
+        self.start_executor()
+        try:
+            for chunk in _iter_chunks(texts, chunksize):
+                self.submit(chunk)
+                while len(self.pending) >= self.max_in_flight:
+                    for result in self.next_results():
+                        yield result
+
+            while self.pending:
+                for result in self.next_results():
+                    yield result
+
+        finally:
+            self.executor.shutdown()
+
+    def start_executor(self):
+        self.executor = ProcessPoolExecutor(
+            self.workers,
+            initializer=_init_worker,
+            initargs=(self.parser_cls, self.parser_kwargs),
+        )
+
+    def restart_executor(self):
+        """Replace a broken executor with a new one"""
+        self.executor.shutdown()
+        self.start_executor()
+
+    def resubmit_lost(self):
+        """Resubmit the pending chunks which were lost with a broken
+            executor.
+        """
+        pending, self.pending = self.pending, deque()
+        for chunk, future in pending:
+            if not (future.done() and future.exception() is None):
+                future = self.executor.submit(_render_chunk, chunk)
+            self.pending.append((chunk, future))
+
+    def submit(self, chunk):
+        try:
+            future = self.executor.submit(_render_chunk, chunk)
+        except BrokenProcessPool:
+            # A chunk in flight killed a worker, which one is found out when
+            # its results are wanted.
+            self.restart_executor()
+            self.resubmit_lost()
+            future = self.executor.submit(_render_chunk, chunk)
+        self.pending.append((chunk, future))
+
+    def next_results(self):
+        chunk, future = self.pending.popleft()
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            # Something killed a worker, in this chunk or in another one
+            # in flight. Render each text of this chunk on its own, with
+            # nothing else in flight, to find out which, and only then
+            # resubmit the rest.
+            self.restart_executor()
+            results = [self.render_isolated(text) for text in chunk]
+            self.resubmit_lost()
+            return results
+
+    def render_isolated(self, text):
+        future = self.executor.submit(_render_chunk, [text])
+        try:
+            return future.result()[0]
+        except BrokenProcessPool:
+            self.restart_executor()
+            return RenderResult(None, WORKER_CRASHED)
@@ -0,0 +1,380 @@
+# Copyright (c) 2017 Conde Nast Britain
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import importlib
+import marshal
+import struct
+import sys
+import zlib
+from array import array
+
+from .compact import (
+    _COLUMN_ATTRS,
+    COLUMNS,
+    TAG_NODE,
+    TEXT_NODE,
+    CompactTree,
+    NodeRef,
+    get_slot_names,
+)
+from .errors import TreeLoadError
+from .tags import BaseNode, BaseTag, _follow_edits
+
+MAGIC = b"BBCT"
+FORMAT_VERSION = 2
+
+# Follows MAGIC: the format version, the marshal version and Python version
+# (major, minor) the data was dumped with, and the crc32 of the rest.
+# marshal's format may change between Python versions, so data is only
+# loaded by the version it was dumped by.
+_HEADER = struct.Struct("<BBBBI")
+
+# Node classes which are recorded by the part they play for the parser,
+# as (role, parser attribute).
+_ROLES = (
+    ("root", "root_tag_class"),
+    ("text", "raw_text_class"),
+    ("newline", "newline_text_class"),
+    ("error", "error_text_class"),
+    ("paragraph", "paragraph_tag_class"),
+)
+
+# Markers for encoded values which aren't stored as themselves
+_REF = 0
+_LIST = 1
+_TUPLE = 2
+_DICT = 3
+
+_PLAIN_TYPES = (bool, int, float, str, bytes)
+
+# Properties CompactTree puts in the state of nodes whose text isn't the
+# source's, for tags and for other nodes.
+_TAG_TEXT_ATTRS = frozenset(["start_text", "end_text"])
+_TEXT_ATTRS = frozenset(["text"])
+
+
+def dump_tree(root_node, parser_cls, source=None):
+    """returns `root_node`, as parsed by `parser_cls`, as bytes which can
+        be loaded with `load_tree`.
+
+        `source` is the text the tree was parsed from, by default that
+        recorded on the tree by the parser.
+        Tags are recorded by `tag_name`, so can only be loaded by a parser
+        with tags of the same names. Attributes of the nodes (attrs etc.)
+        must be made of None, bools, numbers, strings, bytes, lists, tuples,
+        dicts and nodes of the tree, or ValueError is raised.
+
+        The data can only be loaded by the same version of Python (see
+        _HEADER), so anything storing it long term should keep the source
+        text too, to parse again if `load_tree` refuses it.
+    """
+    if source is None:
+        source = _follow_edits(root_node).text
+
+    tree = CompactTree(root_node, source)
+
+    payload = (
+        sys.byteorder,
+        source,
+        [_describe_class(node_cls, parser_cls) for node_cls in tree.classes],
+        [
+            (
+                getattr(tree, name).typecode,
+                zlib.compress(getattr(tree, name).tobytes(), 1),
+            )
+            for name in COLUMNS
+        ],
+        [
+            [(key, _encode(value)) for key, value in state.items()]
+            for state in tree.states
+        ],
+    )
+    body = marshal.dumps(payload)
+    header = _HEADER.pack(
+        FORMAT_VERSION,
+        marshal.version,
+        sys.version_info[0],
+        sys.version_info[1],
+        zlib.crc32(body),
+    )
+    return MAGIC + header + body
+
+
+def load_tree(data, parser_cls):
+    """returns the root node of a tree dumped by `dump_tree`, with its tags
+        taken from `parser_cls`.
+        Raises TreeLoadError if `data` is malformed, was dumped by another
+        version of Python, or has tags which `parser_cls` doesn't have.
+    """
+    if not data.startswith(MAGIC):
+        raise TreeLoadError("not a dumped tree")
+
+    body_start = len(MAGIC) + _HEADER.size
+    if len(data) < body_start:
+        raise TreeLoadError("malformed tree data")
+
+    version, marshal_version, major, minor, crc = _HEADER.unpack_from(
+        data, len(MAGIC)
+    )
+    if version != FORMAT_VERSION:
+        raise TreeLoadError("unknown format version {}".format(version))
+
+    if (marshal_version, major, minor) != (marshal.version,) + sys.version_info[:2]:
+        raise TreeLoadError(
+            "dumped by Python {}.{} (marshal version {})".format(
+                major, minor, marshal_version
+            )
+        )
+
+    body = data[body_start:]
+    if zlib.crc32(body) != crc:
+        raise TreeLoadError("corrupt tree data")
+
+    try:
+        payload = marshal.loads(body)
+        byteorder, source, class_descs, column_data, states = payload
+        columns = {}
+        for name, (typecode, column_bytes) in zip(COLUMNS, column_data):
+            column = columns[name] = array(typecode)
+            column.frombytes(zlib.decompress(column_bytes))
+            if byteorder != sys.byteorder:
+                column.byteswap()
+        states = [
+            dict((key, _decode(value)) for key, value in state) for state in states
+        ]
+    except (
+        EOFError,
+        TypeError,
+        ValueError,
+        KeyError,
+        IndexError,
+        MemoryError,
+        zlib.error,
+    ):
+        raise TreeLoadError("malformed tree data")
+
+    if not isinstance(source, str) or not isinstance(class_descs, list):
+        raise TreeLoadError("malformed tree data")
+
+    tags = _get_all_tags(parser_cls)
+    classes = [_resolve_class(desc, parser_cls, tags) for desc in class_descs]
+    _check_columns(columns, len(source), classes, states)
+
+    tree = CompactTree.from_columns(source, columns, classes, states)
+    try:
+        return tree.node()
+    except TreeLoadError:
+        raise
+    except Exception:
+        # e.g. a reference to a node which doesn't exist, or state which
+        # a node's setters won't take
+        raise TreeLoadError("malformed tree data")
+
+
+def _describe_class(node_cls, parser_cls):
+    for role, attr in _ROLES:
+        if node_cls is getattr(parser_cls, attr, None):
+            return (role,)
+
+    if issubclass(node_cls, BaseTag) and node_cls.tag_name is not None:
+        if node_cls.__dict__.get("null_class") is node_cls:
+            return ("null", node_cls.tag_name)
+        return ("tag", node_cls.tag_name)
+
+    return ("class", node_cls.__module__, node_cls.__qualname__)
+
+
+def _get_all_tags(parser_cls):
+    """returns {tag_name: tag class} for every tag `parser_cls` can parse,
+        including those only allowed within other tags.
+    """
+    tags = {}
+    pending = list(parser_cls.get_tags())
+    while pending:
+        tag_cls = pending.pop()
+        if tags.get(tag_cls.tag_name) is tag_cls:
+            continue
+        tags[tag_cls.tag_name] = tag_cls
+        pending.extend(tag_cls.get_allowed_tags() or ())
+    return tags
+
+
+def _resolve_class(desc, parser_cls, tags):
+    kind = desc[0]
+
+    for role, attr in _ROLES:
+        if kind == role:
+            node_cls = getattr(parser_cls, attr, None)
+            if node_cls is None:
+                raise TreeLoadError("parser has no {}".format(attr))
+            return node_cls
+
+    if kind in ("tag", "null"):
+        try:
+            tag_cls = tags[desc[1]]
+        except KeyError:
+            raise TreeLoadError("parser has no tag {}".format(desc[1]))
+        return tag_cls.null_class if kind == "null" else tag_cls
+
+    if kind == "class":
+        # Only the library's own classes are looked up, so loading data
+        # can't import arbitrary modules.
+        module_name, qualname = desc[1], desc[2]
+        if module_name.split(".")[0] == __name__.split(".")[0]:
+            try:
+                node_cls = importlib.import_module(module_name)
+                for name in qualname.split("."):
+                    node_cls = getattr(node_cls, name)
+            except (ImportError, AttributeError):
+                node_cls = None
+
+            if isinstance(node_cls, type) and issubclass(node_cls, BaseNode):
+                return node_cls
+
+        raise TreeLoadError("unknown node class {}.{}".format(module_name, qualname))
+
+    raise TreeLoadError("unknown node class {!r}".format(desc))
+
+
+def _check_columns(columns, source_length, classes, states):
+    """Make sure the columns describe a tree, in document order, of nodes
+        which can be made from them.
+    """
+    size = len(columns["kinds"])
+    if size == 0 or any(len(column) != size for column in columns.values()):
+        raise TreeLoadError("malformed tree data")
+
+    if (
+        min(columns["class_ids"]) < 0
+        or max(columns["class_ids"]) >= len(classes)
+        or min(columns["state_ids"]) < -1
+        or max(columns["state_ids"]) >= len(states)
+    ):
+        raise TreeLoadError("malformed tree data")
+
+    # Each node's kind must be that of its class
+    kinds = columns["kinds"]
+    class_ids = columns["class_ids"]
+    class_kinds = [
+        TAG_NODE if issubclass(node_cls, BaseTag) else TEXT_NODE
+        for node_cls in classes
+    ]
+    expected_kinds = [class_kinds[class_id] for class_id in class_ids]
+    if array(kinds.typecode, expected_kinds) != kinds:
+        raise TreeLoadError("malformed tree data")
+
+    for start, end in zip(columns["starts"], columns["ends"]):
+        if not (
+            start == end == -1 if start == -1 else 0 <= start <= end <= source_length
+        ):
+            raise TreeLoadError("malformed tree data")
+
+    for class_id, state_id in set(zip(class_ids, columns["state_ids"])):
+        if state_id != -1:
+            node_cls = classes[class_id]
+            _check_state(node_cls, class_kinds[class_id] == TAG_NODE, states[state_id])
+
+    _check_links(
+        columns["parents"], columns["first_children"], columns["next_siblings"]
+    )
+
+
+def _check_links(parents, first_children, next_siblings):
+    """Make sure every node but the root is the child of the parent it
+        names, and no other node.
+    """
+    size = len(parents)
+    if parents[0] != -1:
+        raise TreeLoadError("malformed tree data")
+
+    seen = bytearray(size)
+    seen[0] = 1
+    for index in range(size):
+        if index and not 0 <= parents[index] < index:
+            raise TreeLoadError("malformed tree data")
+
+        # The children of `index`, each after the one before
+        child = first_children[index]
+        previous = index
+        while child != -1:
+            if not previous < child < size or parents[child] != index or seen[child]:
+                raise TreeLoadError("malformed tree data")
+            seen[child] = 1
+            previous = child
+            child = next_siblings[child]
+
+    if not all(seen):
+        raise TreeLoadError("malformed tree data")
+
+
+def _check_state(node_cls, is_tag, state):
+    """Make sure `state` can be set on a node of `node_cls`"""
+    slot_names = get_slot_names(node_cls)
+    has_dict = node_cls.__dictoffset__ != 0
+    text_attrs = _TAG_TEXT_ATTRS if is_tag else _TEXT_ATTRS
+    for key in state:
+        if (
+            not isinstance(key, str)
+            or key.startswith("__")
+            or key in _COLUMN_ATTRS
+            or not (
+                key in slot_names
+                or key in text_attrs
+                # anything else must go in the __dict__, rather than through
+                # a property or the like on the class
+                or has_dict
+                and not hasattr(getattr(node_cls, key, None), "__set__")
+            )
+        ):
+            raise TreeLoadError(
+                "{} can't have attribute {!r}".format(node_cls.__name__, key)
+            )
+
+
+def _encode(value):
+    if value is None or isinstance(value, _PLAIN_TYPES):
+        return value
+    if isinstance(value, NodeRef):
+        return (_REF, value.index)
+    if isinstance(value, list):
+        return (_LIST, [_encode(item) for item in value])
+    if isinstance(value, tuple):
+        return (_TUPLE, [_encode(item) for item in value])
+    if isinstance(value, dict):
+        return (_DICT, [(_encode(key), _encode(val)) for key, val in value.items()])
+
+    raise ValueError("Cannot dump value {!r}".format(value))
+
+
+def _decode(value):
+    if not isinstance(value, tuple):
+        return value
+
+    marker, contents = value
+    if marker == _REF:
+        return NodeRef(contents)
+    if marker == _LIST:
+        return [_decode(item) for item in contents]
+    if marker == _TUPLE:
+        return tuple(_decode(item) for item in contents)
+    if marker == _DICT:
+        return dict((_decode(key), _decode(val)) for key, val in contents)
+
+    raise ValueError("unknown value marker {}".format(marker))
@@ -18,19 +18,204 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import copy
+import heapq
+import sys
+import threading
+import weakref
+from collections import namedtuple
 
 NEWLINE_STR = "\n"
 
+# Size, in characters, of the pieces output is streamed in by `iter_render`
+DEFAULT_CHUNK_SIZE = 8192
+
+# Added by `render_truncated` where the rendering is cut short
+DEFAULT_ELLIPSIS = "\u2026"
+
+# Put between blocks of text by `render_text`
+DEFAULT_BLOCK_SEPARATOR = "\n"
+
+# Most distinct sets of attrs kept for each tag class with `cache_attrs` set
+ATTRS_CACHE_SIZE = 1024
+
+# The result of `BaseTag.parse_attrs`, which can be given to a tag's __init__
+# in place of the attrs, if they've already been parsed.
+ParsedAttrs = namedtuple("ParsedAttrs", ["attrs", "errors"])
+
+
+class _RenderState(threading.local):
+    # {id(tag): context} for the tags being rendered by iter_render_nodes,
+    # with _UNKNOWN for those whose context hasn't been wanted yet.
+    contexts = None
+
+
+_render_state = _RenderState()
+_UNKNOWN = object()
+
+# Held while a node's location is moved along for edits to its source, so
+# that nodes used by more than one thread are only moved once.
+_edits_lock = threading.Lock()
+
+
+def _find_context(tag, contexts):
+    """returns the context of `tag`, working out and keeping in `contexts`
+        those of it and the tags above it which are _UNKNOWN, from the top
+        down so each is got from its parent's.
+    """
+    pending = []
+    node = tag
+    while contexts.get(id(node)) is _UNKNOWN:
+        pending.append(node)
+        node = node._parent_node
+
+    for node in reversed(pending):
+        contexts[id(node)] = node.get_context()
+    return contexts[id(tag)]
+
+
+def _follow_edits(node):
+    """Move the location of `node` along for the edits made to its source
+        since it was last used (see `Source.edited`).
+        returns the source the node is now in.
+    """
+    with _edits_lock:
+        source = node._source
+        start, end = node._start, node._end
+        while source.edit is not None:
+            boundary, delta, source = source.edit
+            if start >= boundary:
+                start += delta
+                end += delta
+            elif end >= boundary:
+                end += delta
+        # The source last, as it's what others check before reading the
+        # location.
+        node._start, node._end = start, end
+        node._source = source
+        return source
+
+
+class Source(object):
+    """The text a tree was parsed from, shared by the tree's nodes so that
+        they needn't keep copies of their own text.
+        When the tree is updated for an edit, the text is moved to a new
+        Source (see `edited`), and each node moves its location into the
+        new text when it's next used, rather than all of them at once.
+    """
+
+    __slots__ = ("text", "edit")
+
+    def __init__(self, text):
+        self.text = text
+        # (boundary, delta, newer Source), once edited
+        self.edit = None
+
+    def __repr__(self):
+        if self.text is None:
+            return "{}(edited)".format(self.__class__.__name__)
+        return "{}({} chars)".format(self.__class__.__name__, len(self.text))
+
+    def edited(self, boundary, delta, text):
+        """returns a new Source for `text`, which is this one's text with
+            `delta` characters inserted (or removed, if negative) just before
+            `boundary`.
+            Locations starting at or after `boundary` are moved by `delta`,
+            those spanning it have their end moved.
+        """
+        source = self.__class__(text)
+        self.edit = (boundary, delta, source)
+        # Nodes don't read from this any more, they're moved to `source`.
+        self.text = None
+        return source
+
 
 class BaseNode(object):
+    # The library's node classes are slotted to keep trees small. Subclasses
+    # which don't define __slots__ themselves get a __dict__ as usual, so
+    # can set whatever attributes they like.
+    # The location is kept as two ints rather than a tuple, to save a
+    # tuple for every node.
+    __slots__ = ("_parent_node", "_start", "_end", "_source", "__weakref__")
+
     def __init__(self):
         self._parent_node = None
+        self._start = self._end = None
+        # The `Source` the location is in, if set by `set_source`.
+        self._source = None
+
+    @property
+    def location(self):
+        """(start, end) of the node in the source text, set by the parser.
+            None for nodes which weren't parsed from source.
+        """
+        if self._start is None:
+            return None
+        if self._source is not None and self._source.edit is not None:
+            _follow_edits(self)
+        return (self._start, self._end)
+
+    @location.setter
+    def location(self, location):
+        if location is None:
+            self._unset_source()
+            self._start = self._end = None
+        else:
+            if self._source is not None and self._source.edit is not None:
+                _follow_edits(self)
+            self._start, self._end = location
 
     def set_parent_node(self, parent_node):
-        self._parent_node = parent_node
+        if parent_node is not self._parent_node:
+            self.invalidate()
+            self._parent_node = parent_node
+            self.invalidate()
+
+    def invalidate(self):
+        """Forget what's kept about this node and the tags containing it:
+            their renderings (see BaseTag.cache_render) and the tags within
+            them (see BaseTag.find_all). This is done by the setters here,
+            but must be called after changing a node in some other way,
+            e.g. adding to a tag's `tree` in place.
+        """
+        if isinstance(self, BaseTag):
+            self._contains = None
+        # A tag's contents are only known if those of the tags within it
+        # are, so we can stop at the first tag whose aren't.
+        node = self._parent_node
+        while isinstance(node, BaseTag) and node._contains is not None:
+            node._contains = None
+            node = node._parent_node
+
+        if not _kept_renders:
+            # no renderings to forget
+            return
+
+        node = self
+        while isinstance(node, BaseNode):
+            if isinstance(node, BaseTag):
+                node._render_cache = None
+            node = node._parent_node
+
+    def set_source(self, source, location):
+        """Set the `location` of the node within `source` (a `Source`)"""
+        self._source = source
+        self._start, self._end = location
+
+    def _unset_source(self):
+        """Stop following the source, keeping the location as it is"""
+        self._source = None
 
     def get_context(self):
         if self._parent_node:
+            # While it's being rendered, the parent's context is kept.
+            contexts = _render_state.contexts
+            if contexts:
+                ctx = contexts.get(id(self._parent_node))
+                if ctx is _UNKNOWN:
+                    ctx = _find_context(self._parent_node, contexts)
+                if ctx is not None:
+                    return ctx
             return self._parent_node.get_context()
         return {}
 
@@ -42,9 +227,47 @@ class BaseNode(object):
 
 
 class BaseText(BaseNode):
+    __slots__ = ("_text",)
+
     def __init__(self, text):
         super(BaseText, self).__init__()
-        self.text = text
+        # None when the text is sliced from `_source` at `location` on use.
+        self._text = text
+
+    @property
+    def text(self):
+        text = self._text
+        if text is not None:
+            return text
+        source = self._source
+        if source.edit is not None:
+            source = _follow_edits(self)
+        return source.text[self._start : self._end]
+
+    @text.setter
+    def text(self, text):
+        self._text = text
+        self.invalidate()
+
+    def set_source(self, source, location):
+        """Set the `location` of the node within `source` (a `Source`).
+            If the node's text is what's found there, the node takes its
+            text from `source` rather than keeping its own copy.
+        """
+        text = self.text
+        self._source = source
+        self._start, self._end = location
+        start, end = location
+        if end - start == len(text) and source.text.startswith(text, start):
+            self._text = None
+        else:
+            self._text = text
+
+    def _unset_source(self):
+        """Go back to keeping a copy of the text"""
+        if self._source is not None:
+            self._text = self.text
+            self._source = None
 
     def __eq__(self, other):
         return self.__class__ == other.__class__ and self.text == other.text
@@ -64,10 +287,12 @@ class RawText(BaseText):
         handles escaping html within the text.
     """
 
-    pass
+    __slots__ = ()
 
 
 class NewlineText(BaseText):
+    __slots__ = ("count",)
+
     DOUBLE_NEWLINE = NEWLINE_STR * 2
 
     def __init__(self, *args, **kwargs):
@@ -77,9 +302,21 @@ class NewlineText(BaseText):
     def __eq__(self, other):
         return self.__class__ == other.__class__ and self.text == other.text
 
-    def add_newline(self, text):
+    def add_newline(self, text, location=None):
+        """`location` is the location of `text` in the source"""
         self.count += 1
+        if (
+            self._text is None
+            and location is not None
+            and location[0] == self._end
+        ):
+            # Still one run of the source text
+            self._end = location[1]
+            return
+
         self.text += text
+        if location is not None and self._start is not None:
+            self._end = location[1]
 
     def _render(self):
         return NEWLINE_STR if self.count == 1 else self.DOUBLE_NEWLINE
@@ -90,6 +327,8 @@ class ErrorText(BaseText):
         handles escaping html within the text.
     """
 
+    __slots__ = ("reason",)
+
     def __init__(self, text, reason=None):
         """`text` - the invalid text from the markup source
             `reason` - why the source text was considered invalid
@@ -103,35 +342,103 @@ class ErrorText(BaseText):
         )
 
 
+def set_template_parts(tag_cls):
+    """Set `_template_parts` on tag classes with a `template` and
+        `replace_text`: the template split at each `replace_text`, so that
+        the tag renders as its rendered children joined by them.
+        ("", "") if the template is None (just the children), None if
+        there's no `replace_text` to split at or they aren't plain strings
+        (e.g. properties).
+    """
+    if not (hasattr(tag_cls, "template") and hasattr(tag_cls, "replace_text")):
+        return
+
+    template = tag_cls.template
+    replace_text = tag_cls.replace_text
+    if template is None:
+        parts = ("", "")
+    elif isinstance(template, str) and isinstance(replace_text, str) and replace_text:
+        parts = tuple(template.split(replace_text))
+    else:
+        parts = None
+    # (not through __setattr__, which would bring us back here)
+    type.__setattr__(tag_cls, "_template_parts", parts)
+
+
+# Tables of {node class: how it renders}, worked out on first use (see
+# register_render_table)
+_render_tables = []
+
+# Attributes which, when changed on a tag class, change how it renders.
+_RENDER_CLASS_ATTRS = frozenset(
+    [
+        "render",
+        "_render",
+        "render_children",
+        "_get_render_parts",
+        "render_raw",
+        "cache_render",
+        "template",
+        "replace_text",
+        "trim_whitespace",
+    ]
+)
+
+
+def register_render_table(table):
+    """Have the entries of `table`, a dict of {node class: how it renders},
+        dropped for a tag class (and its subclasses) whenever an attribute
+        deciding how it renders is set on or deleted from it.
+        returns `table`
+    """
+    _render_tables.append(table)
+    return table
+
+
+def _tag_cls_changed(cls, name):
+    """Update what's kept about `cls`, and its subclasses which may have
+        been using it, for its attribute `name` having been set or deleted.
+    """
+    if name == "allowed_tags":
+        TagCategory._changes += 1
+    if name not in _RENDER_CLASS_ATTRS:
+        return
+    stack = [cls]
+    while stack:
+        tag_cls = stack.pop()
+        if name in ("template", "replace_text"):
+            set_template_parts(tag_cls)
+        for table in _render_tables:
+            table.pop(tag_cls, None)
+        stack.extend(tag_cls.__subclasses__())
+
+
 class BaseTagMeta(type):
     def __new__(cls, name, bases, ctx):
         new_cls = super(BaseTagMeta, cls).__new__(cls, name, bases, ctx)
 
         cls.validate_tag_cls(new_cls)
+        set_template_parts(new_cls)
 
         if new_cls.tag_name is not None:
-
-            def render(self):
-                return self.render_children()
-
-            # We force this to be a string as python2 internals does not like
-            # unicode class names.
-            null_name = str("Null{}".format(name))
+            # The null class is only made if it's wanted (see _NullClass)
             null_ctx = dict(ctx)
             null_ctx.pop("__classcell__", None)
-            null_ctx["render"] = render
-            new_null_cls = super(BaseTagMeta, cls).__new__(
-                cls, null_name, bases, null_ctx
-            )
-
-            new_cls.null_class = new_null_cls
-            new_null_cls.null_class = new_null_cls
+            type.__setattr__(new_cls, "_null_spec_cache", (name, bases, null_ctx))
 
             for category in new_cls.tag_categories:
                 category.add_tag_cls(new_cls)
 
         return new_cls
 
+    def __setattr__(cls, name, value):
+        super(BaseTagMeta, cls).__setattr__(name, value)
+        _tag_cls_changed(cls, name)
+
+    def __delattr__(cls, name):
+        super(BaseTagMeta, cls).__delattr__(name)
+        _tag_cls_changed(cls, name)
+
     @staticmethod
     def validate_tag_cls(tag_cls):
         # TODO `close_on_newline` vs `self_closing`
@@ -141,15 +448,83 @@ class BaseTagMeta(type):
         pass
 
 
+class _NullClass(object):
+    """The `null_class` of tag classes: a class made from the same class
+        body, but which renders only its children, for tags found where
+        they aren't allowed. Made on first use, as most are never needed.
+    """
+
+    def __get__(self, instance, owner):
+        null_cls = owner.__dict__.get("_null_class_cache")
+        if null_cls is None:
+            null_cls = _make_null_class(owner)
+        return null_cls
+
+
+def _null_render(self):
+    return self.render_children()
+
+
+def _null_get_render_parts(self):
+    return ("", "", False)
+
+
+def _null_get_plain_text(self):
+    return None
+
+
+_null_class_lock = threading.Lock()
+
+
+def _make_null_class(tag_cls):
+    with _null_class_lock:
+        null_cls = tag_cls.__dict__.get("_null_class_cache")
+        if null_cls is not None:
+            return null_cls
+
+        spec = tag_cls.__dict__.get("_null_spec_cache")
+        if spec is None:
+            raise AttributeError("{} has no null_class".format(tag_cls.__name__))
+        name, bases, ctx = spec
+
+        # We force this to be a string as python2 internals does not like
+        # unicode class names.
+        null_name = str("Null{}".format(name))
+        null_ctx = dict(ctx)
+        null_ctx["render"] = _null_render
+        # Rendering by parts skips render_children, so only when it is
+        # not overridden (the null class has the same one as `tag_cls`).
+        if tag_cls.render_children is BaseTag.render_children:
+            null_ctx["_get_render_parts"] = _null_get_render_parts
+        null_ctx["get_plain_text"] = _null_get_plain_text
+        null_ctx["text_block"] = False
+        # Made as by BaseTagMeta's type.__new__, so without the rest of
+        # BaseTagMeta.__new__ (e.g. joining tag categories).
+        null_cls = type.__new__(type(tag_cls), null_name, bases, null_ctx)
+        null_cls.null_class = null_cls
+        set_template_parts(null_cls)
+
+        type.__setattr__(tag_cls, "_null_class_cache", null_cls)
+        type.__delattr__(tag_cls, "_null_spec_cache")
+        return null_cls
+
+
 class TagCategory(object):
     """A TagCategory is for holding a collection of tags.
         the `category_name` is for informational purposes
         only.
     """
 
+    # Incremented whenever any category's tags (or any tag class's
+    # `allowed_tags`) change, so that anything built from them (e.g. a
+    # parser's TagTable) knows to rebuild.
+    _changes = 0
+
     def __init__(self, category_name):
         self.category_name = category_name
         self.tag_classes = set()
+        # {tag_name: tag class}, for finding clashes
+        self._tag_names = {}
 
     def __repr__(self):
         return "{}({}: {})".format(
@@ -161,15 +536,17 @@ class TagCategory(object):
             (returns `tag_cls` so could be used as a class decorator)
         """
         assert issubclass(tag_cls, BaseTag)
-        for curr_tag_cls in self.tag_classes:
-            if curr_tag_cls.tag_name == tag_cls.tag_name:
-                raise ValueError(
-                    "Cannot add {tag_cls} to tag category"
-                    " '{self}' as name '{tag_cls.tag_name}'"
-                    " clashes with tag {curr_tag_cls}.".format(**locals())
-                )
+        curr_tag_cls = self._tag_names.get(tag_cls.tag_name)
+        if curr_tag_cls in self.tag_classes:
+            raise ValueError(
+                "Cannot add {tag_cls} to tag category"
+                " '{self}' as name '{tag_cls.tag_name}'"
+                " clashes with tag {curr_tag_cls}.".format(**locals())
+            )
 
         self.tag_classes.add(tag_cls)
+        self._tag_names[tag_cls.tag_name] = tag_cls
+        TagCategory._changes += 1
 
         return tag_cls
 
@@ -184,6 +561,10 @@ class TagCategory(object):
             self.tag_classes.remove(tag_cls)
         except KeyError:
             pass
+        else:
+            if self._tag_names.get(tag_cls.tag_name) is tag_cls:
+                del self._tag_names[tag_cls.tag_name]
+            TagCategory._changes += 1
 
     __call__ = add_tag_cls
 
@@ -262,6 +643,16 @@ class BaseTag(BaseNode, metaclass=BaseTagMeta):
             rendered version of the text.
     """
 
+    __slots__ = (
+        "_tree",
+        "_start_text",
+        "_end_text",
+        "attrs",
+        "errors",
+        "_render_cache",
+        "_contains",
+    )
+
     tag_name = None
 
     close_on_newline = False
@@ -272,6 +663,22 @@ class BaseTag(BaseNode, metaclass=BaseTagMeta):
 
     attr_defs = {}
 
+    # Set to True to keep the parsed attrs of tags of this class, so that
+    # the attr parsers are run once for each distinct set of attrs. (Only
+    # for attr parsers which always give the same result for a value.)
+    cache_attrs = False
+
+    # Set to True to keep the rendering of tags of this class, which is
+    # reused while they're rendered in the same context and neither they
+    # nor anything within them has been changed.
+    cache_render = False
+
+    null_class = _NullClass()
+
+    # Whether the text of these tags is kept apart from the text around it
+    # by `render_text` (e.g. for paragraphs).
+    text_block = False
+
     def __init__(self, attrs, tree, start_text, end_text):
         """These classes should not be initialized directly
             (are initialized by the parser).
@@ -279,16 +686,100 @@ class BaseTag(BaseNode, metaclass=BaseTagMeta):
         assert self.self_closing is False or len(tree) == 0
         assert self.self_closing is False or end_text == ""
         super(BaseTag, self).__init__()
-        self.tree = tree
-        self.start_text = start_text
-        self.end_text = end_text
-
-        self.attrs, self.errors = self.parse_attrs(attrs)
+        self._render_cache = None
+        # bits (see `tag_bit`) of the tags this is or contains, or None if
+        # not worked out since the tree was last changed.
+        self._contains = None
+        self._tree = tree
+        # When these are ints, they're the lengths of the start and end
+        # text, which are sliced from `_source` at `location` on use.
+        self._start_text = start_text
+        self._end_text = end_text
+
+        if not isinstance(attrs, ParsedAttrs):
+            attrs = self.get_parsed_attrs(attrs)
+        self.attrs, self.errors = attrs
 
         for node in self.tree:
             if isinstance(node, BaseNode):
                 node.set_parent_node(self)
 
+    @property
+    def tree(self):
+        return self._tree
+
+    @tree.setter
+    def tree(self, tree):
+        self._tree = tree
+        self.invalidate()
+
+    @property
+    def start_text(self):
+        start_text = self._start_text
+        if not isinstance(start_text, int):
+            return start_text
+        source = self._source
+        if source.edit is not None:
+            source = _follow_edits(self)
+        start = self._start
+        return source.text[start : start + start_text]
+
+    @start_text.setter
+    def start_text(self, text):
+        self._keep_texts()
+        self._start_text = text
+        self.invalidate()
+
+    @property
+    def end_text(self):
+        end_text = self._end_text
+        if not isinstance(end_text, int):
+            return end_text
+        source = self._source
+        if source.edit is not None:
+            source = _follow_edits(self)
+        end = self._end
+        return source.text[end - end_text : end]
+
+    @end_text.setter
+    def end_text(self, text):
+        self._keep_texts()
+        self._end_text = text
+        self.invalidate()
+
+    def set_source(self, source, location):
+        """Set the `location` of the tag within `source` (a `Source`).
+            If the tag's start and end text are what's found there, the tag
+            takes them from `source` rather than keeping its own copies.
+        """
+        start_text, end_text = self.start_text, self.end_text
+        self._source = source
+        self._start, self._end = location
+
+        start, end = location
+        if (
+            start + len(start_text) <= end - len(end_text)
+            and source.text.startswith(start_text, start)
+            and source.text.startswith(end_text, end - len(end_text))
+        ):
+            self._start_text = len(start_text)
+            self._end_text = len(end_text)
+        else:
+            self._start_text, self._end_text = start_text, end_text
+
+    def _keep_texts(self):
+        """Keep copies of the start and end text, rather than taking them
+            from the source
+        """
+        if isinstance(self._start_text, int):
+            self._start_text, self._end_text = self.start_text, self.end_text
+
+    def _unset_source(self):
+        """Go back to keeping copies of the start and end text"""
+        if self._source is not None:
+            self._keep_texts()
+            self._source = None
+
     def __eq__(self, other):
         return (
             self.__class__ == other.__class__
@@ -361,11 +852,18 @@ class BaseTag(BaseNode, metaclass=BaseTagMeta):
 
         if len(items) > 1:
             # Too many, use `index` from `items` to find bad children,
-            # and replace with ErrorText
+            # and replace with ErrorText. The tree is replaced as a whole
+            # rather than modified in place so that another thread
+            # rendering this tag never sees it half updated.
+            tree = list(self.tree)
             for index, child in items[:-1]:
-                self.tree[index] = ErrorText(
+                error = ErrorText(
                     child.render_raw(), reason="Extra {} tag".format(child.tag_name)
                 )
+                error.location = child.location
+                error.set_parent_node(self)
+                tree[index] = error
+            self.tree = tree
 
         # Return the last defined
         return items[-1][1]
@@ -374,16 +872,120 @@ class BaseTag(BaseNode, metaclass=BaseTagMeta):
         """Iterate and yield through each child of the tree and recursively
             iterate through their children.
         """
-        for child in self.tree:
-            yield child
-            if isinstance(child, BaseTag):
-                for smaller_child in child.walk_tree():
-                    yield smaller_child
+        stack = [iter(self.tree)]
+        while stack:
+            for child in stack[-1]:
+                yield child
+                if isinstance(child, BaseTag):
+                    stack.append(iter(child.tree))
+                    break
+            else:
+                stack.pop()
+
+    def find_all(self, tag):
+        """returns a list of the tags within this one (at any depth) which
+            are instances of `tag` (a tag class), or have `tag` (a string)
+            as their tag_name, in the order they're found in the text.
+        """
+        self._get_contains()
+        mask = tag_mask(tag)
+        found = []
+        stack = [iter(self.tree)]
+        while stack:
+            for child in stack[-1]:
+                # skip anything not containing any matching tags
+                if isinstance(child, BaseTag) and child._contains & mask:
+                    if _tag_matches(type(child), tag):
+                        found.append(child)
+                    stack.append(iter(child.tree))
+                    break
+            else:
+                stack.pop()
+
+        return found
+
+    def contains_tag(self, tag):
+        """returns whether there are any tags matching `tag` (as for
+            `find_all`) within this one.
+        """
+        self._get_contains()
+        mask = tag_mask(tag)
+        return any(
+            isinstance(child, BaseTag) and child._contains & mask
+            for child in self.tree
+        )
+
+    def _get_contains(self):
+        """returns the bits (see `tag_bit`) of the tags this is or contains"""
+        if self._contains is None:
+            _find_contains(self)
+        return self._contains
 
     def render_children(self):
         """Return the rendering of child tags/text
         """
-        return "".join(child.render() for child in self.tree)
+        return render_nodes(self.tree)
+
+    def render_cached(self):
+        """returns `render()`, reusing this tag's last rendering if it was
+            rendered in the same context (see `cache_render`).
+        """
+        key = _freeze_context(self.get_context())
+        cached = self._render_cache
+        if cached is not None and key is not None and cached[0] == key:
+            return cached[1]
+
+        text = self.render()
+        if key is not None:
+            global _kept_renders
+            _kept_renders = True
+            self._render_cache = (key, text)
+        return text
+
+    def iter_render(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """yields the rendering of this tag in pieces of around
+            `chunk_size` characters, so it can be sent on as it's rendered.
+        """
+        return iter_render_nodes([self], chunk_size)
+
+    def render_to(self, fp, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Write the rendering of this tag to `fp` (anything with a
+            `write` taking text), `chunk_size` characters at a time.
+        """
+        for chunk in self.iter_render(chunk_size):
+            fp.write(chunk)
+
+    def render_text(self, block_separator=DEFAULT_BLOCK_SEPARATOR):
+        """returns the text of this tag, and those within it, as plain
+            text (see `render_nodes_text`).
+        """
+        return render_nodes_text([self], block_separator)
+
+    def get_plain_text(self):
+        """returns the text this tag gives to `render_text` in place of
+            that of its children (e.g. an image's alt text), or None to
+            use its children's.
+        """
+        return None
+
+    def render_truncated(self, max_chars, ellipsis=DEFAULT_ELLIPSIS):
+        """returns the rendering of this tag, cut short with `ellipsis`
+            after `max_chars` characters of text (see
+            `render_nodes_truncated`), e.g. for excerpts.
+        """
+        return render_nodes_truncated([self], max_chars, ellipsis)
+
+    def _get_render_parts(self):
+        """For tags which render as some text, followed by their rendered
+            children, followed by some more text, returns a tuple of
+            (text before, text after, whether to strip the whole), so that
+            the tag can be rendered without a call to `render`.
+            returns None for tags which need `render` to be called.
+
+            Only used if `render`, `_render` and `render_children` aren't
+            overridden below the class defining `_get_render_parts`.
+        """
+        return None
 
     def _render(self):
         raise NotImplementedError
@@ -399,6 +1001,29 @@ class BaseTag(BaseNode, metaclass=BaseTagMeta):
         """
         return "".join(child.render_raw() for child in self.tree)
 
+    @classmethod
+    def get_parsed_attrs(cls, attrs):
+        """returns `parse_attrs(attrs)` as a ParsedAttrs, reusing the result
+            for the same attrs if `cache_attrs` is set.
+        """
+        if not cls.cache_attrs:
+            return ParsedAttrs(*cls.parse_attrs(attrs))
+
+        cache = cls.__dict__.get("_parsed_attrs_cache")
+        if cache is None:
+            cache = cls._parsed_attrs_cache = {}
+
+        key = tuple(attrs)
+        try:
+            parsed_attrs, errors = cache[key]
+        except KeyError:
+            if len(cache) >= ATTRS_CACHE_SIZE:
+                cache.clear()
+            parsed_attrs, errors = cache[key] = cls.parse_attrs(attrs)
+
+        # copies, as tags are free to change their own
+        return ParsedAttrs(dict(parsed_attrs), list(errors))
+
     @classmethod
     def parse_attrs(cls, attrs):
         parsed_attrs = {}
@@ -443,11 +1068,38 @@ class BaseTag(BaseNode, metaclass=BaseTagMeta):
 
 
 class RootTag(BaseTag):
+    # (list of the tags within the root in order, {tag class: [indexes
+    #   in that list of those tags]}), made when `_contains` is worked out.
+    __slots__ = ("_index",)
+
+    def _get_contains(self):
+        if self._contains is None:
+            _find_contains(self)
+            self._index = _make_index(self)
+        return self._contains
+
+    def find_all(self, tag):
+        self._get_contains()
+        tags, positions = self._index
+        found = [
+            tag_positions
+            for tag_cls, tag_positions in positions.items()
+            if _tag_matches(tag_cls, tag)
+        ]
+        if len(found) == 1:
+            return [tags[position] for position in found[0]]
+        return [tags[position] for position in heapq.merge(*found)]
+
     def _render(self, ctx=None):
         return self.render_children()
 
+    def _get_render_parts(self):
+        return ("", "", False)
+
 
 class SimpleTag(BaseTag):
+    __slots__ = ()
+
     # use one '{{ body }}' to be replaced with the contents
     # of the items children
     # e.g. "<awesometext>{{ body }}</awesometext>"
@@ -455,10 +1107,491 @@ class SimpleTag(BaseTag):
     replace_text = "{{ body }}"
 
     def _render(self):
-        if self.template is None:
-            return self.render_children()
+        return render_template(self)
+
+    def _get_render_parts(self):
+        parts = get_template_parts(self)
+        if parts is None or len(parts) != 2:
+            return None
+        return (parts[0], parts[1], False)
+
+
+def get_template_parts(tag):
+    """returns the `_template_parts` of `tag`'s class (see
+        set_template_parts), or None if `tag` has its own `template` or
+        `replace_text`.
+    """
+    instance_attrs = getattr(tag, "__dict__", None)
+    if instance_attrs and (
+        "template" in instance_attrs or "replace_text" in instance_attrs
+    ):
+        return None
+    return tag._template_parts
+
+
+def render_template(tag):
+    """returns the rendering of a tag with a `template` (see SimpleTag)"""
+    parts = get_template_parts(tag)
+    if parts is None:
+        return tag.template.replace(tag.replace_text, tag.render_children())
+    if len(parts) == 1:
+        # The children have nowhere to go
+        return parts[0]
+    return tag.render_children().join(parts)
+
+
+def render_nodes(nodes):
+    """returns the rendering of each of `nodes`, joined."""
+    return "".join(iter_render_nodes(nodes))
+
+
+def iter_render_nodes(nodes, chunk_size=None):
+    """yields the rendering of each of `nodes`, in pieces of at least
+        `chunk_size` characters (bar the last), or all at once if it's None.
+
+        Tags which can say how they render (see BaseTag._get_render_parts)
+        are rendered here, walking the tree with a stack and adding their
+        text to a single buffer. Anything else is rendered by its `render`
+        (or `render_cached` for tags with `cache_render` set).
+
+        Each tag's context is worked out at most once, when first wanted,
+        and handed to what's within it through `get_context` until it's
+        been rendered.
+    """
+    if chunk_size is None:
+        chunk_size = sys.maxsize
+
+    outer_contexts = _render_state.contexts
+    # Renders started from within this one (e.g. by a tag's `render`) add
+    # to the same contexts.
+    contexts = {} if outer_contexts is None else outer_contexts
+    _render_state.contexts = contexts
+
+    out = []
+    size = 0
+    # number of open tags whose output is to be stripped
+    trimming = 0
+    # [(id of the tag, iterator over its children, text after them,
+    #   start of the tag's output in `out` if it's to be stripped)]
+    stack = [(None, iter(nodes), "", None)]
+
+    try:
+        while stack:
+            key, children, suffix, mark = stack[-1]
+            for node in children:
+                kind = get_render_kind(type(node))
+                if kind is RENDER:
+                    text = node.render()
+                    parts = None
+                else:
+                    node_key = id(node)
+                    contexts[node_key] = _UNKNOWN
+                    if kind is RENDER_PARTS:
+                        parts = node._get_render_parts()
+                    else:
+                        parts = None
+
+                    if parts is None:
+                        if kind is RENDER_CACHED:
+                            text = node.render_cached()
+                        else:
+                            text = node.render()
+                        del contexts[node_key]
+
+                    else:
+                        text, child_suffix, trim = parts
+                        child_mark = None
+                        if trim:
+                            child_mark = len(out)
+                            trimming += 1
+                        stack.append(
+                            (node_key, iter(node.tree), child_suffix, child_mark)
+                        )
+
+                out.append(text)
+                size += len(text)
+                # carry on from the stack, with the new tag or a full chunk
+                if parts is not None or size >= chunk_size:
+                    break
+
+            else:
+                stack.pop()
+                out.append(suffix)
+                size += len(suffix)
+                if key is not None:
+                    del contexts[key]
+                if mark is not None:
+                    text = "".join(out[mark:]).strip()
+                    del out[mark:]
+                    out.append(text)
+                    trimming -= 1
+
+            if size >= chunk_size and not trimming:
+                _render_state.contexts = outer_contexts
+                yield "".join(out)
+                _render_state.contexts = contexts
+                out = []
+                size = 0
+
+        _render_state.contexts = outer_contexts
+        text = "".join(out)
+        if text:
+            yield text
+
+    finally:
+        # Only put back if this generator is running, rather than being
+        # closed between chunks.
+        if _render_state.contexts is contexts:
+            _render_state.contexts = outer_contexts
+
+
+def render_nodes_truncated(nodes, max_chars, ellipsis=DEFAULT_ELLIPSIS):
+    """returns the rendering of each of `nodes`, joined, cut short once
+        `max_chars` characters of their text have been rendered. If it's cut
+        short, `ellipsis` is added where it was cut, and the tags open at
+        that point are closed. Nothing after that point is rendered.
+
+        Text is counted as it is in the tree (e.g. before HTML escaping).
+        Tags rendered from their parts (see BaseTag._get_render_parts) may
+        be cut within, anything else is rendered whole if all the text
+        within it fits, and is otherwise left out.
+    """
+    outer_contexts = _render_state.contexts
+    contexts = {} if outer_contexts is None else outer_contexts
+    _render_state.contexts = contexts
+
+    out = []
+    budget = max_chars
+    truncated = False
+    # as for iter_render_nodes
+    stack = [(None, iter(nodes), "", None)]
+
+    def close():
+        key, children, suffix, mark = stack.pop()
+        out.append(suffix)
+        if key is not None:
+            del contexts[key]
+        if mark is not None:
+            text = "".join(out[mark:]).strip()
+            del out[mark:]
+            out.append(text)
+
+    try:
+        while stack and not truncated:
+            key, children, suffix, mark = stack[-1]
+            for node in children:
+                kind = get_render_kind(type(node))
+                if kind is RENDER:
+                    length = _text_length(node)
+                    if length > budget:
+                        out.append(_render_text_prefix(node, budget))
+                        truncated = True
+                        break
+                    text = node.render()
+                    parts = None
+
+                else:
+                    node_key = id(node)
+                    contexts[node_key] = _UNKNOWN
+                    if kind is RENDER_PARTS:
+                        parts = node._get_render_parts()
+                    else:
+                        parts = None
+
+                    if parts is None:
+                        length = _text_length(node)
+                        if length > budget:
+                            del contexts[node_key]
+                            truncated = True
+                            break
+                        if kind is RENDER_CACHED:
+                            text = node.render_cached()
+                        else:
+                            text = node.render()
+                        del contexts[node_key]
+
+                    else:
+                        length = 0
+                        text, child_suffix, trim = parts
+                        child_mark = len(out) if trim else None
+                        stack.append(
+                            (node_key, iter(node.tree), child_suffix, child_mark)
+                        )
+
+                out.append(text)
+                budget -= length
+                if parts is not None:
+                    break
+
+            else:
+                close()
+
+        if truncated:
+            out.append(ellipsis)
+            while stack:
+                close()
+
+    finally:
+        _render_state.contexts = outer_contexts
+
+    return "".join(out)
+
+
+def _text_length(node):
+    """returns the number of characters of text in `node`"""
+    if isinstance(node, BaseText):
+        return len(node.text)
+    if isinstance(node, BaseTag):
+        return sum(
+            len(child.text)
+            for child in node.walk_tree()
+            if isinstance(child, BaseText)
+        )
+    return 0
+
+
+def _render_text_prefix(node, max_chars):
+    """returns the rendering of the first `max_chars` characters of the
+        text of `node`, or nothing if the node can't be cut.
+    """
+    if max_chars <= 0 or not isinstance(node, BaseText):
+        return ""
+    if isinstance(node, NewlineText):
+        # newlines count for nothing less than all of them
+        return ""
+
+    cut = copy.copy(node)
+    cut._text = node.text[:max_chars]
+    return cut.render()
+
+
+def render_nodes_text(nodes, block_separator=DEFAULT_BLOCK_SEPARATOR):
+    """returns the text of each of `nodes` as plain text (e.g. for search
+        indexing), without rendering them: there's no templating, escaping
+        or anything else done by the tags' `render`.
+
+        Runs of whitespace are made single spaces, and blocks of text
+        (tags with `text_block` set, and text between double newlines) are
+        joined with `block_separator` instead. A tag's children give its
+        text, unless it has other text to give (see BaseTag.get_plain_text).
+    """
+    blocks = []
+    block = []
+
+    def end_block():
+        text = " ".join("".join(block).split())
+        if text:
+            blocks.append(text)
+        del block[:]
+
+    # [(iterator over a tag's children, whether the tag is a block)]
+    stack = [(iter(nodes), False)]
+    while stack:
+        children, is_block = stack[-1]
+        for node in children:
+            if isinstance(node, BaseTag):
+                if node.text_block:
+                    end_block()
+                text = node.get_plain_text()
+                if text is None:
+                    stack.append((iter(node.tree), node.text_block))
+                    break
+                block.append(text)
+                if node.text_block:
+                    end_block()
+
+            elif isinstance(node, NewlineText) and node.count > 1:
+                end_block()
+
+            elif isinstance(node, BaseText):
+                block.append(node.text)
+
+        else:
+            stack.pop()
+            if is_block:
+                end_block()
 
-        return self.template.replace(self.replace_text, self.render_children())
+    end_block()
+    return block_separator.join(blocks)
+
+
+# Set once any tag has kept its rendering, until when there's no need to go
+# through the tree forgetting them.
+_kept_renders = False
+
+
+def _freeze_context(ctx):
+    """returns a hashable copy of the context `ctx`, or None if it has
+        values which can't be hashed.
+    """
+    try:
+        return frozenset(ctx.items())
+    except TypeError:
+        return None
+
+
+# How iter_render_nodes renders nodes of a class:
+# by calling `render` (nodes other than tags),
+RENDER = 1
+# by calling `render` (tags),
+RENDER_TAG = 2
+# from `_get_render_parts`, rendering the tag's children in turn,
+RENDER_PARTS = 3
+# or by calling `render_cached`.
+RENDER_CACHED = 4
+
+_render_kinds = register_render_table({})
+
+# Methods which, if overridden, mean `_get_render_parts` can't be used.
+_RENDER_METHODS = ("render", "_render", "render_children")
+
+
+def get_render_kind(node_cls):
+    """returns how nodes of `node_cls` are rendered by iter_render_nodes"""
+    try:
+        return _render_kinds[node_cls]
+    except KeyError:
+        kind = _render_kinds[node_cls] = _find_render_kind(node_cls)
+        return kind
+
+
+def _find_render_kind(node_cls):
+    if not issubclass(node_cls, BaseTag):
+        return RENDER
+
+    if node_cls.cache_render:
+        return RENDER_CACHED
+
+    defining_cls = next(
+        klass for klass in node_cls.__mro__ if "_get_render_parts" in vars(klass)
+    )
+    if all(
+        getattr(node_cls, name) is getattr(defining_cls, name)
+        for name in _RENDER_METHODS
+    ):
+        return RENDER_PARTS
+
+    return RENDER_TAG
+
+
+# Each tag class is given a bit of its own (kept on the class as
+# `_tag_bit_cache`), for sets of tag classes held as ints. Classes are only
+# weakly referenced here, and the bits of those which are garbage collected
+# are given out again.
+_tag_bit_lock = threading.Lock()
+# {bit: weakref to the tag class with it}
+_tag_bit_classes = {}
+# heap of bits to give out again
+_free_tag_bits = []
+# bits of collected classes, not yet in _free_tag_bits
+_dead_tag_bits = []
+# Changed whenever bits are given out, so masks are worked out again.
+_tag_bits_version = 0
+# {tag name: (_tag_bits_version at the time, mask)}
+_tag_name_masks = {}
+# {tag class: (_tag_bits_version at the time, mask)}
+_tag_class_masks = weakref.WeakKeyDictionary()
+
+
+def tag_bit(tag_cls):
+    """returns the bit standing for `tag_cls` in `BaseTag._contains`"""
+    bit = tag_cls.__dict__.get("_tag_bit_cache")
+    if bit is None:
+        bit = _new_tag_bit(tag_cls)
+    return bit
+
+
+def _new_tag_bit(tag_cls):
+    global _tag_bits_version
+    with _tag_bit_lock:
+        bit = tag_cls.__dict__.get("_tag_bit_cache")
+        if bit is not None:
+            return bit
+
+        while _dead_tag_bits:
+            dead_bit = _dead_tag_bits.pop()
+            del _tag_bit_classes[dead_bit]
+            heapq.heappush(_free_tag_bits, dead_bit)
+
+        if _free_tag_bits:
+            # the lowest, to keep masks small
+            bit = heapq.heappop(_free_tag_bits)
+        else:
+            bit = 1 << len(_tag_bit_classes)
+        # (the callback may be called mid way through this, so only adds
+        # the bit to be freed next time)
+        _tag_bit_classes[bit] = weakref.ref(
+            tag_cls, lambda ref, bit=bit: _dead_tag_bits.append(bit)
+        )
+        type.__setattr__(tag_cls, "_tag_bit_cache", bit)
+        _tag_bits_version += 1
+        return bit
+
+
+def tag_mask(tag):
+    """returns the bits of the tag classes matching `tag` (see `find_all`)
+        of those which have been given bits so far.
+    """
+    version = _tag_bits_version
+    masks = _tag_name_masks if isinstance(tag, str) else _tag_class_masks
+    try:
+        seen_version, mask = masks[tag]
+        if seen_version == version:
+            return mask
+    except KeyError:
+        pass
+
+    mask = 0
+    for bit, ref in list(_tag_bit_classes.items()):
+        tag_cls = ref()
+        if tag_cls is not None and _tag_matches(tag_cls, tag):
+            mask |= bit
+    masks[tag] = (version, mask)
+    return mask
+
+
+def _tag_matches(tag_cls, tag):
+    if isinstance(tag, str):
+        return tag_cls.tag_name == tag
+    return issubclass(tag_cls, tag)
+
+
+def _find_contains(tag):
+    """Work out `_contains` for `tag` and the tags within it"""
+    # tags whose `_contains` isn't known, parents before their children
+    unknown = []
+    stack = [tag]
+    while stack:
+        node = stack.pop()
+        unknown.append(node)
+        stack.extend(
+            child
+            for child in node.tree
+            if isinstance(child, BaseTag) and child._contains is None
+        )
+
+    bits = {}
+    for node in reversed(unknown):
+        node_cls = type(node)
+        try:
+            contains = bits[node_cls]
+        except KeyError:
+            contains = bits[node_cls] = tag_bit(node_cls)
+        for child in node.tree:
+            if isinstance(child, BaseTag):
+                contains |= child._contains
+        node._contains = contains
+
+
+def _make_index(tag):
+    """returns (list of the tags within `tag` in order, {tag class:
+        [indexes in that list of those tags]})
+    """
+    tags = [node for node in tag.walk_tree() if isinstance(node, BaseTag)]
+    positions = {}
+    for position, node in enumerate(tags):
+        positions.setdefault(type(node), []).append(position)
+    return tags, positions
 
 
 def parse_tag_set(tag_set):
@@ -44,8 +44,8 @@ NEWLINE_CHARS = (
 )
 
 
-def get_tokens(text):
-    parser = TokenParser(text)
+def get_tokens(text, max_tokens=None):
+    parser = TokenParser(text, max_tokens)
     return parser.tokens
 
 
@@ -171,9 +171,16 @@ class CloseTagToken(BaseToken):
 
 
 class TokenParser(object):
-    def __init__(self, raw_text):
+    def __init__(self, raw_text, max_tokens=None):
+        """`max_tokens` - if given, stop once more than this many tokens
+            have been found, leaving the rest of the text untokenized.
+        """
         self.original_text = raw_text
         self.text = raw_text
+        self.max_tokens = max_tokens
+        # Whether a tag was still being scanned for its closing character
+        # when the end of the text was reached.
+        self.reached_end_in_tag = False
 
         self.parse_tokens()
 
@@ -184,6 +191,9 @@ class TokenParser(object):
         search_chars = NEWLINE_CHARS + OPEN_CHAR
 
         while self.curr_pos < len(self.text):
+            if self.max_tokens is not None and len(self.tokens) > self.max_tokens:
+                break
+
             self.last_pos = self.curr_pos
             self.curr_pos = find_next_multi_char(self.text, search_chars, self.curr_pos)
 
@@ -274,6 +284,7 @@ class TokenParser(object):
         end_of_tag_loc = self._find_close_char()
         if end_of_tag_loc == -1 or self.text[end_of_tag_loc] != CLOSE_CHAR:
             if end_of_tag_loc == -1:
+                self.reached_end_in_tag = True
                 end_of_tag_loc = len(self.text) - 1
             else:
                 # Need to step back a character so that the OPEN_CHAR will
@@ -18,67 +18,605 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import contextlib
+import hashlib
+import threading
 from collections import namedtuple
 
-from bbcondeparser.tags import ErrorText, NewlineText, RawText, RootTag, parse_tag_set
+from bbcondeparser.errors import ParseLimitExceeded
+from bbcondeparser.tags import (
+    DEFAULT_BLOCK_SEPARATOR,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_ELLIPSIS,
+    BaseTag,
+    ErrorText,
+    NewlineText,
+    RawText,
+    RootTag,
+    Source,
+    TagCategory,
+    _follow_edits,
+    parse_tag_set,
+)
 from bbcondeparser.token_parser import (
     BadSyntaxToken,
     CloseTagToken,
     NewlineToken,
     OpenTagToken,
     TextToken,
+    TokenParser,
     get_tokens,
 )
 
 
+class ParseLimits(object):
+    """Caps on the work done parsing a single document, for use with
+        untrusted input. Any limit left as None is not enforced.
+
+        `max_tokens` - the number of tokens in the source text
+        `max_depth` - how deeply tags may be nested
+        `max_errors` - the number of errors encountered (including any
+            later discarded by error recovery)
+        `max_attrs` - the number of attributes on a single tag
+        `max_attr_bytes` - the utf-8 encoded size of the attribute names
+            and values on a single tag
+        `max_recovery_steps` - the number of tokens the parser may go back
+            over (in total) when backtracking to recover from errors, each
+            of which is parsed again. Unclosed tags make the parser go back
+            over everything after them, so the work done recovering can
+            grow with the square of the number of tokens without this.
+
+        `truncate` - if falsy, `ParseLimitExceeded` is raised when a limit
+            is exceeded. If truthy, parsing stops and the remaining text
+            (from the outermost unclosed tag, if any) is added to the tree
+            as ErrorText.
+    """
+
+    def __init__(
+        self,
+        max_tokens=None,
+        max_depth=None,
+        max_errors=None,
+        max_attrs=None,
+        max_attr_bytes=None,
+        max_recovery_steps=None,
+        truncate=False,
+    ):
+        self.max_tokens = max_tokens
+        self.max_depth = max_depth
+        self.max_errors = max_errors
+        self.max_attrs = max_attrs
+        self.max_attr_bytes = max_attr_bytes
+        self.max_recovery_steps = max_recovery_steps
+        self.truncate = truncate
+
+    def __repr__(self):
+        return "{}({})".format(
+            self.__class__.__name__,
+            ", ".join(
+                "{}={}".format(key, val) for key, val in sorted(vars(self).items())
+            ),
+        )
+
+
+# An edit to a document's text, replacing text[start:end] with `text`
+TextEdit = namedtuple("TextEdit", ["start", "end", "text"])
+
+
+# The contexts of renders in progress on each thread, by id of the parser.
+_render_contexts = threading.local()
+
+
 class BaseTreeParser(object):
     tags = []
     ignored_tags = []
 
+    # A ParseLimits instance, or None for no limits
+    limits = None
+
+    # A ParseCache used by `cached_render`, or None for no caching
+    parse_cache = None
+
     raw_text_class = RawText
     error_text_class = ErrorText
     newline_text_class = NewlineText
     root_tag_class = RootTag
 
     def __init__(self, text):
+        self._tree_parser = None
+        # Whether the tree may hold errors from recovering by backtracking
+        # (see `backtracked_over`), set by `build_tree`.
+        self._recovered = True
+        self.reset(text)
+
+    def reset(self, text):
+        """Parse `text`, replacing the current `root_node` and context.
+            The parser's internal state is kept and reused, so resetting
+            a parser is cheaper than creating a new one.
+        """
         self._context = {}
         self.raw_text = text
 
-        tags = parse_tag_set(self.tags)
+        self.root_node = self.build_tree(text)
+
+        # Update the root node parent to self
+        self.root_node.set_parent_node(self)
+
+    def build_tree(self, text):
+        """returns the root node of the parsed `text`"""
+        tag_table = self.get_tag_table()
+        tree_parser = self._tree_parser
+
+        if tree_parser is None or tree_parser.tag_table is not tag_table:
+            tree_parser = _TreeParser(
+                text,
+                tag_table,
+                raw_text_class=self.raw_text_class,
+                error_text_class=self.error_text_class,
+                newline_text_class=self.newline_text_class,
+                root_tag_class=self.root_tag_class,
+                limits=self.limits,
+            )
+            self._tree_parser = tree_parser
+        else:
+            tree_parser.reset(text)
+
+        tree_parser.parse_tree()
+        root_node = tree_parser.root_node
+        self._recovered = tree_parser.recovered
+        # Don't hold on to the document until the next reset
+        tree_parser.reset("")
+        return root_node
+
+    def reparse(self, edit):
+        """Update `root_node` and `raw_text` for an edit to the text.
+            `edit` is a `TextEdit`.
+
+            Where possible, only the smallest tag whose contents contain the
+            edit is parsed again, and the result spliced into the existing
+            tree. This is only done where it's certain to give the same tree
+            as parsing the whole text, otherwise the whole text is parsed.
+
+            returns `root_node`
+        """
+        new_text = self.raw_text[: edit.start] + edit.text + self.raw_text[edit.end :]
+
+        # Limits are applied per parse, so a partial parse can't honour them.
+        if self.limits is None:
+            path = find_edit_path(self.root_node, edit.start, edit.end)
+            if (
+                len(path) > 1
+                and not (self._recovered and backtracked_over(path))
+                and self.reparse_node(path, new_text, edit)
+            ):
+                return self.root_node
+
+        self.raw_text = new_text
+        self.root_node = self.build_tree(new_text)
+        self.root_node.set_parent_node(self)
+        return self.root_node
+
+    def reparse_node(self, path, new_text, edit):
+        """Reparse the node at the end of `path` (as returned by
+            find_edit_path), and if the result is a drop-in replacement,
+            swap it in and return True.
+        """
+        if self.root_node._source is None:
+            # The rest of the tree is moved along for the edit by way of
+            # the source, so can't be without one.
+            return False
+
+        node = path[-1]
+        parent = path[-2]
+        # Nodes without a location were added after parsing, so weren't
+        # on the stack when the node was parsed.
+        ancestors = [ancestor for ancestor in path[1:-1] if ancestor.location]
+
+        delta = len(edit.text) - (edit.end - edit.start)
+        start, end = node.location[0], node.location[1] + delta
+        region_text = new_text[start:end]
+
+        tag_table = self.get_tag_table()
+        tag_dict = tag_table.tag_dict
+        for ancestor in ancestors:
+            tag_dict = tag_table.get_new_tag_dict(ancestor.__class__, tag_dict)
+
+        inst = _RegionTreeParser(
+            region_text,
+            tag_table,
+            ancestors,
+            raw_text_class=self.raw_text_class,
+            error_text_class=self.error_text_class,
+            newline_text_class=self.newline_text_class,
+            root_tag_class=self.root_tag_class,
+        )
+        inst.tag_dict = tag_dict
+        inst.parse_tree()
+
+        tree = inst.root_node.tree
+        if not (
+            inst.in_context
+            and len(tree) == 1
+            and tree[0].__class__ is node.__class__
+            and tree[0].location == (0, len(region_text))
+        ):
+            return False
+
+        new_node = tree[0]
+        self._recovered = self._recovered or inst.recovered
+        index = _find_child_index(parent.tree, node.location[0])
+        if index is None or parent.tree[index] is not node:
+            index = next(i for i, child in enumerate(parent.tree) if child is node)
+        boundary = node.location[1]
+        # The node being replaced doesn't read the same from the new text,
+        # so mustn't follow the source into it.
+        unset_sources(node)
+        node.set_parent_node(None)
+        # Everything else does, once moved along for the edit, which each
+        # node does when it's next used.
+        source = _follow_edits(self.root_node).edited(boundary, delta, new_text)
+        offset_locations(new_node, start, source)
+
+        parent.tree[index] = new_node
+        new_node.set_parent_node(parent)
+        self.raw_text = new_text
+
+        self.amend_reparsed_node(new_node, path[:-1])
+        return True
+
+    def amend_reparsed_node(self, node, path):
+        """Hook for subclasses which alter the tree after parsing.
+            `node` has been spliced into the tree by `reparse`, as a child
+            of the last item in `path` (path being from the root node).
+        """
+        pass
+
+    @classmethod
+    def get_tags(cls):
+        """returns the set of tag classes this parser will recognise,
+            with `ignored_tags` swapped out for their null classes.
+        """
+        tags = parse_tag_set(cls.tags)
         ignored_tags = set(
             tag.null_class
-            for tag in parse_tag_set(self.ignored_tags)
+            for tag in parse_tag_set(cls.ignored_tags)
             if tag not in tags
         )
         tags.update(ignored_tags)
-
-        self.root_node = parse_tree(
+        return tags
+
+    @classmethod
+    def get_tag_table(cls):
+        """returns the `TagTable` for this parser, which is built on first
+            use and shared by every parse until `tags`, `ignored_tags` or
+            any TagCategory changes, or the `allowed_tags` of any tag class
+            is set. (`allowed_tags` changed in place isn't noticed, it must
+            be set again.)
+        """
+        cached = cls.__dict__.get("_tag_table_cache")
+        key = (list(cls.tags), list(cls.ignored_tags), TagCategory._changes)
+        if cached is None or cached[0] != key:
+            cached = (key, TagTable(cls.get_tags()))
+            cls._tag_table_cache = cached
+        return cached[1]
+
+    @classmethod
+    def fingerprint(cls):
+        """returns a hex digest identifying how this parser parses and
+            renders, from the parser, every tag it can parse (their
+            attributes and the code of their methods) and the library
+            version.
+            Computed once until the parser's tags (or the tags allowed
+            within them) change, as for get_tag_table, so other changes
+            made to a tag class after first use aren't noticed.
+        """
+        cached = cls.__dict__.get("_fingerprint_cache")
+        key = (list(cls.tags), list(cls.ignored_tags), TagCategory._changes)
+        if cached is None or cached[0] != key:
+            from bbcondeparser import __version__
+
+            reachable = _get_reachable_tags(cls.get_tags())
+            description = [
+                __version__,
+                _describe_class(cls),
+                sorted((_describe_class(tag_cls) for tag_cls in reachable), key=repr),
+            ]
+            digest = hashlib.sha1(repr(description).encode("utf-8")).hexdigest()
+            cached = (key, digest)
+            cls._fingerprint_cache = cached
+        return cached[1]
+
+    @classmethod
+    def cached_render(cls, text, ctx=None, **kwargs):
+        """Render `text`, going through `parse_cache` if there is one.
+            `kwargs` are passed through to the parser's __init__.
+        """
+        if cls.parse_cache is None:
+            return cls(text, **kwargs).render(ctx)
+        return cls.parse_cache.render(cls, text, ctx, **kwargs)
+
+    @classmethod
+    def parse_many(cls, texts, **kwargs):
+        """Parse each of `texts` in turn, yielding the root node of each.
+            `kwargs` are passed through to the parser's __init__.
+        """
+        parser = None
+        for text in texts:
+            if parser is None:
+                parser = cls(text, **kwargs)
+            else:
+                parser.reset(text)
+            yield parser.root_node
+
+    @classmethod
+    def render_many(cls, texts, ctx=None, **kwargs):
+        """Parse and render each of `texts` in turn, yielding the rendered
+            text of each.
+            `kwargs` are passed through to the parser's __init__.
+        """
+        parser = None
+        for text in texts:
+            if parser is None:
+                parser = cls(text, **kwargs)
+            else:
+                parser.reset(text)
+            yield parser.render(ctx)
+
+    @classmethod
+    def extract_text(cls, text, block_separator=DEFAULT_BLOCK_SEPARATOR):
+        """returns the plain text of `text` (see `render_text`), e.g. for
+            search indexing. The tree is built as by `parse_tree`, so none
+            of the changes a parser makes to it in `build_tree` (e.g. HTML
+            paragraphs) are made.
+        """
+        root_node = parse_tree(
             text,
-            tags,
-            raw_text_class=self.raw_text_class,
-            error_text_class=self.error_text_class,
-            newline_text_class=self.newline_text_class,
-            root_tag_class=self.root_tag_class,
+            cls.get_tag_table(),
+            raw_text_class=cls.raw_text_class,
+            error_text_class=cls.error_text_class,
+            newline_text_class=cls.newline_text_class,
+            root_tag_class=cls.root_tag_class,
+            limits=cls.limits,
         )
+        return root_node.render_text(block_separator)
 
-        # Update the root node parent to self
-        self.root_node.set_parent_node(self)
+    @classmethod
+    def validate(cls, text):
+        """returns a list of (location, reason) for each error in `text`,
+            without building a tree. `location` is the (start, end) of the
+            offending source text. An empty list means `text` is valid.
+        """
+        inst = _ValidatingTreeParser(text, cls.get_tag_table(), limits=cls.limits)
+        inst.parse_tree()
+        return inst.root_node
 
     def get_context(self):
+        contexts = getattr(_render_contexts, "contexts", None)
+        if contexts:
+            ctx = contexts.get(id(self))
+            if ctx is not None:
+                return ctx
         return self._context
 
     def render(self, ctx=None):
-        if ctx:
-            self._context = ctx
-        return self.root_node.render()
+        """Render the parsed text. `ctx` is seen through `get_context` for
+            the duration of this call only (and only by this thread), so a
+            parser may be rendered from several threads at once.
+        """
+        if not ctx:
+            return self.root_node.render()
+
+        with self._render_context(ctx):
+            return self.root_node.render()
+
+    def iter_render(self, ctx=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """yields the rendered text in pieces of around `chunk_size`
+            characters, so it can be sent on (e.g. as a response body)
+            before the whole has been rendered. `ctx` is as for `render`.
+            The tree mustn't be changed until this has been exhausted.
+        """
+        chunks = self.root_node.iter_render(chunk_size)
+        if not ctx:
+            return chunks
+        return self._iter_with_context(chunks, ctx)
+
+    def render_to(self, fp, ctx=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Write the rendered text to `fp` (anything with a `write` taking
+            text), `chunk_size` characters at a time.
+        """
+        for chunk in self.iter_render(ctx, chunk_size):
+            fp.write(chunk)
+
+    def render_text(self, block_separator=DEFAULT_BLOCK_SEPARATOR):
+        """returns the parsed text as plain text, with whitespace normalised
+            and blocks of text joined by `block_separator`
+            (see `tags.render_nodes_text`).
+        """
+        return self.root_node.render_text(block_separator)
+
+    def render_truncated(self, max_chars, ellipsis=DEFAULT_ELLIPSIS, ctx=None):
+        """Render the parsed text, cut short with `ellipsis` once `max_chars`
+            characters of text have been rendered, closing any tags open at
+            that point (e.g. for excerpts). Text is counted before escaping,
+            and the ellipsis isn't counted. `ctx` is as for `render`.
+        """
+        if not ctx:
+            return self.root_node.render_truncated(max_chars, ellipsis)
+
+        with self._render_context(ctx):
+            return self.root_node.render_truncated(max_chars, ellipsis)
+
+    def _iter_with_context(self, chunks, ctx):
+        # The context is only set while each chunk is being rendered, so
+        # that whatever runs between chunks doesn't see it.
+        while True:
+            with self._render_context(ctx):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    @contextlib.contextmanager
+    def _render_context(self, ctx):
+        try:
+            contexts = _render_contexts.contexts
+        except AttributeError:
+            contexts = _render_contexts.contexts = {}
+
+        key = id(self)
+        previous = contexts.get(key)
+        contexts[key] = ctx
+        try:
+            yield
+        finally:
+            if previous is None:
+                del contexts[key]
+            else:
+                contexts[key] = previous
 
     def pretty_format(self):
         return self.root_node.pretty_format()
 
 
+def _get_reachable_tags(tags):
+    """returns a list of `tags` and every tag class allowed (at any depth)
+        within them, each once.
+    """
+    seen = set()
+    reachable = []
+    pending = list(tags)
+    while pending:
+        tag_cls = pending.pop()
+        if tag_cls in seen:
+            continue
+        seen.add(tag_cls)
+        reachable.append(tag_cls)
+        pending.extend(tag_cls.get_allowed_tags() or ())
+    return reachable
+
+
+def _class_path(cls):
+    return "{}.{}".format(cls.__module__, cls.__qualname__)
+
+
+def _describe_class(cls):
+    """returns a description of `cls` for fingerprinting, being its name
+        and the attributes defined by it and its bases.
+    """
+    attrs = {}
+    for klass in reversed(cls.__mro__):
+        for name, value in vars(klass).items():
+            if not name.startswith("__") and not name.endswith("_cache"):
+                attrs[name] = value
+
+    return (
+        _class_path(cls),
+        sorted((name, _describe(value)) for name, value in attrs.items()),
+    )
+
+
+def _describe(value):
+    """returns a description of `value` for fingerprinting, made only of
+        builtin types so that its repr is the same in any process.
+    """
+    if isinstance(value, (classmethod, staticmethod, property)):
+        value = getattr(value, "__func__", getattr(value, "fget", None))
+
+    if isinstance(value, type):
+        return _class_path(value)
+
+    if isinstance(value, TagCategory):
+        return (
+            "category",
+            value.category_name,
+            sorted(_class_path(tag_cls) for tag_cls in value.tag_classes),
+        )
+
+    code = getattr(value, "__code__", None)
+    if code is not None:
+        return (
+            "code",
+            value.__qualname__,
+            _describe_code(code),
+            _describe(getattr(value, "__defaults__", None)),
+            _describe(getattr(value, "__kwdefaults__", None)),
+        )
+
+    if isinstance(value, dict):
+        return sorted((repr(key), _describe(val)) for key, val in value.items())
+
+    if isinstance(value, (set, frozenset)):
+        return sorted((_describe(item) for item in value), key=repr)
+
+    if isinstance(value, (list, tuple)):
+        return [_describe(item) for item in value]
+
+    if value is None or isinstance(value, (str, bytes, int, float, bool)):
+        return value
+
+    if isinstance(value, ParseLimits):
+        return repr(value)
+
+    # Anything else is only known by its type
+    return _class_path(type(value))
+
+
+def _describe_code(code):
+    """returns a description of a code object: its bytecode, the names it
+        uses (globals, attributes and so on) and its constants, including
+        the code of any functions defined within it.
+    """
+    return (code.co_code.hex(), list(code.co_names), _describe_const(code.co_consts))
+
+
+def _describe_const(const):
+    if hasattr(const, "co_code"):
+        return _describe_code(const)
+    if isinstance(const, (tuple, frozenset)):
+        items = [_describe_const(item) for item in const]
+        if isinstance(const, frozenset):
+            items.sort(key=repr)
+        return items
+    if const is None or isinstance(const, (str, bytes, int, float, bool, complex)):
+        return const
+    return _class_path(type(const))
+
+
+class ParserPool(object):
+    """Hands out parser instances for reuse, one per parser class (and
+        set of __init__ arguments) per thread.
+
+        The parser returned by `parse` is reset by the next call to `parse`
+        for the same parser class in the same thread, so must be finished
+        with before then. (`root_node`s stay valid, being replaced rather
+        than modified)
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def parse(self, parser_cls, text, **kwargs):
+        """returns a `parser_cls` instance which has parsed `text`
+            `kwargs` are passed through to the parser's __init__.
+        """
+        try:
+            parsers = self._local.parsers
+        except AttributeError:
+            parsers = self._local.parsers = {}
+
+        key = (parser_cls, tuple(sorted(kwargs.items())))
+        parser = parsers.get(key)
+        if parser is None:
+            parser = parsers[key] = parser_cls(text, **kwargs)
+        else:
+            parser.reset(text)
+
+        return parser
+
+
 StackLevel = namedtuple(
     "TreeParserStackLevel",
-    ["tree", "tag_dict", "tag_cls", "tag_open_token", "token_index"],
+    ["tree", "tag_dict", "tag_cls", "tag_open_token", "tag_attrs", "token_index"],
 )
 
 
@@ -94,9 +632,15 @@ class TreeStack(object):
     def __len__(self):
         return len(self.stack)
 
+    def __getitem__(self, index):
+        return self.stack[index]
+
     def pop(self):
         return self.stack.pop()
 
+    def clear(self):
+        del self.stack[:]
+
     def behead(self, index):
         """Reset the stack back to index and return the items
             removed from the top of the stack.
@@ -188,9 +732,12 @@ def parse_tree(
     error_text_class=ErrorText,
     newline_text_class=NewlineText,
     root_tag_class=RootTag,
+    limits=None,
 ):
     """`raw_text` is the raw bb code (conde format) to be parsed
-        `tags` should be an iterable of tag classes allowed in the text
+        `tags` should be an iterable of tag classes allowed in the text,
+            or a `TagTable`
+        `limits` is an optional `ParseLimits`
     """
     inst = _TreeParser(
         raw_text,
@@ -199,11 +746,23 @@ def parse_tree(
         error_text_class,
         newline_text_class,
         root_tag_class,
+        limits,
     )
     inst.parse_tree()
     return inst.root_node
 
 
+# Reasons given for ErrorText created when backtracking
+SHORT_CIRCUITED_BY_CLOSE_TAG = "open tag short-circuited by differing close tag"
+SHORT_CIRCUITED_BY_NEWLINE = "Open tag short-circuited by newline closed outer tag"
+MISSING_CLOSE_TAG = "missing close tag"
+RECOVERY_REASONS = (
+    SHORT_CIRCUITED_BY_CLOSE_TAG,
+    SHORT_CIRCUITED_BY_NEWLINE,
+    MISSING_CLOSE_TAG,
+)
+
+
 # This class is relatively straight forward, apart from what it does
 # when it encounters an error and has to re-evaluate tokens it's already
 # parsed. consider the following setup
@@ -247,83 +806,127 @@ class _TreeParser(object):
         error_text_class=ErrorText,
         newline_text_class=NewlineText,
         root_tag_class=RootTag,
+        limits=None,
     ):
         self.raw_text_class = raw_text_class
         self.error_text_class = error_text_class
         self.newline_text_class = newline_text_class
         self.root_tag_class = root_tag_class
+        self.limits = limits or ParseLimits()
+
+        if isinstance(tags, TagTable):
+            self.tag_table = tags
+        else:
+            self.tag_table = TagTable(tags)
+
+        self.stack = TreeStack()
+        self.reset(raw_text)
 
-        self.tokens = get_tokens(raw_text)
-        self.tag_dict = create_tag_dict(tags)
+    def reset(self, raw_text):
+        """Set up to parse `raw_text`, clearing any previous parse."""
+        self.raw_text = raw_text
+        self.source = Source(raw_text)
+        self.tokens = self.tokenize(raw_text)
+        self.tag_dict = self.tag_table.tag_dict
 
         self._tree = None
-        self.stack = TreeStack()
+        self.stack.clear()
         self.root_node = None
+        self.token = None
+        # ParsedAttrs of the open tag `token`
+        self.tag_attrs = None
 
         self.token_index = 0
+        self.error_count = 0
+        self.recovery_steps = 0
+        # Whether any errors were added for recovering by backtracking
+        self.recovered = False
 
     @property
     def tag_cls(self):
         return self.tag_dict.get(self.token.tag_name)
 
+    def tokenize(self, raw_text):
+        return get_tokens(raw_text, self.limits.max_tokens)
+
     def parse_tree(self):
         self._tree = []
         while self.token_index <= len(self.tokens):
-            try:
-                self.token = self.tokens[self.token_index]
-            except IndexError:
-                self.token = None
+            self.process_token()
+
+        # Move tree from self to a root tag
+        self.root_node = self.make_root(self._tree)
+        self._tree = None
 
-            if isinstance(self.token, TextToken):
-                self.append_tree(self.raw_text_class(self.token.text))
+    def process_token(self):
+        """Handle the token at `self.token_index` and move on to the next.
+            (N.B. handling a token may cause `self.token_index` to
+            backtrack to an earlier token)
+        """
+        try:
+            self._process_token()
+        except ParseLimitExceeded:
+            if not self.limits.truncate:
+                raise
+            self.truncate()
 
-            elif isinstance(self.token, BadSyntaxToken):
-                self.append_err(self.token.reason)
+    def _process_token(self):
+        try:
+            self.token = self.tokens[self.token_index]
+        except IndexError:
+            self.token = None
 
-            elif isinstance(self.token, OpenTagToken):
-                self.handle_open_token()
+        max_tokens = self.limits.max_tokens
+        if max_tokens is not None and self.token_index >= max_tokens:
+            if self.token is not None:
+                self.limit_exceeded("max_tokens")
 
-            elif isinstance(self.token, CloseTagToken):
-                self.handle_close_token()
+        if isinstance(self.token, TextToken):
+            self.append_tree(self.make_text())
 
-            elif isinstance(self.token, NewlineToken):
-                self.handle_newline_token()
+        elif isinstance(self.token, BadSyntaxToken):
+            self.append_err(self.token.reason)
 
-            elif self.token is None:
-                # This might cause us to backtrack, which is why it's
-                # not just a call outside the while.
-                self.handle_eof()
+        elif isinstance(self.token, OpenTagToken):
+            self.handle_open_token()
 
-            else:
-                raise TypeError("Unknown token type: {}".format(type(self.token)))
+        elif isinstance(self.token, CloseTagToken):
+            self.handle_close_token()
 
-            self.token_index += 1
+        elif isinstance(self.token, NewlineToken):
+            self.handle_newline_token()
 
-        # Move tree from self to a root tag
-        root_tag = self.root_tag_class({}, self._tree, "", "")
-        self._tree = None
-        self.root_node = root_tag
+        elif self.token is None:
+            # This might cause us to backtrack, which is why it's
+            # not just a call outside the while.
+            self.handle_eof()
+
+        else:
+            raise TypeError("Unknown token type: {}".format(type(self.token)))
+
+        self.token_index += 1
 
     def handle_open_token(self):
+        self.check_attr_limits()
+
         if self.tag_cls is None:
             self.append_err("unknown tag")
 
         elif self.tag_cls.self_closing:
-            # [] because self-closing tags contain no tree
-            # "" beacuse self-closing tags don't have any end text
-            inst = self.tag_cls(self.token.attrs, [], self.token.text, "")
+            inst, errors = self.make_self_closing_tag()
 
-            if inst.errors:
-                self.append_err("; ".join(inst.errors))
+            if errors:
+                self.append_err("; ".join(errors))
 
             else:
                 self.append_tree(inst)
 
         else:
             # Check if the attrs are ok first. if not, it's an error!
-            _, errors = self.tag_cls.parse_attrs(self.token.attrs)
-            if errors:
-                self.append_err("; ".join(errors))
+            # (They're kept for making the tag, rather than parsed again)
+            self.tag_attrs = self.tag_cls.get_parsed_attrs(self.token.attrs)
+            if self.tag_attrs.errors:
+                self.append_err("; ".join(self.tag_attrs.errors))
             # It's an open tag, so push onto the stack
             else:
                 self.stack_push()
@@ -341,26 +944,19 @@ class _TreeParser(object):
             # (which sits at open_for_index +1)
             if open_for_index < len(self.stack) - 1:
                 self.stack_reset(open_for_index + 1, reset=True)
-                self.append_err("open tag short-circuited by " "differing close tag")
+                self.append_err(SHORT_CIRCUITED_BY_CLOSE_TAG)
 
             else:
                 tag_tree = self._tree
                 close_token = self.token
                 self.stack_pop()
-                self.append_tree(
-                    self.tag_cls(
-                        self.token.attrs, tag_tree, self.token.text, close_token.text,
-                    )
-                )
+                self.append_tree(self.make_tag(tag_tree, close_token))
 
     def handle_newline_token(self):
         first_newline_close = self.stack.first_newline_close_index()
 
         if first_newline_close == -1:
-            if self._tree and isinstance(self._tree[-1], self.newline_text_class):
-                self._tree[-1].add_newline(self.token.text)
-            else:
-                self.append_tree(self.newline_text_class(self.token.text))
+            self.append_newline()
 
         else:
             first_non_newline_close = self.stack.find_first(
@@ -374,9 +970,7 @@ class _TreeParser(object):
                 # at this index. So we need to go back and re-evaluate the
                 # tokens from that location.
                 self.stack_reset(first_non_newline_close, reset=True)
-                self.append_err(
-                    "Open tag short-circuited by " "newline closed outer tag"
-                )
+                self.append_err(SHORT_CIRCUITED_BY_NEWLINE)
             else:
                 # everything from the first close_on_newline tag on the stack
                 # to the last is a close_on_newline. So lets close them.
@@ -387,28 +981,44 @@ class _TreeParser(object):
                     tag_tree = self._tree
                     self.set_state(closed_items.pop())
 
-                    self.append_tree(
-                        self.tag_cls(self.token.attrs, tag_tree, self.token.text, "",)
-                    )
+                    self.append_tree(self.make_tag(tag_tree, close_token))
 
                 # And now add our newline at the end.
-                self.append_tree(self.newline_text_class(close_token.text))
+                self.token = close_token
+                self.append_tree(self.make_newline())
 
     def handle_eof(self):
         if self.stack:
             # The first unclosed token has not been closed, so we have to
             # go back and start again.
             self.stack_reset(0, reset=True)
-            self.append_err("missing close tag")
+            self.append_err(MISSING_CLOSE_TAG)
 
     def stack_push(self):
+        max_depth = self.limits.max_depth
+        if max_depth is not None and len(self.stack) >= max_depth:
+            self.limit_exceeded("max_depth")
+
         self.stack.push(
-            self._tree, self.tag_dict, self.tag_cls, self.token, self.token_index
+            self._tree,
+            self.tag_dict,
+            self.tag_cls,
+            self.token,
+            self.tag_attrs,
+            self.token_index,
         )
         self._tree = []
-        self.tag_dict = get_new_tag_dict(self.tag_cls, self.tag_dict)
+        self.tag_dict = self.tag_table.get_new_tag_dict(self.tag_cls, self.tag_dict)
 
     def stack_reset(self, index, reset=False):
+        if reset:
+            # Every token since the tag at `index` was opened is parsed again
+            self.recovery_steps += self.token_index - self.stack[index].token_index
+            max_recovery_steps = self.limits.max_recovery_steps
+            if max_recovery_steps is not None:
+                if self.recovery_steps > max_recovery_steps:
+                    self.limit_exceeded("max_recovery_steps")
+
         self.set_state(self.stack.reset(index), reset)
 
     def stack_pop(self, reset=False):
@@ -418,16 +1028,481 @@ class _TreeParser(object):
         self._tree = stack_ctx.tree
         self.tag_dict = stack_ctx.tag_dict
         self.token = stack_ctx.tag_open_token
+        self.tag_attrs = stack_ctx.tag_attrs
 
         if reset:
             self.token_index = stack_ctx.token_index
 
     def append_err(self, reason):
-        self.append_tree(self.error_text_class(self.token.text, reason))
+        self.error_count += 1
+        max_errors = self.limits.max_errors
+        if max_errors is not None and self.error_count > max_errors:
+            self.limit_exceeded("max_errors")
+
+        if reason in RECOVERY_REASONS:
+            self.recovered = True
+        self.append_tree(self.make_error(reason))
+
+    def check_attr_limits(self):
+        attrs = self.token.attrs
+        max_attrs = self.limits.max_attrs
+        if max_attrs is not None and len(attrs) > max_attrs:
+            self.limit_exceeded("max_attrs")
+
+        max_attr_bytes = self.limits.max_attr_bytes
+        if max_attr_bytes is not None:
+            attr_bytes = sum(
+                len(attr_key.encode("utf-8")) + len(attr_val.encode("utf-8"))
+                for attr_key, attr_val in attrs
+            )
+            if attr_bytes > max_attr_bytes:
+                self.limit_exceeded("max_attr_bytes")
+
+    def limit_exceeded(self, limit):
+        if self.token is None:
+            location = len(self.raw_text)
+        else:
+            location = self.token.location[0]
+        raise ParseLimitExceeded(limit, location)
+
+    def truncate(self):
+        """Stop parsing, and add everything from the outermost unclosed
+            tag (or the current token) onwards as an error.
+        """
+        if self.stack:
+            self.stack_reset(0)
+
+        if self.token is None:
+            start = len(self.raw_text)
+        else:
+            start = self.token.location[0]
+
+        self.token = BadSyntaxToken(
+            self.raw_text[start:], (start, len(self.raw_text)), "parse limit exceeded"
+        )
+        if self.token.text:
+            self.append_tree(self.make_error(self.token.reason))
+
+        # Jump past the end of the tokens so that parsing finishes
+        self.token_index = len(self.tokens) + 1
 
     def append_tree(self, item):
         self._tree.append(item)
 
+    def append_newline(self):
+        if self._tree and isinstance(self._tree[-1], self.newline_text_class):
+            self._tree[-1].add_newline(self.token.text, self.token.location)
+        else:
+            self.append_tree(self.make_newline())
+
+    # The make_* methods below are the only places nodes are created.
+    # `self.token` is the token the node is being created for, apart from
+    # make_tag, where it is the open token (having been restored from the
+    # stack) and the token which closed the tag is passed in.
+
+    def make_text(self):
+        node = self.raw_text_class(self.token.text)
+        node.set_source(self.source, self.token.location)
+        return node
+
+    def make_newline(self):
+        node = self.newline_text_class(self.token.text)
+        node.set_source(self.source, self.token.location)
+        return node
+
+    def make_error(self, reason):
+        node = self.error_text_class(self.token.text, reason)
+        node.set_source(self.source, self.token.location)
+        return node
+
+    def make_self_closing_tag(self):
+        """returns a tuple of (tag instance, errors)"""
+        # [] because self-closing tags contain no tree
+        # "" beacuse self-closing tags don't have any end text
+        inst = self.tag_cls(self.token.attrs, [], self.token.text, "")
+        inst.set_source(self.source, self.token.location)
+        return inst, inst.errors
+
+    def make_tag(self, tree, close_token):
+        # A tag closed by a newline doesn't own the newline, it's added
+        # to the tree after the tag.
+        if isinstance(close_token, NewlineToken):
+            end_text = ""
+            end = close_token.location[0]
+        else:
+            end_text = close_token.text
+            end = close_token.location[1]
+
+        inst = self.tag_cls(self.tag_attrs, tree, self.token.text, end_text)
+        inst.set_source(self.source, (self.token.location[0], end))
+        return inst
+
+    def make_root(self, tree):
+        root = self.root_tag_class({}, tree, "", "")
+        root.set_source(self.source, (0, len(self.raw_text)))
+        return root
+
+
+ParseEvent = namedtuple(
+    "ParseEvent", ["type", "location", "text", "tag_cls", "attrs", "reason"],
+)
+
+START_TAG_EVENT = "start_tag"
+END_TAG_EVENT = "end_tag"
+TEXT_EVENT = "text"
+NEWLINE_EVENT = "newline"
+ERROR_EVENT = "error"
+
+
+def parse_events(raw_text, parser_cls):
+    """Generate `ParseEvent`s for `raw_text` as `parser_cls` would parse it,
+        without building a tree.
+
+        `raw_text` is the raw bb code (conde format) to be parsed
+        `parser_cls` is a `BaseTreeParser` subclass whose `tags` and
+            `ignored_tags` are used.
+
+        Events are yielded in document order, with the same allowed_tags,
+        close_on_newline and error recovery handling as `parse_tree`.
+        Each event is a `ParseEvent`, where `type` is one of:
+            `START_TAG_EVENT` - `tag_cls` and its parsed `attrs` are given
+            `END_TAG_EVENT` - `text` is '' for tags closed by a newline
+                or self closing tags (which still get an END_TAG_EVENT)
+            `TEXT_EVENT`
+            `NEWLINE_EVENT` - one per newline, runs of newlines are not
+                combined as they are in the tree.
+            `ERROR_EVENT` - `reason` is why `text` could not be parsed
+        `location` is the (start, end) of `text` in `raw_text`.
+
+        Events are only yielded once no later token can cause them to be
+        re-evaluated, so anything inside a tag is held back until the
+        outermost open tag is closed.
+    """
+    inst = _EventTreeParser(
+        raw_text, parser_cls.get_tag_table(), limits=parser_cls.limits
+    )
+    return inst.iter_events()
+
+
+class _EventTreeParser(_TreeParser):
+    """A _TreeParser which builds (nested) lists of `ParseEvent`s in
+        place of nodes.
+        tree items are either a `ParseEvent`, or a list of
+        [start event, tree, end event] for a tag.
+    """
+
+    def iter_events(self):
+        self._tree = []
+        while self.token_index <= len(self.tokens):
+            self.process_token()
+
+            # Nothing at the root of the tree can be backtracked over once
+            # the stack is empty, so it's safe to hand it out.
+            if not self.stack and self._tree:
+                for event in iter_flat_events(self._tree):
+                    yield event
+                self._tree = []
+
+    def append_newline(self):
+        self.append_tree(self.make_newline())
+
+    def make_event(self, event_type, tag_cls=None, attrs=None, reason=None):
+        return ParseEvent(
+            event_type, self.token.location, self.token.text, tag_cls, attrs, reason,
+        )
+
+    def make_text(self):
+        return self.make_event(TEXT_EVENT)
+
+    def make_newline(self):
+        return self.make_event(NEWLINE_EVENT)
+
+    def make_error(self, reason):
+        return self.make_event(ERROR_EVENT, reason=reason)
+
+    def make_self_closing_tag(self):
+        attrs, errors = self.tag_cls.get_parsed_attrs(self.token.attrs)
+        end_loc = self.token.location[1]
+        end_event = ParseEvent(
+            END_TAG_EVENT, (end_loc, end_loc), "", self.tag_cls, None, None
+        )
+        start_event = self.make_event(START_TAG_EVENT, self.tag_cls, attrs)
+        return [start_event, [], end_event], errors
+
+    def make_tag(self, tree, close_token):
+        start_event = self.make_event(
+            START_TAG_EVENT, self.tag_cls, self.tag_attrs.attrs
+        )
+
+        if isinstance(close_token, NewlineToken):
+            close_loc = close_token.location[0]
+            end_event = ParseEvent(
+                END_TAG_EVENT, (close_loc, close_loc), "", self.tag_cls, None, None
+            )
+        else:
+            end_event = ParseEvent(
+                END_TAG_EVENT,
+                close_token.location,
+                close_token.text,
+                self.tag_cls,
+                None,
+                None,
+            )
+
+        return [start_event, tree, end_event]
+
+
+class _RegionTreeParser(_TreeParser):
+    """A _TreeParser for reparsing part of a document, where the text would
+        have been inside the tags `ancestors`.
+        `in_context` is set False if the ancestors being open would have
+        changed how the text is parsed.
+    """
+
+    def __init__(self, raw_text, tags, ancestors, **kwargs):
+        self.in_context = True
+        self.ancestor_tag_names = set(ancestor.tag_name for ancestor in ancestors)
+        self.ancestor_closes_on_newline = any(
+            ancestor.close_on_newline for ancestor in ancestors
+        )
+        super(_RegionTreeParser, self).__init__(raw_text, tags, **kwargs)
+
+    def tokenize(self, raw_text):
+        token_parser = TokenParser(raw_text)
+        # A tag which ran to the end of the region may have carried on
+        # past it in the full text.
+        if token_parser.reached_end_in_tag:
+            self.in_context = False
+        return token_parser.tokens
+
+    def handle_close_token(self):
+        if self.token.tag_name in self.ancestor_tag_names:
+            if self.stack.open_for_index(self.token) == -1:
+                self.in_context = False
+        super(_RegionTreeParser, self).handle_close_token()
+
+    def handle_newline_token(self):
+        if self.ancestor_closes_on_newline:
+            self.in_context = False
+        super(_RegionTreeParser, self).handle_newline_token()
+
+
+def find_edit_path(root_node, start, end):
+    """returns a list of nodes from `root_node` down to the smallest tag
+        whose contents (not including the start and end text) contain
+        start:end.
+        Tags without an end text (self closing, or closed by a newline)
+        are not considered.
+    """
+    path = [root_node]
+    while True:
+        child_path = _find_child_edit_path(path[-1], start, end)
+        if child_path is None:
+            return path
+        path.extend(child_path)
+
+
+def _find_child_edit_path(node, start, end):
+    # Only the last child starting at or before the edit can contain it.
+    index = _find_child_index(node.tree, start)
+    children = node.tree if index is None else node.tree[index : index + 1]
+    for child in children:
+        if not isinstance(child, BaseTag):
+            continue
+
+        if child.location is None:
+            # Added after parsing (e.g. a paragraph), so look through it.
+            child_path = _find_child_edit_path(child, start, end)
+            if child_path is not None:
+                return [child] + child_path
+
+        elif child.end_text:
+            contents_start = child.location[0] + len(child.start_text)
+            contents_end = child.location[1] - len(child.end_text)
+            if contents_start <= start and end <= contents_end:
+                return [child]
+
+    return None
+
+
+def _find_child_index(tree, pos):
+    """returns the index of the last node in `tree` starting at or before
+        `pos` (-1 if none), found by bisection as the tree is in order of
+        location, or None if the start of a node can't be told.
+    """
+    low, high = 0, len(tree)
+    while low < high:
+        middle = (low + high) // 2
+        start = _get_start(tree[middle])
+        if start is None:
+            return None
+        if start <= pos:
+            low = middle + 1
+        else:
+            high = middle
+    return low - 1
+
+
+def _get_start(node):
+    while node.location is None:
+        # Added after parsing (e.g. a paragraph), so starts where the
+        # first node in it does.
+        if not isinstance(node, BaseTag) or not node.tree:
+            return None
+        node = node.tree[0]
+    return node.location[0]
+
+
+def backtracked_over(path):
+    """returns whether the last node in `path` might have been parsed more
+        than once, with different tags open.
+
+        That's the case if a tag which was open when the node was parsed was
+        then reset by backtracking, the ErrorText for which will be in the
+        tree of one of the node's ancestors, before the node.
+    """
+    node_start = path[-1].location[0]
+    for ancestor, child in zip(path, path[1:]):
+        for sibling in ancestor.tree:
+            if sibling is child:
+                break
+            if _contains_recovery_error(sibling, node_start):
+                return True
+    return False
+
+
+def _contains_recovery_error(node, before):
+    if isinstance(node, ErrorText):
+        return node.reason in RECOVERY_REASONS
+
+    # Nodes added after parsing (e.g. paragraphs) hold what was parsed
+    # into their parent, so need looking through
+    if isinstance(node, BaseTag) and node.location is None:
+        return any(
+            _contains_recovery_error(child, before)
+            for child in node.tree
+            if child.location is None or child.location[0] < before
+        )
+
+    return False
+
+
+def offset_locations(node, offset, source=None):
+    """Add `offset` to the location of `node` and its children, which now
+        take their text from `source` (or keep their own copies, if None)
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if getattr(node, "_source", None) is not None:
+            if source is None:
+                node._unset_source()
+            else:
+                node._source = source
+        if node.location is not None:
+            node.location = (node.location[0] + offset, node.location[1] + offset)
+        if isinstance(node, BaseTag):
+            stack.extend(node.tree)
+
+
+def unset_sources(node):
+    """Make `node` and its children keep copies of their own text, rather
+        than taking it from their source.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if getattr(node, "_source", None) is not None:
+            node._unset_source()
+        if isinstance(node, BaseTag):
+            stack.extend(node.tree)
+
+
+class _ValidatingTreeParser(_TreeParser):
+    """A _TreeParser which only collects errors.
+        trees are flat lists of (location, reason) tuples, a tag's tree
+        being merged into its parent's when it is closed.
+    """
+
+    def append_tree(self, item):
+        self._tree.extend(item)
+
+    def append_newline(self):
+        pass
+
+    def make_text(self):
+        return ()
+
+    def make_newline(self):
+        return ()
+
+    def make_error(self, reason):
+        return [(self.token.location, reason)]
+
+    def make_self_closing_tag(self):
+        _, errors = self.tag_cls.get_parsed_attrs(self.token.attrs)
+        return (), errors
+
+    def make_tag(self, tree, close_token):
+        return tree
+
+    def make_root(self, tree):
+        return tree
+
+
+def iter_flat_events(tree):
+    """Flatten an `_EventTreeParser` tree into a sequence of events"""
+    # Iterative so that deeply nested markup can't exhaust the stack
+    stack = [iter(tree)]
+    while stack:
+        for item in stack[-1]:
+            if isinstance(item, ParseEvent):
+                yield item
+            else:
+                start_event, child_tree, end_event = item
+                yield start_event
+                stack.append(iter([end_event]))
+                stack.append(iter(child_tree))
+                break
+        else:
+            stack.pop()
+
+
+class TagTable(object):
+    """Holds the {tag_name: tag_cls} dicts a _TreeParser uses, so that they
+        only need building once for any number of parses.
+        Every tag dict handed out is shared, and must not be modified.
+    """
+
+    def __init__(self, tags):
+        # {frozenset(tag_dict.items()): tag_dict}
+        # Equal dicts are shared, so that (for example) tags which allow
+        # each other don't create a new dict for every level of nesting.
+        self._tag_dicts = {}
+        # {(tag_cls, id(tag_dict)): (tag_dict, new_tag_dict)}
+        # tag_dict is kept to hold on to it, so its id can't be reused.
+        self._new_tag_dicts = {}
+        self.tag_dict = self._share(create_tag_dict(tags))
+
+    def _share(self, tag_dict):
+        return self._tag_dicts.setdefault(frozenset(tag_dict.items()), tag_dict)
+
+    def get_new_tag_dict(self, tag_cls, tag_dict):
+        """The cached equivalent of `get_new_tag_dict`, `tag_dict` must
+            have come from this TagTable.
+        """
+        key = (tag_cls, id(tag_dict))
+        try:
+            old_tag_dict, new_tag_dict = self._new_tag_dicts[key]
+        except KeyError:
+            old_tag_dict = None
+
+        if old_tag_dict is not tag_dict:
+            new_tag_dict = self._share(get_new_tag_dict(tag_cls, tag_dict))
+            self._new_tag_dicts[key] = (tag_dict, new_tag_dict)
+
+        return new_tag_dict
+
 
 def create_tag_dict(tags):
     # parse_tag_set will raise a RuntimeError
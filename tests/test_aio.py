@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import unittest
+
+from bbcondeparser import BaseTreeParser, SimpleTag
+from bbcondeparser import aio
+
+
+class BoldTag(SimpleTag):
+    tag_name = "b"
+    template = "<b>{{ body }}</b>"
+
+
+class ThreadRecordingParser(BaseTreeParser):
+    tags = [BoldTag]
+    threads = []
+
+    def render(self, ctx=None):
+        self.threads.append(threading.current_thread())
+        return super(ThreadRecordingParser, self).render(ctx)
+
+
+class TestAsyncRenderer(unittest.TestCase):
+    def setUp(self):
+        ThreadRecordingParser.threads = []
+        self.renderer = aio.AsyncRenderer(max_concurrency=2, size_threshold=20)
+
+    def tearDown(self):
+        self.renderer.shutdown()
+
+    def test_small_inline(self):
+        result = asyncio.run(
+            self.renderer.arender("[b]small[/b]", ThreadRecordingParser)
+        )
+
+        self.assertEqual("<b>small</b>", result)
+        self.assertEqual([threading.current_thread()], ThreadRecordingParser.threads)
+
+    def test_large_offloaded(self):
+        text = "[b]{}[/b]".format("x" * 100)
+
+        result = asyncio.run(self.renderer.arender(text, ThreadRecordingParser))
+
+        self.assertEqual(ThreadRecordingParser(text).render(), result)
+        self.assertNotEqual(
+            threading.current_thread(), ThreadRecordingParser.threads[0]
+        )
+
+    def test_many_concurrent(self):
+        texts = ["[b]{}[/b]".format(str(i) * 30) for i in range(10)]
+
+        async def run():
+            return await asyncio.gather(
+                *(self.renderer.arender(text, ThreadRecordingParser) for text in texts)
+            )
+
+        result = asyncio.run(run())
+
+        self.assertEqual([ThreadRecordingParser(t).render() for t in texts], result)
+
+    def test_aparse(self):
+        text = "[b]{}[/b]".format("x" * 100)
+
+        result = asyncio.run(self.renderer.aparse(text, ThreadRecordingParser))
+
+        self.assertEqual(ThreadRecordingParser(text).root_node, result.root_node)
+
+    def test_default_renderer(self):
+        result = asyncio.run(aio.arender("[b]a[/b]", ThreadRecordingParser))
+
+        self.assertEqual("<b>a</b>", result)
@@ -0,0 +1,105 @@
+import unittest
+
+from bbcondeparser import (
+    BaseHTMLRenderTreeParser,
+    BaseHTMLTag,
+    HtmlSimpleTag,
+    ParseCache,
+)
+
+
+class BoldTag(HtmlSimpleTag):
+    tag_name = "b"
+    template = "<b>{{ body }}</b>"
+
+
+class NameTag(BaseHTMLTag):
+    tag_name = "name"
+
+    def _render(self):
+        return self.get_context().get("name", "")
+
+
+class CacheParser(BaseHTMLRenderTreeParser):
+    tags = [BoldTag, NameTag]
+
+
+class TestParseCache(unittest.TestCase):
+    def test_render(self):
+        cache = ParseCache()
+
+        first = cache.render(CacheParser, "[b]a[/b]\nb")
+        second = cache.render(CacheParser, "[b]a[/b]\nb")
+
+        self.assertEqual(CacheParser("[b]a[/b]\nb").render(), first)
+        self.assertEqual(first, second)
+        self.assertEqual((1, 1, 1), (len(cache), cache.hits, cache.misses))
+
+    def test_parser_args_in_key(self):
+        cache = ParseCache()
+
+        converted = cache.render(CacheParser, "a\nb", newline_behaviour="convert")
+        removed = cache.render(CacheParser, "a\nb", newline_behaviour="remove")
+
+        self.assertEqual("a<br />b", converted)
+        self.assertEqual("ab", removed)
+        self.assertEqual(2, len(cache))
+
+    def test_eviction(self):
+        cache = ParseCache(max_size=400)
+
+        for i in range(10):
+            cache.render(CacheParser, "[b]{}[/b]".format(i) * 10)
+
+        self.assertLessEqual(cache.size, 400)
+        self.assertGreater(cache.evictions, 0)
+        self.assertEqual(10, len(cache) + cache.evictions)
+
+    def test_lru_order(self):
+        text_a, text_b, text_c = "a" * 100, "b" * 100, "c" * 100
+        cache = ParseCache()
+        for text in [text_a, text_b, text_c]:
+            cache.render(CacheParser, text)
+        cache.max_size = cache.size - 1
+
+        # a is used, so b is the least recently used
+        cache.render(CacheParser, text_a)
+        cache.render(CacheParser, "d")
+
+        hits = cache.hits
+        cache.render(CacheParser, text_a)
+        cache.render(CacheParser, text_c)
+        self.assertEqual(hits + 2, cache.hits)
+        cache.render(CacheParser, text_b)
+        self.assertEqual(hits + 2, cache.hits)
+
+    def test_context_not_cached(self):
+        cache = ParseCache()
+
+        self.assertEqual("x", cache.render(CacheParser, "[name][/name]", {"name": "x"}))
+        self.assertEqual("y", cache.render(CacheParser, "[name][/name]", {"name": "y"}))
+        self.assertEqual(0, len(cache))
+
+    def test_cache_trees(self):
+        cache = ParseCache(cache_trees=True)
+
+        first = cache.parse(CacheParser, "[name][/name]")
+        second = cache.parse(CacheParser, "[name][/name]")
+
+        self.assertIs(first, second)
+        self.assertEqual("x", cache.render(CacheParser, "[name][/name]", {"name": "x"}))
+        self.assertEqual(2, cache.hits)
+
+    def test_decorator(self):
+        cache = ParseCache()
+
+        @cache
+        class DecoratedParser(CacheParser):
+            pass
+
+        self.assertIs(cache, DecoratedParser.parse_cache)
+        self.assertEqual("<b>a</b>", DecoratedParser.cached_render("[b]a[/b]"))
+        self.assertEqual("<b>a</b>", DecoratedParser.cached_render("[b]a[/b]"))
+        self.assertEqual(1, cache.hits)
+        self.assertIsNone(CacheParser.parse_cache)
+        self.assertEqual("<b>a</b>", CacheParser.cached_render("[b]a[/b]"))
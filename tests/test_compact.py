@@ -0,0 +1,182 @@
+import unittest
+from unittest import mock
+
+from bbcondeparser import (
+    BaseHTMLRenderTreeParser,
+    BaseHTMLTag,
+    BaseTreeParser,
+    HtmlSimpleTag,
+    SimpleTag,
+)
+from bbcondeparser.compact import CompactTree, NodeRef
+
+
+class BoldTag(HtmlSimpleTag):
+    tag_name = "b"
+    template = "<b>{{ body }}</b>"
+
+
+class ImgTag(BaseHTMLTag):
+    tag_name = "img"
+    self_closing = True
+    attr_defs = {"src": {}}
+
+    def _render(self):
+        return '<img src="{}" />'.format(self.attrs["src"])
+
+
+class ItemTag(HtmlSimpleTag):
+    tag_name = "item"
+    template = "<li>{{ body }}</li>"
+
+
+class ListTag(BaseHTMLTag):
+    tag_name = "list"
+    tag_display = "block"
+    allowed_tags = [ItemTag]
+
+    def __init__(self, *args, **kwargs):
+        super(ListTag, self).__init__(*args, **kwargs)
+        self._items = self.find_children_instances(ItemTag)
+
+    def _render(self):
+        return "<ul {}>{}</ul>".format(
+            self.get_context().get("list_class"),
+            "".join(item.render() for item in self._items),
+        )
+
+
+class HTMLParser(BaseHTMLRenderTreeParser):
+    tags = [BoldTag, ImgTag, ListTag]
+    convert_paragraphs = True
+    newline_behaviour = "convert"
+
+
+class PlainBold(SimpleTag):
+    tag_name = "b"
+    template = "<b>{{ body }}</b>"
+
+
+class PlainParser(BaseTreeParser):
+    tags = [PlainBold]
+
+
+HTML_TEXT = (
+    "para [b]one[/b] & <two>\nline\n\n"
+    '[img src="a.png"] [img] [b]unclosed\n\n'
+    "[list][item]x[/item][item][b]y[/b][/item][/list]\n"
+    "[/b] end"
+)
+
+
+class TestCompactTree(unittest.TestCase):
+    def test_node_round_trip(self):
+        parser = HTMLParser(HTML_TEXT)
+
+        tree = CompactTree.from_parser(parser)
+
+        self.assertEqual(parser.root_node, tree.node())
+        self.assertEqual(
+            parser.root_node.pretty_format(), tree.node().pretty_format()
+        )
+
+    def test_render(self):
+        parser = HTMLParser(HTML_TEXT)
+        ctx = {"list_class": "class-a"}
+
+        tree = CompactTree.from_parser(parser)
+
+        self.assertEqual(parser.render(ctx), tree.render(ctx))
+        self.assertEqual(parser.render(), tree.render())
+
+    def test_plain_render(self):
+        parser = PlainParser("[b]a[/b]\n\n[b]b\nc [/b]")
+
+        tree = CompactTree.from_parser(parser)
+
+        self.assertEqual(parser.render(), tree.render())
+        self.assertEqual(parser.root_node, tree.node())
+
+    def test_deep_render(self):
+        parser = PlainParser("[b]" * 3000 + "x" + "[/b]" * 3000)
+
+        tree = CompactTree.from_parser(parser)
+
+        self.assertEqual(parser.render(), tree.render())
+
+    def test_template_not_on_class(self):
+        class Quote(HtmlSimpleTag):
+            tag_name = "quote"
+
+            @property
+            def template(self):
+                return "<q>{{ body }}</q>"
+
+        class Color(HtmlSimpleTag):
+            tag_name = "color"
+            template = "<span>{{ body }}</span>"
+
+            def __init__(self, *args, **kwargs):
+                super(Color, self).__init__(*args, **kwargs)
+                self.template = '<span style="color:red">{{ body }}</span>'
+
+        class Parser(BaseHTMLRenderTreeParser):
+            tags = [Quote, Color]
+
+        parser = Parser("[quote]a[/quote][color]b[/color]")
+
+        tree = CompactTree.from_parser(parser)
+
+        self.assertEqual('<q>a</q><span style="color:red">b</span>', parser.render())
+        self.assertEqual(parser.render(), tree.render())
+
+    def test_patched_class(self):
+        class Bold(SimpleTag):
+            tag_name = "b"
+            template = "<b>{{ body }}</b>"
+
+        class Parser(BaseTreeParser):
+            tags = [Bold]
+
+        tree = CompactTree.from_parser(Parser("[b]x[/b]"))
+        self.assertEqual("<b>x</b>", tree.render())
+
+        with mock.patch.object(Bold, "template", "<i>{{ body }}</i>"):
+            self.assertEqual("<i>x</i>", tree.render())
+        with mock.patch.object(Bold, "_render", return_value="PATCHED"):
+            self.assertEqual("PATCHED", tree.render())
+        self.assertEqual("<b>x</b>", tree.render())
+
+    def test_node_references(self):
+        parser = HTMLParser(
+            "[list][item]x[/item][item]y[/item][/list]", convert_paragraphs=False
+        )
+
+        tree = CompactTree.from_parser(parser)
+        list_index = tree.get_children(0)[0]
+
+        self.assertEqual(
+            [NodeRef(index) for index in tree.get_children(list_index)],
+            tree.get_state(list_index)["_items"],
+        )
+        list_node = tree.node(list_index)
+        self.assertEqual(list_node.tree, list_node._items)
+        self.assertIs(list_node.tree[0], list_node._items[0])
+
+    def test_states_shared(self):
+        parser = HTMLParser("[b]a[/b][b]b[/b][b]c[/b]", convert_paragraphs=False)
+
+        tree = CompactTree.from_parser(parser)
+
+        self.assertEqual(7, len(tree))
+        bold_states = set(tree.state_ids[index] for index in tree.get_children(0))
+        self.assertEqual(1, len(bold_states))
+
+    def test_nodes_not_shared(self):
+        parser = HTMLParser('[img src="a.png"]', convert_paragraphs=False)
+        tree = CompactTree.from_parser(parser)
+
+        first = tree.node()
+        first.tree[0].attrs["src"] = "b.png"
+
+        self.assertEqual("a.png", tree.node().tree[0].attrs["src"])
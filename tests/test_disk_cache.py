@@ -0,0 +1,96 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from bbcondeparser import BaseHTMLRenderTreeParser, HtmlSimpleTag
+from bbcondeparser.disk_cache import DiskRenderCache
+
+
+class BoldTag(HtmlSimpleTag):
+    tag_name = "b"
+    template = "<b>{{ body }}</b>"
+
+
+class DiskCacheParser(BaseHTMLRenderTreeParser):
+    tags = [BoldTag]
+
+
+class ItalicTag(HtmlSimpleTag):
+    tag_name = "b"
+    template = "<i>{{ body }}</i>"
+
+
+class OtherParser(BaseHTMLRenderTreeParser):
+    tags = [ItalicTag]
+
+
+def _put_from_process(path):
+    cache = DiskRenderCache(path)
+    cache.put(DiskCacheParser, "from child", "<child />")
+
+
+class TestDiskRenderCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "cache.sqlite")
+        self.cache = DiskRenderCache(self.path)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.dir)
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get(DiskCacheParser, "text"))
+
+        self.cache.put(DiskCacheParser, "text", "html")
+
+        self.assertEqual("html", self.cache.get(DiskCacheParser, "text"))
+        self.assertIsNone(self.cache.get(OtherParser, "text"))
+        self.assertIsNone(
+            self.cache.get(DiskCacheParser, "text", newline_behaviour="remove")
+        )
+
+    def test_render_many(self):
+        texts = ["[b]{}[/b]".format(i) for i in range(3)]
+        self.cache.put(DiskCacheParser, texts[1], "cached")
+
+        result = self.cache.render_many(DiskCacheParser, texts + [texts[0]])
+
+        self.assertEqual(["<b>0</b>", "cached", "<b>2</b>", "<b>0</b>"], result)
+        self.assertEqual(
+            ["<b>0</b>", "cached", "<b>2</b>"],
+            self.cache.get_many(DiskCacheParser, texts),
+        )
+
+    def test_bulk_batches(self):
+        texts = [str(i) for i in range(1200)]
+        self.cache.put_many(DiskCacheParser, [(text, text) for text in texts])
+
+        self.assertEqual(texts, self.cache.get_many(DiskCacheParser, texts))
+
+    def test_persists(self):
+        self.cache.put(DiskCacheParser, "text", "html")
+
+        other = DiskRenderCache(self.path)
+        try:
+            self.assertEqual("html", other.get(DiskCacheParser, "text"))
+        finally:
+            other.close()
+
+    def test_other_process(self):
+        process = multiprocessing.Process(target=_put_from_process, args=(self.path,))
+        process.start()
+        process.join()
+
+        self.assertEqual("<child />", self.cache.get(DiskCacheParser, "from child"))
+
+    def test_purge(self):
+        self.cache.put(DiskCacheParser, "text", "html")
+        self.cache.put(OtherParser, "text", "other")
+
+        self.cache.purge(DiskCacheParser)
+
+        self.assertIsNone(self.cache.get(DiskCacheParser, "text"))
+        self.assertEqual("other", self.cache.get(OtherParser, "text"))
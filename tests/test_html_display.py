@@ -1,5 +1,6 @@
 import unittest
 
+from bbcondeparser import tree_parser
 from bbcondeparser import (
     ErrorText,
     TagCategory,
@@ -672,3 +673,14 @@ class ParentScopeTest(BaseTest):
 
         for node in root_node.tree:
             self.assertEqual(node._parent_node, root_node)
+
+
+class ReparseTests(unittest.TestCase):
+    def test_reparse_paragraphs(self):
+        parser = ParagraphNewlinesParser("a\n\n[b]bold[/b] text\nmore\n\nend")
+        parser.reparse(tree_parser.TextEdit(8, 8, "er\n[i]it[/i]"))
+
+        expected = ParagraphNewlinesParser(parser.raw_text)
+
+        self.assertEqual(expected.root_node, parser.root_node)
+        self.assertEqual(expected.render(), parser.render())
@@ -1,6 +1,7 @@
 import unittest
 
 from bbcondeparser import html_tags
+from bbcondeparser.tree_parser import TextEdit
 
 
 class TestBaseHTMLTagMeta(unittest.TestCase):
@@ -10,3 +11,131 @@ class TestBaseHTMLTagMeta(unittest.TestCase):
             class BadTag(html_tags.BaseHTMLTag):
                 tag_name = "bad_tag"
                 newline_behaviour = "butts"
+
+
+class TestHtmlSimpleTag(unittest.TestCase):
+    def test_template_property(self):
+        class Quote(html_tags.HtmlSimpleTag):
+            tag_name = "quote"
+
+            @property
+            def template(self):
+                return "<q>{{ body }}</q>"
+
+        class Parser(html_tags.BaseHTMLRenderTreeParser):
+            tags = [Quote]
+
+        self.assertEqual("a<q>b</q>", Parser("a[quote]b[/quote]").render())
+
+    def test_template_set_on_instance(self):
+        class Color(html_tags.HtmlSimpleTag):
+            tag_name = "color"
+            template = "<span>{{ body }}</span>"
+
+            def __init__(self, *args, **kwargs):
+                super(Color, self).__init__(*args, **kwargs)
+                self.template = '<span style="color:red">{{ body }}</span>'
+
+        class Parser(html_tags.BaseHTMLRenderTreeParser):
+            tags = [Color]
+
+        self.assertEqual(
+            '<span style="color:red">x</span>', Parser("[color]x[/color]").render()
+        )
+
+
+class TestTrimWhitespace(unittest.TestCase):
+    def test_trimmed_render(self):
+        class Quote(html_tags.HtmlSimpleTag):
+            tag_name = "quote"
+            template = " <q> {{ body }} </q> "
+            trim_whitespace = True
+
+        class Trim(html_tags.HtmlSimpleTag):
+            tag_name = "trim"
+            trim_whitespace = True
+
+        class Parser(html_tags.BaseHTMLRenderTreeParser):
+            tags = [Quote, Trim]
+
+        parser = Parser("a[quote] x [trim] y [/trim] [/quote]b")
+        self.assertEqual("a<q>  x y  </q>b", parser.render())
+        self.assertEqual(
+            "a<q>  x y  </q>b", "".join(parser.iter_render(chunk_size=1))
+        )
+        self.assertEqual(
+            parser.root_node.render_children(),
+            "".join(child.render() for child in parser.root_node.tree),
+        )
+
+    def test_render_text(self):
+        class Quote(html_tags.HtmlSimpleTag):
+            tag_name = "quote"
+            template = "<q>{{ body }}</q>"
+            tag_display = "block"
+
+        class Parser(html_tags.BaseHTMLRenderTreeParser):
+            tags = [Quote]
+            convert_paragraphs = True
+
+        text = "a <x>\nb\n\nc[quote] d [/quote]e"
+        self.assertEqual("a <x> b\nc\nd\ne", Parser(text).render_text())
+        self.assertEqual("a <x> b\nc\nd\ne", Parser.extract_text(text))
+
+    def test_trimmed_render_truncated(self):
+        class Quote(html_tags.HtmlSimpleTag):
+            tag_name = "quote"
+            template = " <q> {{ body }} </q> "
+            trim_whitespace = True
+
+        class Parser(html_tags.BaseHTMLRenderTreeParser):
+            tags = [Quote]
+
+        parser = Parser("a[quote] <x> y [/quote]b")
+        self.assertEqual("a<q>  &lt;x&gt; y  </q>b", parser.render_truncated(20))
+        self.assertEqual("a<q>  &lt;x- </q>", parser.render_truncated(4, "-"))
+
+
+class TestDeepNesting(unittest.TestCase):
+    def setUp(self):
+        class Quote(html_tags.HtmlSimpleTag):
+            tag_name = "quote"
+            template = "<q>{{ body }}</q>"
+            tag_display = "block"
+            convert_paragraphs = True
+
+        class Bold(html_tags.HtmlSimpleTag):
+            tag_name = "b"
+            template = "<b>{{ body }}</b>"
+
+        class Parser(html_tags.BaseHTMLRenderTreeParser):
+            tags = [Quote, Bold]
+            convert_paragraphs = True
+
+        self.parser_cls = Parser
+
+    def test_nested_quotes(self):
+        text = "[quote]" * 3000 + "a\n\nb" + "[/quote]" * 3000
+
+        parser = self.parser_cls(text)
+
+        self.assertEqual(
+            "<q>" * 3000 + "<p>a</p><p>b</p>" + "</q>" * 3000, parser.render()
+        )
+
+    def test_nested_inline(self):
+        text = "[b]" * 3000 + "a" + "[/b]" * 3000
+
+        parser = self.parser_cls(text)
+
+        self.assertEqual(
+            "<p>" + "<b>" * 3000 + "a" + "</b>" * 3000 + "</p>", parser.render()
+        )
+
+    def test_reparse_nested(self):
+        text = "[quote]" * 3000 + "a" + "[/quote]" * 3000
+        parser = self.parser_cls(text)
+
+        parser.reparse(TextEdit(3000 * 7, 3000 * 7 + 1, "[b]b[/b]"))
+
+        self.assertEqual(self.parser_cls(parser.raw_text).render(), parser.render())
@@ -0,0 +1,93 @@
+import os
+import unittest
+
+from bbcondeparser import BaseTreeParser, SimpleTag, BaseTag
+from bbcondeparser import parallel
+
+
+class BoldTag(SimpleTag):
+    tag_name = "b"
+    template = "<b>{{ body }}</b>"
+
+
+class FailTag(BaseTag):
+    tag_name = "fail"
+
+    def _render(self):
+        raise ValueError("bad tag")
+
+
+class CrashTag(BaseTag):
+    tag_name = "crash"
+
+    def _render(self):
+        os._exit(1)
+
+
+class ParallelParser(BaseTreeParser):
+    tags = [BoldTag, FailTag, CrashTag]
+
+
+class TestRenderParallel(unittest.TestCase):
+    def test_ordered_results(self):
+        texts = ["[b]{}[/b]".format(i) for i in range(50)]
+        expected = [
+            parallel.RenderResult(ParallelParser(text).render(), None)
+            for text in texts
+        ]
+
+        result = list(
+            parallel.render_parallel(
+                iter(texts), ParallelParser, workers=2, chunksize=3, max_in_flight=2
+            )
+        )
+
+        self.assertEqual(expected, result)
+
+    def test_exception_in_render(self):
+        texts = ["a", "[fail][/fail]", "b"]
+
+        result = list(parallel.render_parallel(texts, ParallelParser, workers=2))
+
+        self.assertEqual(parallel.RenderResult("a", None), result[0])
+        self.assertEqual(None, result[1].html)
+        self.assertEqual("ValueError: bad tag", result[1].error)
+        self.assertEqual(parallel.RenderResult("b", None), result[2])
+
+    def test_worker_crash(self):
+        texts = ["a", "[crash][/crash]", "[b]b[/b]", "c"]
+
+        result = list(
+            parallel.render_parallel(texts, ParallelParser, workers=2, chunksize=2)
+        )
+
+        self.assertEqual(
+            [
+                parallel.RenderResult("a", None),
+                parallel.RenderResult(None, parallel.WORKER_CRASHED),
+                parallel.RenderResult("<b>b</b>", None),
+                parallel.RenderResult("c", None),
+            ],
+            result,
+        )
+
+    def test_worker_crash_many_in_flight(self):
+        texts = ["[b]{}[/b]".format(i) for i in range(60)]
+        for i in [7, 8, 31]:
+            texts[i] = "[crash][/crash]"
+
+        result = list(
+            parallel.render_parallel(
+                iter(texts), ParallelParser, workers=4, chunksize=2, max_in_flight=4
+            )
+        )
+
+        self.assertEqual(
+            [
+                parallel.RenderResult(None, parallel.WORKER_CRASHED)
+                if i in [7, 8, 31]
+                else parallel.RenderResult("<b>{}</b>".format(i), None)
+                for i in range(60)
+            ],
+            result,
+        )
@@ -0,0 +1,214 @@
+import marshal
+import struct
+import sys
+import unittest
+import zlib
+from array import array
+
+from bbcondeparser import BaseHTMLRenderTreeParser, BaseHTMLTag, HtmlSimpleTag
+from bbcondeparser.errors import TreeLoadError
+from bbcondeparser import serialize
+from bbcondeparser.compact import COLUMNS, TAG_NODE
+from bbcondeparser.serialize import dump_tree, load_tree
+
+
+class BoldTag(HtmlSimpleTag):
+    tag_name = "b"
+    template = "<b>{{ body }}</b>"
+
+
+class ImgTag(BaseHTMLTag):
+    tag_name = "img"
+    self_closing = True
+    attr_defs = {"src": {}, "width": {"parser": int, "default": None}}
+
+    def _render(self):
+        return '<img src="{}" width="{}" />'.format(
+            self.attrs["src"], self.attrs["width"]
+        )
+
+
+class ItemTag(HtmlSimpleTag):
+    tag_name = "item"
+    template = "<li>{{ body }}</li>"
+
+
+class ListTag(BaseHTMLTag):
+    tag_name = "list"
+    tag_display = "block"
+    allowed_tags = [ItemTag]
+
+    def __init__(self, *args, **kwargs):
+        super(ListTag, self).__init__(*args, **kwargs)
+        self._items = self.find_children_instances(ItemTag)
+
+    def _render(self):
+        return "<ul>{}</ul>".format("".join(item.render() for item in self._items))
+
+
+class SerializeParser(BaseHTMLRenderTreeParser):
+    tags = [BoldTag, ImgTag, ListTag]
+    convert_paragraphs = True
+    newline_behaviour = "convert"
+
+
+class OtherParser(BaseHTMLRenderTreeParser):
+    tags = [BoldTag]
+
+
+TEXT = (
+    "para [b]one[/b] & <two>\nline\n\n"
+    '[img src="a.png" width="10"] [img] [b]unclosed\n\n'
+    "[list][item]x[/item][item][b]y[/b][/item][/list]\n"
+    "[/b] [item]end[/item]"
+)
+
+
+class TestSerialize(unittest.TestCase):
+    def test_round_trip(self):
+        parser = SerializeParser(TEXT)
+
+        root = load_tree(dump_tree(parser.root_node, SerializeParser), SerializeParser)
+
+        self.assertEqual(parser.root_node, root)
+        self.assertEqual(parser.root_node.pretty_format(), root.pretty_format())
+        self.assertEqual(parser.render(), root.render())
+        self.assertEqual(parser.root_node.render_raw(), root.render_raw())
+
+    def test_parents(self):
+        parser = SerializeParser(TEXT)
+
+        root = load_tree(dump_tree(parser.root_node, SerializeParser), SerializeParser)
+
+        self.assertIsNone(root._parent_node)
+        for node in root.walk_tree():
+            self.assertIn(node, node._parent_node.tree)
+
+    def test_node_references(self):
+        parser = SerializeParser("[list][item]x[/item][item]y[/item][/list]")
+
+        root = load_tree(dump_tree(parser.root_node, SerializeParser), SerializeParser)
+
+        list_tag = root.tree[0]
+        self.assertIs(list_tag.tree[0].tree[0], list_tag._items[0])
+
+    def test_missing_tag(self):
+        data = dump_tree(SerializeParser("[img src='a']").root_node, SerializeParser)
+
+        with self.assertRaises(TreeLoadError):
+            load_tree(data, OtherParser)
+
+    def test_malformed(self):
+        data = dump_tree(SerializeParser(TEXT).root_node, SerializeParser)
+
+        for bad_data in [b"", b"nope", data[:-10], data[:4] + b"\0" + data[5:]]:
+            with self.assertRaises(TreeLoadError):
+                load_tree(bad_data, SerializeParser)
+
+    def change_dump(self, data, change_columns=None, change_states=None):
+        """returns `data` with its columns and states changed by the given
+            functions, and a header to match
+        """
+        header_size = len(serialize.MAGIC) + serialize._HEADER.size
+        byteorder, source, class_descs, column_data, states = marshal.loads(
+            data[header_size:]
+        )
+        columns = {}
+        for name, (typecode, column_bytes) in zip(COLUMNS, column_data):
+            columns[name] = array(typecode, zlib.decompress(column_bytes))
+        if change_columns is not None:
+            change_columns(columns)
+        if change_states is not None:
+            change_states(states)
+
+        column_data = [
+            (columns[name].typecode, zlib.compress(columns[name].tobytes()))
+            for name in COLUMNS
+        ]
+        body = marshal.dumps((byteorder, source, class_descs, column_data, states))
+        return data[: header_size - 4] + struct.pack("<I", zlib.crc32(body)) + body
+
+    def test_unchanged_dump(self):
+        parser = SerializeParser(TEXT)
+        data = self.change_dump(dump_tree(parser.root_node, SerializeParser))
+
+        self.assertEqual(parser.render(), load_tree(data, SerializeParser).render())
+
+    def test_corrupt(self):
+        data = dump_tree(SerializeParser(TEXT).root_node, SerializeParser)
+
+        for index in range(len(serialize.MAGIC), len(data), 7):
+            bad_data = bytearray(data)
+            bad_data[index] ^= 0xFF
+            with self.assertRaises(TreeLoadError):
+                load_tree(bytes(bad_data), SerializeParser)
+
+    def test_other_python_version(self):
+        data = dump_tree(SerializeParser(TEXT).root_node, SerializeParser)
+        minor_index = len(serialize.MAGIC) + 3
+        self.assertEqual(sys.version_info[1], data[minor_index])
+
+        bad_data = data[:minor_index] + b"\xff" + data[minor_index + 1 :]
+        with self.assertRaises(TreeLoadError):
+            load_tree(bad_data, SerializeParser)
+
+    def test_kind_not_class(self):
+        data = dump_tree(SerializeParser("a").root_node, SerializeParser)
+
+        def make_text_tag(columns):
+            # root, paragraph, text
+            columns["kinds"][2] = TAG_NODE
+
+        with self.assertRaises(TreeLoadError):
+            load_tree(self.change_dump(data, make_text_tag), SerializeParser)
+
+    def test_bad_links(self):
+        data = dump_tree(
+            SerializeParser("a [b]b[/b] [b]c[/b]").root_node, SerializeParser
+        )
+
+        # root, paragraph, "a ", [b], "b", " ", [b], "c"
+        def share_child(columns):
+            # both [b] tags claim the same child
+            columns["first_children"][6] = columns["first_children"][3]
+
+        def lose_child(columns):
+            columns["next_siblings"][2] = -1
+
+        def wrong_parent(columns):
+            columns["parents"][4] = 1
+
+        for change in [share_child, lose_child, wrong_parent]:
+            with self.assertRaises(TreeLoadError):
+                load_tree(self.change_dump(data, change), SerializeParser)
+
+    def test_bad_state(self):
+        data = dump_tree(SerializeParser("[b]a[/b]").root_node, SerializeParser)
+
+        for key in ["__class__", "_tree", "tree", "render", "text"]:
+
+            def add_key(states):
+                states.append([(key, None)])
+
+            def use_state(columns):
+                columns["state_ids"][1] = max(columns["state_ids"]) + 1
+
+            bad_data = self.change_dump(data, use_state, add_key)
+            with self.assertRaises(TreeLoadError, msg=key):
+                load_tree(bad_data, SerializeParser)
+
+    def test_bad_location(self):
+        data = dump_tree(SerializeParser("[b]a[/b]").root_node, SerializeParser)
+
+        def move_past_end(columns):
+            columns["ends"][1] = 100
+
+        with self.assertRaises(TreeLoadError):
+            load_tree(self.change_dump(data, move_past_end), SerializeParser)
+
+    def test_unserializable_attr(self):
+        parser = SerializeParser("[b]a[/b]")
+        parser.root_node.tree[0].tree[0].extra = object()
+
+        with self.assertRaises(ValueError):
+            dump_tree(parser.root_node, SerializeParser)
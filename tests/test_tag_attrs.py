@@ -255,3 +255,62 @@ class TestAttributes(unittest.TestCase):
 
         self._test(input_text, expected_text, expected_tree, TestParser)
 
+
+class TestAttrParsing(unittest.TestCase):
+    def setUp(self):
+        calls = self.calls = []
+
+        def parse_size(value):
+            calls.append(value)
+            return int(value)
+
+        class Embed(MockBaseTag):
+            tag_name = "embed"
+            attr_defs = {"size": {"parser": parse_size}}
+
+        class Img(MockBaseTag):
+            tag_name = "img"
+            self_closing = True
+            attr_defs = {"size": {"parser": parse_size}}
+
+        self.Embed = Embed
+        self.Img = Img
+
+    def parse(self, text):
+        class TestParser(MockTreeParser):
+            tags = [self.Embed, self.Img]
+
+        return TestParser(text)
+
+    def test_parsed_once(self):
+        inst = self.parse('[embed size="1"]a[/embed][img size="2"]')
+
+        self.assertEqual(["1", "2"], self.calls)
+        embed, img = inst.root_node.tree
+        self.assertEqual({"size": 1}, embed.attrs)
+        self.assertEqual({"size": 2}, img.attrs)
+
+    def test_cache_attrs(self):
+        self.Embed.cache_attrs = True
+        self.Img.cache_attrs = True
+
+        inst = self.parse('[embed size="1"][img size="2"][img size="2"][/embed]' * 3)
+
+        self.assertEqual(["1", "2"], self.calls)
+        embeds = inst.root_node.tree
+        self.assertEqual(3, len(embeds))
+        # Tags don't share their attrs
+        embeds[0].attrs["size"] = 5
+        self.assertEqual({"size": 1}, embeds[1].attrs)
+        self.assertEqual({"size": 2}, embeds[2].tree[0].attrs)
+
+    def test_cache_attrs_errors(self):
+        self.Img.cache_attrs = True
+
+        inst = self.parse('[img size="x"][img size="x"]')
+
+        self.assertEqual(["x"], self.calls)
+        self.assertEqual(
+            [ErrorText('[img size="x"]'), ErrorText('[img size="x"]')],
+            inst.root_node.tree,
+        )
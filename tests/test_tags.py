@@ -1,4 +1,7 @@
+import gc
 import unittest
+import weakref
+from unittest import mock
 
 from bbcondeparser import tags
 
@@ -53,6 +56,23 @@ class TestTagCategory(unittest.TestCase):
 
         self.assertEqual(expected_tag_classes, category.tag_classes)
 
+    def test_name_clash(self):
+        category = tags.TagCategory("Test goat")
+
+        class Tag1(tags.BaseTag):
+            tag_name = "cheese"
+
+        class Tag2(tags.BaseTag):
+            tag_name = "cheese"
+
+        category.add_tag_cls(Tag1)
+        with self.assertRaises(ValueError):
+            category.add_tag_cls(Tag2)
+
+        category.remove_tag_cls(Tag1)
+        category.add_tag_cls(Tag2)
+        self.assertEqual({Tag2}, category.tag_classes)
+
 
 class TestAllowedTags(unittest.TestCase):
     def test_none_defined(self):
@@ -215,3 +235,748 @@ class TestTagWalkTree(unittest.TestCase):
             a_b_tag,
         ]
         self.assertEqual(test_children, expected_children)
+
+
+class TestFindChildrenInstances(unittest.TestCase):
+    def test_extra_replaced(self):
+        class Item(tags.BaseTag):
+            tag_name = "item"
+
+        first = Item({}, [], "[item]", "[/item]")
+        second = Item({}, [], "[item]", "[/item]")
+        parent = tags.BaseTag({}, [first, tags.RawText("a"), second], "", "")
+        old_tree = parent.tree
+
+        result = parent.find_children_instances(Item, multi=False)
+
+        self.assertIs(second, result)
+        self.assertEqual(
+            [tags.ErrorText("[item][/item]"), tags.RawText("a"), second], parent.tree
+        )
+        # The tree is swapped for a new list, not changed in place
+        self.assertIsNot(old_tree, parent.tree)
+        self.assertIs(first, old_tree[0])
+
+        # Further calls find the same thing
+        self.assertIs(second, parent.find_children_instances(Item, multi=False))
+
+
+class TestSource(unittest.TestCase):
+    def test_text_from_source(self):
+        source = tags.Source("abc def")
+        node = tags.RawText("def")
+
+        node.set_source(source, (4, 7))
+
+        self.assertIsNone(node._text)
+        self.assertEqual("def", node.text)
+
+        node.text = "xyz"
+        self.assertEqual("xyz", node.text)
+        self.assertEqual("xyz", node._text)
+
+    def test_text_not_in_source(self):
+        source = tags.Source("abc def")
+        node = tags.RawText("abc")
+
+        node.set_source(source, (4, 7))
+
+        self.assertEqual("abc", node._text)
+        self.assertEqual("abc", node.text)
+        self.assertEqual((4, 7), node.location)
+
+    def test_newlines_from_source(self):
+        source = tags.Source("a\n\r\nb")
+        node = tags.NewlineText("\n")
+        node.set_source(source, (1, 2))
+
+        node.add_newline("\r\n", (2, 4))
+
+        self.assertIsNone(node._text)
+        self.assertEqual("\n\r\n", node.text)
+        self.assertEqual(2, node.count)
+
+    def test_tag_text_from_source(self):
+        source = tags.Source("x [b]y[/b]")
+        tag = tags.BaseTag({}, [tags.RawText("y")], "[b]", "[/b]")
+
+        tag.set_source(source, (2, 10))
+
+        self.assertEqual(3, tag._start_text)
+        self.assertEqual("[b]", tag.start_text)
+        self.assertEqual("[/b]", tag.end_text)
+
+        tag.end_text = ""
+        self.assertEqual("[b]", tag._start_text)
+        self.assertEqual("[b]", tag.start_text)
+        self.assertEqual("", tag.end_text)
+
+    def test_edited_source(self):
+        source = tags.Source("ab cd ef")
+        before = tags.RawText("ab")
+        spanning = tags.RawText("ab cd")
+        after = tags.RawText("ef")
+        before.set_source(source, (0, 2))
+        spanning.set_source(source, (0, 5))
+        after.set_source(source, (6, 8))
+
+        source = source.edited(5, 2, "ab cdxx ef")
+        source.edited(10, -1, "ab cdxx f")
+
+        self.assertEqual((0, 2), before.location)
+        self.assertEqual("ab", before.text)
+        self.assertEqual("ab cdxx", spanning.text)
+        self.assertEqual((0, 7), spanning.location)
+        self.assertEqual("f", after.text)
+        self.assertEqual((8, 9), after.location)
+
+
+class TestSlots(unittest.TestCase):
+    def test_library_nodes_slotted(self):
+        for node in [
+            tags.RawText("a"),
+            tags.NewlineText("\n"),
+            tags.ErrorText("a"),
+            tags.RootTag({}, [], "", ""),
+        ]:
+            self.assertFalse(hasattr(node, "__dict__"), node)
+
+    def test_library_nodes_weakref(self):
+        for node in [
+            tags.RawText("a"),
+            tags.NewlineText("\n"),
+            tags.ErrorText("a"),
+            tags.RootTag({}, [], "", ""),
+        ]:
+            self.assertIs(node, weakref.ref(node)())
+
+    def test_location(self):
+        node = tags.RawText("a")
+        self.assertIsNone(node.location)
+
+        node.location = (1, 2)
+        self.assertEqual((1, 2), node.location)
+        self.assertEqual((1, 2), (node._start, node._end))
+
+        node.location = None
+        self.assertIsNone(node.location)
+
+    def test_subclasses_can_add_attributes(self):
+        class Text(tags.RawText):
+            def __init__(self, text):
+                super(Text, self).__init__(text)
+                self.extra = 1
+
+        class Tag(tags.BaseTag):
+            tag_name = "tag"
+
+            def __init__(self, *args, **kwargs):
+                super(Tag, self).__init__(*args, **kwargs)
+                self.extra = 2
+
+        self.assertEqual(1, Text("a").extra)
+        self.assertEqual(2, Tag({}, [], "[tag]", "[/tag]").extra)
+
+
+class TestRenderNodes(unittest.TestCase):
+    class B(tags.SimpleTag):
+        tag_name = "b"
+        template = "<b>{{ body }}</b>"
+
+    class Shout(tags.SimpleTag):
+        tag_name = "shout"
+
+        def _render(self):
+            return self.render_children().upper()
+
+    def test_templates(self):
+        tree = [
+            tags.RawText("a"),
+            self.B({}, [tags.RawText("b"), self.B({}, [], "", "")], "", ""),
+            tags.RawText("c"),
+        ]
+        self.assertEqual("a<b>b<b></b></b>c", tags.render_nodes(tree))
+
+    def test_custom_render_used(self):
+        inner = self.B({}, [tags.RawText("x")], "", "")
+        shout = self.Shout({}, [inner], "", "")
+        self.assertEqual("<B>X</B>", tags.render_nodes([shout]))
+
+    def test_repeated_replace_text_rendered_by_tag(self):
+        class Twice(tags.SimpleTag):
+            tag_name = "twice"
+            template = "{{ body }}{{ body }}"
+
+        tag = Twice({}, [tags.RawText("x")], "", "")
+        self.assertEqual("xx", tags.render_nodes([tag]))
+
+    def test_patched_class(self):
+        class B(tags.SimpleTag):
+            tag_name = "b"
+            template = "<b>{{ body }}</b>"
+
+        class SubB(B):
+            pass
+
+        tree = [B({}, [tags.RawText("x")], "", ""), SubB({}, [], "", "")]
+        self.assertEqual("<b>x</b><b></b>", tags.render_nodes(tree))
+
+        with mock.patch.object(B, "_render", return_value="PATCHED"):
+            self.assertEqual("PATCHEDPATCHED", tags.render_nodes(tree))
+        self.assertEqual("<b>x</b><b></b>", tags.render_nodes(tree))
+
+        B.render = lambda self: "ASSIGNED"
+        self.assertEqual("ASSIGNEDASSIGNED", tags.render_nodes(tree))
+        del B.render
+        self.assertEqual("<b>x</b><b></b>", tags.render_nodes(tree))
+
+    def test_deep_nesting(self):
+        node = tags.RawText("x")
+        for _ in range(5000):
+            node = self.B({}, [node], "", "")
+
+        self.assertEqual(
+            "<b>" * 5000 + "x" + "</b>" * 5000, tags.render_nodes([node])
+        )
+
+
+class TestRenderTruncated(unittest.TestCase):
+    class B(tags.SimpleTag):
+        tag_name = "b"
+        template = "<b>{{ body }}</b>"
+
+    class Shout(tags.SimpleTag):
+        tag_name = "shout"
+
+        def _render(self):
+            return self.render_children().upper()
+
+    def setUp(self):
+        inner = self.B({}, [tags.RawText("ghi")], "", "")
+        self.root = tags.RootTag(
+            {},
+            [
+                tags.RawText("abc "),
+                self.B({}, [tags.RawText("def "), inner], "", ""),
+                tags.RawText(" "),
+                self.Shout({}, [tags.RawText("jkl")], "", ""),
+            ],
+            "",
+            "",
+        )
+
+    def test_cut_within_tags(self):
+        self.assertEqual("\u2026", self.root.render_truncated(0))
+        self.assertEqual("ab...", self.root.render_truncated(2, "..."))
+        self.assertEqual("abc <b>d...</b>", self.root.render_truncated(5, "..."))
+        self.assertEqual(
+            "abc <b>def <b>gh...</b></b>", self.root.render_truncated(10, "...")
+        )
+
+    def test_custom_render_left_out_unless_it_fits(self):
+        self.assertEqual(
+            "abc <b>def <b>ghi</b></b> ...", self.root.render_truncated(13, "...")
+        )
+        self.assertEqual(
+            "abc <b>def <b>ghi</b></b> JKL", self.root.render_truncated(15, "...")
+        )
+
+    def test_not_cut(self):
+        self.assertEqual(self.root.render(), self.root.render_truncated(15))
+        self.assertEqual(self.root.render(), self.root.render_truncated(100))
+
+    def test_rest_not_rendered(self):
+        class Fail(tags.SimpleTag):
+            tag_name = "fail"
+
+            def _render(self):
+                raise AssertionError("rendered")
+
+        tree = [tags.RawText("abc"), Fail({}, [], "", "")]
+        self.assertEqual("ab-", tags.render_nodes_truncated(tree, 2, "-"))
+
+    def test_deep(self):
+        node = tags.RawText("x" * 10)
+        for _ in range(5000):
+            node = self.B({}, [node], "", "")
+
+        self.assertEqual(
+            "<b>" * 5000 + "xxx-" + "</b>" * 5000, node.render_truncated(3, "-")
+        )
+
+
+class TestRenderText(unittest.TestCase):
+    class B(tags.SimpleTag):
+        tag_name = "b"
+        template = "<b>{{ body }}</b>"
+
+    class Block(tags.SimpleTag):
+        tag_name = "block"
+        template = "<div>{{ body }}</div>"
+        text_block = True
+
+    class Image(tags.SimpleTag):
+        tag_name = "img"
+        attr_defs = {"alt": {}}
+
+        def get_plain_text(self):
+            return self.attrs.get("alt", "")
+
+    def test_text(self):
+        tree = [
+            tags.RawText("  a  <b> "),
+            self.B({}, [tags.RawText("b"), self.B({}, [], "", "")], "", ""),
+            tags.NewlineText("\n"),
+            tags.RawText("\tc "),
+        ]
+        root = tags.RootTag({}, tree, "", "")
+        self.assertEqual("a <b> b c", root.render_text())
+
+    def test_blocks(self):
+        newlines = tags.NewlineText("\n")
+        newlines.add_newline("\n")
+        tree = [
+            tags.RawText("a"),
+            self.Block({}, [tags.RawText(" b "), self.Block({}, [], "", "")], "", ""),
+            tags.RawText("c "),
+            newlines,
+            tags.RawText(" d"),
+        ]
+        self.assertEqual("a\nb\nc\nd", tags.render_nodes_text(tree))
+        self.assertEqual("a | b | c | d", tags.render_nodes_text(tree, " | "))
+
+    def test_get_plain_text(self):
+        image = self.Image([("alt", "a cat")], [tags.RawText("cat.png")], "", "")
+        tree = [tags.RawText("see "), image]
+        self.assertEqual("see a cat", tags.render_nodes_text(tree))
+
+        null_image = self.Image.null_class({}, [tags.RawText("cat.png")], "", "")
+        self.assertEqual("cat.png", null_image.render_text())
+
+    def test_deep(self):
+        node = tags.RawText("x")
+        for _ in range(5000):
+            node = self.Block({}, [node], "", "")
+
+        self.assertEqual("x", node.render_text())
+
+
+class TestRenderCache(unittest.TestCase):
+    def setUp(self):
+        renders = self.renders = []
+
+        class Cached(tags.SimpleTag):
+            tag_name = "cached"
+            cache_render = True
+
+            def _render(self):
+                renders.append(self)
+                return "<{}>".format(self.render_children())
+
+        self.Cached = Cached
+
+    def make_tree(self):
+        text = tags.RawText("x")
+        inner = self.Cached({}, [text], "", "")
+        outer = self.Cached({}, [inner], "", "")
+        root = tags.RootTag({}, [outer], "", "")
+        return root, outer, inner, text
+
+    def test_rendered_once(self):
+        root, outer, inner, text = self.make_tree()
+
+        self.assertEqual("<<x>>", root.render())
+        self.assertEqual("<<x>>", root.render())
+        self.assertEqual([outer, inner], self.renders)
+
+    def test_context_change(self):
+        root, outer, inner, text = self.make_tree()
+
+        class Parser(object):
+            context = {"a": 1}
+
+            def get_context(self):
+                return self.context
+
+        parser = Parser()
+        root.set_parent_node(parser)
+
+        root.render()
+        parser.context = {"a": 2}
+        root.render()
+        parser.context = {"a": []}
+        root.render()
+        root.render()
+
+        self.assertEqual(8, len(self.renders))
+
+    def test_turned_on_after_rendering(self):
+        self.Cached.cache_render = False
+        root, outer, inner, text = self.make_tree()
+        self.assertEqual("<<x>>", root.render())
+        self.assertIsNone(outer._render_cache)
+
+        self.Cached.cache_render = True
+        self.assertEqual("<<x>>", root.render())
+        self.assertEqual("<<x>>", root.render())
+
+        self.assertEqual(4, len(self.renders))
+        self.assertIsNotNone(outer._render_cache)
+
+    def test_text_changed(self):
+        root, outer, inner, text = self.make_tree()
+        root.render()
+
+        text.text = "y"
+
+        self.assertEqual("<<y>>", root.render())
+        self.assertEqual(4, len(self.renders))
+
+    def test_tree_changed(self):
+        root, outer, inner, text = self.make_tree()
+        sibling = self.Cached({}, [], "", "")
+        root.render()
+
+        inner.tree = [tags.RawText("z")]
+        self.assertEqual("<<z>>", root.render())
+
+        # moving a node changes where it was and where it goes to
+        outer.tree.append(sibling)
+        sibling.set_parent_node(outer)
+        self.assertEqual("<<z><>>", root.render())
+
+        inner.tree.append(tags.RawText("!"))
+        inner.invalidate()
+        self.assertEqual("<<z!><>>", root.render())
+
+    def test_unchanged_siblings_kept(self):
+        first = self.Cached({}, [tags.RawText("a")], "", "")
+        second = self.Cached({}, [tags.RawText("b")], "", "")
+        root = tags.RootTag({}, [first, second], "", "")
+        root.render()
+
+        second.tree[0].text = "c"
+
+        self.assertEqual("<a><c>", root.render())
+        self.assertEqual([first, second, second], self.renders)
+
+
+class TestRenderContext(unittest.TestCase):
+    def setUp(self):
+        calls = self.calls = []
+
+        class Level(tags.SimpleTag):
+            tag_name = "level"
+
+            def get_context(self):
+                calls.append(self)
+                ctx = dict(super(Level, self).get_context())
+                ctx["depth"] = ctx.get("depth", 0) + 1
+                return ctx
+
+        class Depth(tags.SimpleTag):
+            tag_name = "depth"
+
+            def _render(self):
+                return "{}{}".format(
+                    self.get_context()["depth"], self.render_children()
+                )
+
+        self.Level = Level
+        self.Depth = Depth
+
+    def nest(self, node, depth, tag_cls):
+        for _ in range(depth):
+            node = tag_cls({}, [node], "", "")
+        return node
+
+    def test_context_found_once(self):
+        inner = self.Depth({}, [self.Depth({}, [], "", "")], "", "")
+        tree = self.nest(inner, 3, self.Level)
+        sibling = self.Level({}, [], "", "")
+
+        self.assertEqual("33", tags.render_nodes([tree, sibling]))
+        self.assertEqual(3, len(self.calls))
+        # Outside rendering the context is found as usual
+        self.assertEqual(3, inner.get_context()["depth"])
+
+    def test_deep_tree(self):
+        tree = self.nest(self.Depth({}, [], "", ""), 5000, self.Level)
+
+        self.assertEqual("5000", tags.render_nodes([tree]))
+        self.assertEqual(5000, len(self.calls))
+
+    def test_context_not_seen_between_chunks(self):
+        first = self.nest(self.Depth({}, [], "", ""), 2, self.Level)
+        second = self.Depth({}, [], "", "")
+        second.set_parent_node(first)
+
+        chunks = tags.iter_render_nodes([first, tags.RawText("x")], 1)
+
+        self.assertEqual("2", next(chunks))
+        # `first` isn't being rendered as far as anything else can tell
+        self.assertEqual(1, second.get_context()["depth"])
+        self.assertEqual("x", next(chunks))
+
+
+class TestFindAll(unittest.TestCase):
+    class B(tags.SimpleTag):
+        tag_name = "b"
+
+    class I(tags.SimpleTag):
+        tag_name = "i"
+
+    class Img(tags.SimpleTag):
+        tag_name = "img"
+
+    class BigImg(Img):
+        tag_name = "bigimg"
+
+    def make_tree(self):
+        def tag(cls, *tree):
+            return cls({}, list(tree), "", "")
+
+        self.img1 = tag(self.Img)
+        self.big = tag(self.BigImg)
+        self.img2 = tag(self.Img)
+        self.i = tag(self.I, tags.RawText("x"), self.big)
+        self.b = tag(self.B, self.img1, self.i)
+        return tag(tags.RootTag, self.b, tags.RawText("y"), self.img2)
+
+    def test_root(self):
+        root = self.make_tree()
+
+        self.assertEqual([self.img1, self.big, self.img2], root.find_all(self.Img))
+        self.assertEqual([self.big], root.find_all(self.BigImg))
+        self.assertEqual([self.img1, self.img2], root.find_all("img"))
+        self.assertEqual([], root.find_all(tags.RootTag))
+
+    def test_subtree(self):
+        root = self.make_tree()
+
+        self.assertEqual([self.img1, self.big], self.b.find_all(self.Img))
+        self.assertEqual([self.i], self.b.find_all("i"))
+        self.assertEqual([], self.i.find_all(self.B))
+
+    def test_same_as_walk_tree(self):
+        root = self.make_tree()
+
+        for tag in [tags.BaseTag, tags.SimpleTag, self.B, "b", "nope"]:
+            for node in [root, self.b]:
+                self.assertEqual(
+                    [
+                        child
+                        for child in node.walk_tree()
+                        if isinstance(child, tags.BaseTag)
+                        and tags._tag_matches(type(child), tag)
+                    ],
+                    node.find_all(tag),
+                )
+
+    def test_contains_tag(self):
+        root = self.make_tree()
+
+        self.assertTrue(root.contains_tag(self.BigImg))
+        self.assertTrue(self.i.contains_tag("bigimg"))
+        self.assertFalse(self.i.contains_tag(self.I))
+        self.assertFalse(self.img2.contains_tag(self.Img))
+
+    def test_changes(self):
+        root = self.make_tree()
+        self.assertEqual([self.img1, self.big, self.img2], root.find_all(self.Img))
+
+        self.i.tree = [tags.RawText("x")]
+        self.assertEqual([self.img1, self.img2], root.find_all(self.Img))
+        self.assertFalse(self.b.contains_tag("bigimg"))
+
+        self.img2.tree.append(self.big)
+        self.big.set_parent_node(self.img2)
+        self.assertEqual([self.img1, self.img2, self.big], root.find_all(self.Img))
+        self.assertTrue(root.contains_tag("bigimg"))
+
+        new_b = self.B({}, [], "", "")
+        self.img1.tree.append(new_b)
+        self.img1.invalidate()
+        self.assertEqual([self.b, new_b], root.find_all(self.B))
+
+    def test_classes_not_kept(self):
+        def make_tag():
+            class Gone(tags.SimpleTag):
+                tag_name = "gone"
+
+            tag = Gone({}, [Gone({}, [], "", "")], "", "")
+            self.assertEqual(tag.tree, tag.find_all("gone"))
+            self.assertEqual(tag.tree, tag.find_all(Gone))
+            return weakref.ref(Gone)
+
+        tags.tag_bit(tags.RootTag)
+        bit_count = len(tags._tag_bit_classes)
+        refs = [make_tag() for _ in range(50)]
+        gc.collect()
+        self.assertEqual([None] * 50, [ref() for ref in refs])
+
+        class New(tags.SimpleTag):
+            tag_name = "new"
+
+        new = New({}, [], "", "")
+        root = tags.RootTag({}, [new], "", "")
+        self.assertEqual([new], root.find_all("new"))
+        self.assertEqual([], root.find_all("gone"))
+        # The bits of the collected classes are given out again
+        self.assertLessEqual(tags.tag_bit(New).bit_length(), bit_count + 1)
+        self.assertLessEqual(len(tags._tag_bit_classes), bit_count + 1)
+
+
+class TestTemplateParts(unittest.TestCase):
+    def render(self, tag_cls):
+        return tag_cls({}, [tags.RawText("x")], "", "").render()
+
+    def test_parts(self):
+        class Tag(tags.SimpleTag):
+            tag_name = "tag"
+            template = "<a>{{ body }}</a>"
+
+        class Repeated(tags.SimpleTag):
+            tag_name = "repeated"
+            template = "{{ body }}-{{ body }}"
+
+        class Empty(tags.SimpleTag):
+            tag_name = "empty"
+            template = "<hr />"
+
+        class NoTemplate(tags.SimpleTag):
+            tag_name = "none"
+
+        self.assertEqual(("<a>", "</a>"), Tag._template_parts)
+        self.assertEqual(("", "-", ""), Repeated._template_parts)
+        self.assertEqual("x-x", self.render(Repeated))
+        self.assertEqual("<hr />", self.render(Empty))
+        self.assertEqual("x", self.render(NoTemplate))
+
+    def test_changed_on_class(self):
+        class Tag(tags.SimpleTag):
+            tag_name = "tag"
+            template = "<a>{{ body }}</a>"
+
+        class SubTag(Tag):
+            tag_name = "subtag"
+
+        Tag.template = "<b>{{ body }}</b>"
+        self.assertEqual("<b>x</b>", self.render(SubTag))
+
+        SubTag.replace_text = "x"
+        self.assertEqual("<b>x</b>", self.render(Tag))
+        self.assertEqual(None, SubTag({}, [], "", "")._get_render_parts())
+
+        # Left to str.replace
+        SubTag.replace_text = ""
+        self.assertEqual(None, SubTag._template_parts)
+        self.assertEqual(
+            "<b>{{ body }}</b>".replace("", "x"), self.render(SubTag)
+        )
+
+    def test_patched_on_class(self):
+        class Tag(tags.SimpleTag):
+            tag_name = "tag"
+            template = "<a>{{ body }}</a>"
+
+        class SubTag(Tag):
+            tag_name = "subtag"
+
+        with mock.patch.object(SubTag, "template", "<z>{{ body }}</z>"):
+            self.assertEqual("<z>x</z>", self.render(SubTag))
+        self.assertNotIn("template", vars(SubTag))
+        self.assertEqual("<a>x</a>", self.render(SubTag))
+
+        with mock.patch.object(Tag, "replace_text", "x"):
+            self.assertEqual("<a>{{ body }}</a>", self.render(SubTag))
+        self.assertEqual("<a>x</a>", self.render(SubTag))
+
+    def test_template_property(self):
+        class Tag(tags.SimpleTag):
+            tag_name = "tag"
+
+            @property
+            def template(self):
+                return "<a>{{ body }}</a>"
+
+        self.assertEqual(None, Tag._template_parts)
+        self.assertEqual("<a>x</a>", self.render(Tag))
+        root = tags.RootTag({}, [Tag({}, [tags.RawText("x")], "", "")], "", "")
+        self.assertEqual("<a>x</a>", root.render())
+
+    def test_template_set_on_instance(self):
+        class Tag(tags.SimpleTag):
+            tag_name = "tag"
+            template = "<span>{{ body }}</span>"
+
+            def __init__(self, *args, **kwargs):
+                super(Tag, self).__init__(*args, **kwargs)
+                self.template = '<span style="color:red">{{ body }}</span>'
+
+        expected = '<span style="color:red">x</span>'
+        self.assertEqual(expected, self.render(Tag))
+        root = tags.RootTag({}, [Tag({}, [tags.RawText("x")], "", "")], "", "")
+        self.assertEqual(expected, root.render())
+
+
+class TestNullClass(unittest.TestCase):
+    def test_made_on_use(self):
+        class Tag(tags.SimpleTag):
+            tag_name = "tag"
+            template = "<a>{{ body }}</a>"
+
+        self.assertNotIn("_null_class_cache", vars(Tag))
+
+        null_cls = Tag.null_class
+        self.assertIs(null_cls, Tag.null_class)
+        self.assertIs(null_cls, Tag({}, [], "", "").null_class)
+        self.assertIs(null_cls, null_cls.null_class)
+        self.assertEqual("NullTag", null_cls.__name__)
+        self.assertEqual("tag", null_cls.tag_name)
+
+        tag = null_cls({}, [tags.RawText("x")], "[tag]", "[/tag]")
+        self.assertEqual("x", tag.render())
+        self.assertEqual("[tag]x[/tag]", tag.render_raw())
+
+    def test_render_children_overridden(self):
+        class Tag(tags.SimpleTag):
+            tag_name = "tag"
+            template = "<a>{{ body }}</a>"
+
+            def render_children(self):
+                return tags.BaseTag.render_children(self).upper()
+
+        class SubTag(Tag):
+            pass
+
+        for tag_cls in [Tag, SubTag]:
+            null_cls = tag_cls.null_class
+            tag = null_cls({}, [tags.RawText("def")], "[tag]", "[/tag]")
+            self.assertEqual("DEF", tag.render())
+            root = tags.RootTag({}, [tag], "", "")
+            self.assertEqual("DEF", root.render())
+
+    def test_subclass(self):
+        class Tag(tags.SimpleTag):
+            tag_name = "tag"
+
+        class SubTag(Tag):
+            pass
+
+        self.assertIsNot(Tag.null_class, SubTag.null_class)
+        self.assertEqual("NullSubTag", SubTag.null_class.__name__)
+
+    def test_no_tag_name(self):
+        self.assertFalse(hasattr(tags.BaseTag, "null_class"))
+
+    def test_not_in_categories(self):
+        category = tags.TagCategory("Test null")
+
+        class Tag(tags.BaseTag):
+            tag_name = "tag"
+            tag_categories = [category]
+
+        self.assertEqual({Tag}, category.tag_classes)
+        Tag.null_class
+        self.assertEqual({Tag}, category.tag_classes)
@@ -1,3 +1,5 @@
+import io
+import threading
 import unittest
 
 from bbcondeparser.tags import (
@@ -8,8 +10,10 @@ from bbcondeparser.tags import (
     NewlineText,
     TagCategory,
     RootTag,
+    SimpleTag,
 )
 from bbcondeparser import tree_parser
+from bbcondeparser.errors import ParseLimitExceeded
 
 
 class MockBaseTag(BaseTag):
@@ -780,3 +784,741 @@ class TestTreeParserContext(unittest.TestCase):
         result_text = inst.render(ctx={"b": "NOT BOLD",})
 
         self.assertEqual(expected_text, result_text)
+
+    def test_context_per_render(self):
+        barrier = threading.Barrier(2)
+
+        class Bold(MockBaseTag):
+            tag_name = "b"
+
+            def _render(self):
+                # Both threads are mid render before either reads context
+                barrier.wait(timeout=5)
+                return "<b>{}</b>".format(self.get_context().get("b"))
+
+        class TestParser(tree_parser.BaseTreeParser):
+            tags = [Bold]
+
+        inst = TestParser("[b]text[/b]")
+        results = {}
+
+        def render(name):
+            results[name] = inst.render(ctx={"b": name})
+
+        threads = [threading.Thread(target=render, args=(n,)) for n in "xy"]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual({"x": "<b>x</b>", "y": "<b>y</b>"}, results)
+        # Context isn't kept after rendering
+        self.assertEqual({}, inst.get_context())
+
+
+class TestIterRender(unittest.TestCase):
+    def setUp(self):
+        class Bold(SimpleTag):
+            tag_name = "b"
+            template = "<b>{{ body }}</b>"
+
+        class Ctx(MockBaseTag):
+            tag_name = "ctx"
+
+            def _render(self):
+                return str(self.get_context().get("value"))
+
+        class TestParser(tree_parser.BaseTreeParser):
+            tags = [Bold, Ctx]
+
+        self.parser_cls = TestParser
+
+    def test_chunks(self):
+        text = "a [b]b[/b] c\n" * 100
+        inst = self.parser_cls(text)
+
+        chunks = list(inst.iter_render(chunk_size=50))
+
+        self.assertEqual(inst.render(), "".join(chunks))
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks[:-1]:
+            self.assertGreaterEqual(len(chunk), 50)
+
+    def test_render_to(self):
+        inst = self.parser_cls("a [b]b[/b] [ctx][/ctx]")
+        out = io.StringIO()
+
+        inst.render_to(out, ctx={"value": "v"})
+
+        self.assertEqual("a <b>b</b> v", out.getvalue())
+
+    def test_render_truncated(self):
+        inst = self.parser_cls("a [b]bc[/b] [ctx][/ctx] d")
+
+        self.assertEqual("a <b>b...</b>", inst.render_truncated(3, "..."))
+        self.assertEqual(
+            "a <b>bc</b> v d", inst.render_truncated(10, ctx={"value": "v"})
+        )
+        self.assertEqual({}, inst.get_context())
+
+    def test_render_text(self):
+        text = "a [b]b  c[/b]\n\n[ctx][/ctx] d"
+        inst = self.parser_cls(text)
+
+        self.assertEqual("a b c | d", inst.render_text(" | "))
+        self.assertEqual("a b c | d", self.parser_cls.extract_text(text, " | "))
+
+    def test_context_only_while_rendering(self):
+        inst = self.parser_cls("[ctx][/ctx]" + "a" * 20 + "[ctx][/ctx]")
+
+        chunks = inst.iter_render(ctx={"value": "v"}, chunk_size=1)
+
+        self.assertEqual("v", next(chunks))
+        self.assertEqual({}, inst.get_context())
+        self.assertEqual("v", "".join(chunks)[-1])
+
+    def test_empty(self):
+        self.assertEqual([], list(self.parser_cls("").iter_render()))
+
+
+class TestParseEvents(unittest.TestCase):
+    def setUp(self):
+        class Bold(MockBaseTag):
+            tag_name = "b"
+
+        class Line(MockBaseTag):
+            tag_name = "line"
+            close_on_newline = True
+
+        class Img(MockBaseTag):
+            tag_name = "img"
+            self_closing = True
+            attr_defs = {"src": {}}
+
+        class TestParser(tree_parser.BaseTreeParser):
+            tags = [Bold, Line, Img]
+
+        self.Bold = Bold
+        self.Line = Line
+        self.Img = Img
+        self.parser_cls = TestParser
+
+    def _events(self, input_text):
+        return [
+            (event.type, event.location, event.text)
+            for event in tree_parser.parse_events(input_text, self.parser_cls)
+        ]
+
+    def test_tags_and_text(self):
+        input_text = '[b]a[/b]\n[img src="x"]'
+        expected = [
+            ("start_tag", (0, 3), "[b]"),
+            ("text", (3, 4), "a"),
+            ("end_tag", (4, 8), "[/b]"),
+            ("newline", (8, 9), "\n"),
+            ("start_tag", (9, 22), '[img src="x"]'),
+            ("end_tag", (22, 22), ""),
+        ]
+
+        self.assertEqual(expected, self._events(input_text))
+
+    def test_attrs_and_classes(self):
+        events = list(tree_parser.parse_events('[img src="x"]', self.parser_cls))
+
+        self.assertEqual(self.Img, events[0].tag_cls)
+        self.assertEqual({"src": "x"}, events[0].attrs)
+
+    def test_close_on_newline(self):
+        input_text = "[line]a\nb"
+        expected = [
+            ("start_tag", (0, 6), "[line]"),
+            ("text", (6, 7), "a"),
+            ("end_tag", (7, 7), ""),
+            ("newline", (7, 8), "\n"),
+            ("text", (8, 9), "b"),
+        ]
+
+        self.assertEqual(expected, self._events(input_text))
+
+    def test_error_recovery(self):
+        input_text = "[b]a[img][/c]"
+        expected = [
+            ("error", (0, 3), "[b]"),
+            ("text", (3, 4), "a"),
+            ("error", (4, 9), "[img]"),
+            ("error", (9, 13), "[/c]"),
+        ]
+
+        self.assertEqual(expected, self._events(input_text))
+
+    def test_matches_tree(self):
+        input_text = "[b]a[line]b\n[/b]c[/b]\n\n[x]"
+
+        tree = self.parser_cls(input_text).root_node
+        node_texts = [
+            node.text for node in tree.walk_tree() if not isinstance(node, BaseTag)
+        ]
+        event_texts = [
+            event.text
+            for event in tree_parser.parse_events(input_text, self.parser_cls)
+            if event.type in ("text", "error", "newline")
+        ]
+
+        self.assertEqual("".join(node_texts), "".join(event_texts))
+
+
+class TestValidate(unittest.TestCase):
+    def setUp(self):
+        class Bold(MockBaseTag):
+            tag_name = "b"
+
+        class Img(MockBaseTag):
+            tag_name = "img"
+            self_closing = True
+            attr_defs = {"src": {}}
+
+        class TestParser(tree_parser.BaseTreeParser):
+            tags = [Bold, Img]
+
+        self.parser_cls = TestParser
+
+    def test_valid(self):
+        result = self.parser_cls.validate('[b]Hello[/b]\n[img src="x"]')
+
+        self.assertEqual([], result)
+
+    def test_errors(self):
+        input_text = "[b]a[img][/c]"
+        expected = [
+            ((0, 3), "missing close tag"),
+            ((4, 9), "missing required attr src"),
+            ((9, 13), "close tag does not match any open tag"),
+        ]
+
+        result = self.parser_cls.validate(input_text)
+
+        self.assertEqual(expected, result)
+
+    def test_matches_tree(self):
+        input_text = "[b]a[b]b[/c]\n[img src='x' alt='y'][/b][b]"
+
+        tree = self.parser_cls(input_text).root_node
+        expected = [
+            node.reason for node in tree.walk_tree() if isinstance(node, ErrorText)
+        ]
+
+        result = [reason for _, reason in self.parser_cls.validate(input_text)]
+
+        self.assertEqual(expected, result)
+
+
+class TestParseLimits(unittest.TestCase):
+    def _parser_cls(self, limits):
+        class Bold(MockBaseTag):
+            tag_name = "b"
+            attr_defs = {"x": {"default": ""}, "y": {"default": ""}}
+
+        class TestParser(tree_parser.BaseTreeParser):
+            tags = [Bold]
+
+        TestParser.limits = limits
+        return TestParser
+
+    def test_no_limits(self):
+        parser_cls = self._parser_cls(tree_parser.ParseLimits())
+
+        parser_cls("[b][b][b]a[/b][/b][/b]")
+
+    def test_max_depth_raises(self):
+        parser_cls = self._parser_cls(tree_parser.ParseLimits(max_depth=2))
+
+        parser_cls("[b][b]a[/b][/b]")
+        with self.assertRaises(ParseLimitExceeded) as cm:
+            parser_cls("[b][b][b]a[/b][/b][/b]")
+
+        self.assertEqual("max_depth", cm.exception.limit)
+        self.assertEqual(6, cm.exception.location)
+
+    def test_max_tokens_raises(self):
+        parser_cls = self._parser_cls(tree_parser.ParseLimits(max_tokens=3))
+
+        parser_cls("[b]a[/b]")
+        with self.assertRaises(ParseLimitExceeded):
+            parser_cls("[b]a[/b]b")
+
+    def test_max_errors_raises(self):
+        parser_cls = self._parser_cls(tree_parser.ParseLimits(max_errors=1))
+
+        parser_cls("[/i]")
+        with self.assertRaises(ParseLimitExceeded):
+            parser_cls("[/i][/i]")
+
+    def test_attr_limits_raise(self):
+        parser_cls = self._parser_cls(tree_parser.ParseLimits(max_attrs=1))
+        with self.assertRaises(ParseLimitExceeded):
+            parser_cls('[b x="1" y="2"][/b]')
+
+        parser_cls = self._parser_cls(tree_parser.ParseLimits(max_attr_bytes=5))
+        parser_cls('[b x="1234"][/b]')
+        with self.assertRaises(ParseLimitExceeded):
+            parser_cls('[b x="12345"][/b]')
+
+    def test_max_recovery_steps_raises(self):
+        parser_cls = self._parser_cls(tree_parser.ParseLimits(max_recovery_steps=1))
+
+        parser_cls("[b]")
+        with self.assertRaises(ParseLimitExceeded):
+            parser_cls("[b][b]")
+
+    def test_max_recovery_steps_counts_tokens(self):
+        # Each unclosed tag sends the parser back over the tokens after it
+        parser_cls = self._parser_cls(tree_parser.ParseLimits(max_recovery_steps=55))
+        parser_cls("[b]" * 10)
+        with self.assertRaises(ParseLimitExceeded):
+            parser_cls("[b]" * 11)
+
+        parser_cls = self._parser_cls(tree_parser.ParseLimits(max_recovery_steps=1000))
+        with self.assertRaises(ParseLimitExceeded) as cm:
+            parser_cls("[b]" * 3000)
+        # Given up on the first time back, at the end of the text
+        self.assertEqual(9000, cm.exception.location)
+
+    def test_truncate(self):
+        parser_cls = self._parser_cls(
+            tree_parser.ParseLimits(max_depth=1, truncate=True)
+        )
+
+        result = parser_cls("a[b]b[/b][b]c[b]d[/b][/b]").root_node
+
+        self.assertEqual(
+            [
+                RawText("a"),
+                parser_cls.tags[0]({}, [RawText("b")], "[b]", "[/b]"),
+                ErrorText("[b]c[b]d[/b][/b]"),
+            ],
+            result.tree,
+        )
+        self.assertEqual("parse limit exceeded", result.tree[-1].reason)
+
+    def test_validate_truncate(self):
+        parser_cls = self._parser_cls(
+            tree_parser.ParseLimits(max_tokens=2, truncate=True)
+        )
+
+        result = parser_cls.validate("ab[/i]c")
+
+        self.assertEqual(
+            [
+                ((2, 6), "close tag does not match any open tag"),
+                ((6, 7), "parse limit exceeded"),
+            ],
+            result,
+        )
+
+
+class TestTagTable(unittest.TestCase):
+    def test_tag_dicts_shared(self):
+        class ATag(MockBaseTag):
+            tag_name = "a"
+
+        class BTag(MockBaseTag):
+            tag_name = "b"
+            allowed_tags = [ATag]
+
+        ATag.allowed_tags = [BTag]
+
+        table = tree_parser.TagTable([ATag, BTag])
+        a_dict = table.get_new_tag_dict(ATag, table.tag_dict)
+        b_dict = table.get_new_tag_dict(BTag, a_dict)
+
+        self.assertIs(a_dict, table.get_new_tag_dict(ATag, table.tag_dict))
+        self.assertIs(a_dict, table.get_new_tag_dict(ATag, b_dict))
+        self.assertEqual(
+            tree_parser.get_new_tag_dict(BTag, a_dict), b_dict,
+        )
+
+    def test_parser_table_cached(self):
+        category = TagCategory("test")
+
+        class ATag(MockBaseTag):
+            tag_name = "a"
+            tag_categories = [category]
+
+        class TestParser(tree_parser.BaseTreeParser):
+            tags = [category]
+
+        table = TestParser.get_tag_table()
+        self.assertIs(table, TestParser.get_tag_table())
+
+        @category
+        class BTag(MockBaseTag):
+            tag_name = "b"
+
+        self.assertIsNot(table, TestParser.get_tag_table())
+        self.assertEqual(
+            {"a": ATag, "b": BTag}, TestParser.get_tag_table().tag_dict,
+        )
+
+    def test_parser_table_allowed_tags_changed(self):
+        class ATag(MockBaseTag):
+            tag_name = "a"
+
+        class BTag(MockBaseTag):
+            tag_name = "b"
+
+        class CTag(MockBaseTag):
+            tag_name = "c"
+            allowed_tags = [ATag]
+
+        class TestParser(tree_parser.BaseTreeParser):
+            tags = [CTag, BTag]
+
+        def parse(text):
+            return TestParser(text).root_node.tree[0].tree[0]
+
+        self.assertIs(BTag.null_class, type(parse("[c][b][/b][/c]")))
+
+        CTag.allowed_tags = [ATag, BTag]
+        self.assertIs(BTag, type(parse("[c][b][/b][/c]")))
+
+        class DTag(MockBaseTag):
+            tag_name = "d"
+
+        BTag.allowed_tags = [DTag]
+        inner = parse("[c][b][d][/d][/b][/c]").tree[0]
+        self.assertIs(DTag, type(inner))
+
+
+class TestParseMany(unittest.TestCase):
+    def setUp(self):
+        class Bold(MockBaseTag):
+            tag_name = "b"
+
+            def _render(self):
+                return "<b>{}</b>".format(self.render_children())
+
+        class TestParser(tree_parser.BaseTreeParser):
+            tags = [Bold]
+
+        self.parser_cls = TestParser
+        self.texts = ["[b]a[/b]", "b", "[b]c"]
+
+    def test_parse_many(self):
+        expected = [self.parser_cls(text).root_node for text in self.texts]
+
+        result = list(self.parser_cls.parse_many(iter(self.texts)))
+
+        self.assertEqual(expected, result)
+
+    def test_render_many(self):
+        expected = ["<b>a</b>", "b", "[b]c"]
+
+        result = list(self.parser_cls.render_many(iter(self.texts)))
+
+        self.assertEqual(expected, result)
+
+
+class TestSourceText(unittest.TestCase):
+    def test_nodes_share_source(self):
+        class Bold(MockBaseTag):
+            tag_name = "b"
+
+        class Line(MockBaseTag):
+            tag_name = "line"
+            close_on_newline = True
+
+        class TestParser(tree_parser.BaseTreeParser):
+            tags = [Bold, Line]
+
+        text = "a [b]b[/b]\n\n[line]c\n[] [/b]"
+        parser = TestParser(text)
+
+        nodes = [parser.root_node] + list(parser.root_node.walk_tree())
+        source = parser.root_node._source
+        self.assertEqual(text, source.text)
+        for node in nodes:
+            self.assertIs(source, node._source, node)
+
+        self.assertEqual(text, parser.root_node.render_raw())
+
+
+class TestFingerprint(unittest.TestCase):
+    def make_parser(self, template):
+        class Bold(MockBaseTag):
+            tag_name = "b"
+
+        Bold.template = template
+
+        class TestParser(tree_parser.BaseTreeParser):
+            tags = [Bold]
+
+        return TestParser
+
+    def test_fingerprint(self):
+        parser_cls = self.make_parser("<b>{{ body }}</b>")
+
+        self.assertEqual(parser_cls.fingerprint(), parser_cls.fingerprint())
+        self.assertEqual(
+            parser_cls.fingerprint(),
+            self.make_parser("<b>{{ body }}</b>").fingerprint(),
+        )
+        self.assertNotEqual(
+            parser_cls.fingerprint(),
+            self.make_parser("<strong>{{ body }}</strong>").fingerprint(),
+        )
+
+    def test_tags_changed(self):
+        parser_cls = self.make_parser("<b>{{ body }}</b>")
+        fingerprint = parser_cls.fingerprint()
+
+        class Italic(MockBaseTag):
+            tag_name = "i"
+
+        parser_cls.tags = parser_cls.tags + [Italic]
+
+        self.assertNotEqual(fingerprint, parser_cls.fingerprint())
+
+    def test_names_used(self):
+        def make_parser(name):
+            class Shout(MockBaseTag):
+                tag_name = "shout"
+
+                if name == "upper":
+
+                    def _render(self):
+                        return self.render_children().upper()
+
+                else:
+
+                    def _render(self):
+                        return self.render_children().lower()
+
+            class TestParser(tree_parser.BaseTreeParser):
+                tags = [Shout]
+
+            return TestParser
+
+        self.assertEqual(
+            make_parser("upper").fingerprint(), make_parser("upper").fingerprint()
+        )
+        self.assertNotEqual(
+            make_parser("upper").fingerprint(), make_parser("lower").fingerprint()
+        )
+
+    def test_allowed_tags(self):
+        def make_parser(template):
+            class Item(MockBaseTag):
+                tag_name = "item"
+
+            Item.template = template
+
+            class List(MockBaseTag):
+                tag_name = "list"
+                allowed_tags = [Item]
+
+            class TestParser(tree_parser.BaseTreeParser):
+                tags = [List]
+
+            return TestParser
+
+        parser_cls = make_parser("<li>{{ body }}</li>")
+        self.assertEqual(
+            parser_cls.fingerprint(), make_parser("<li>{{ body }}</li>").fingerprint()
+        )
+        self.assertNotEqual(
+            parser_cls.fingerprint(),
+            make_parser("<li class=x>{{ body }}</li>").fingerprint(),
+        )
+
+        fingerprint = parser_cls.fingerprint()
+
+        class Other(MockBaseTag):
+            tag_name = "other"
+
+        list_tag = parser_cls.tags[0]
+        list_tag.allowed_tags = list_tag.allowed_tags + [Other]
+        self.assertNotEqual(fingerprint, parser_cls.fingerprint())
+
+
+class TestReset(unittest.TestCase):
+    def setUp(self):
+        class Bold(MockBaseTag):
+            tag_name = "b"
+
+            def _render(self):
+                return "<b>{}</b>".format(self.render_children())
+
+        class TestParser(tree_parser.BaseTreeParser):
+            tags = [Bold]
+
+        self.parser_cls = TestParser
+
+    def test_reset(self):
+        parser = self.parser_cls("[b]a")
+        old_root = parser.root_node
+        tree_parser_inst = parser._tree_parser
+
+        parser.reset("[b]b[/b]")
+
+        self.assertEqual("<b>b</b>", parser.render())
+        self.assertEqual("[b]b[/b]", parser.raw_text)
+        self.assertIs(parser, parser.root_node._parent_node)
+        self.assertEqual(self.parser_cls("[b]b[/b]").root_node, parser.root_node)
+        # The old tree is left alone
+        self.assertEqual(self.parser_cls("[b]a").root_node, old_root)
+        # and the internals are reused
+        self.assertIs(tree_parser_inst, parser._tree_parser)
+        self.assertEqual([], tree_parser_inst.stack.stack)
+
+    def test_reset_after_tags_change(self):
+        class Italic(MockBaseTag):
+            tag_name = "i"
+
+        parser = self.parser_cls("[i]a[/i]")
+        self.parser_cls.tags = self.parser_cls.tags + [Italic]
+
+        parser.reset("[i]a[/i]")
+
+        self.assertIsInstance(parser.root_node.tree[0], Italic)
+
+    def test_pool(self):
+        pool = tree_parser.ParserPool()
+
+        parser = pool.parse(self.parser_cls, "[b]a[/b]")
+        self.assertEqual("<b>a</b>", parser.render())
+
+        second = pool.parse(self.parser_cls, "b")
+        self.assertIs(parser, second)
+        self.assertEqual("b", second.render())
+
+    def test_pool_per_thread(self):
+        pool = tree_parser.ParserPool()
+        parser = pool.parse(self.parser_cls, "a")
+        result = []
+
+        thread = threading.Thread(
+            target=lambda: result.append(pool.parse(self.parser_cls, "a"))
+        )
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(parser, result[0])
+
+
+class TestReparse(unittest.TestCase):
+    def setUp(self):
+        class Bold(MockBaseTag):
+            tag_name = "b"
+
+        class Line(MockBaseTag):
+            tag_name = "line"
+            close_on_newline = True
+
+        class TestParser(tree_parser.BaseTreeParser):
+            tags = [Bold, Line]
+
+        self.parser_cls = TestParser
+
+    def _reparse(self, input_text, edit):
+        parser = self.parser_cls(input_text)
+        old_tree = list(parser.root_node.tree)
+        parser.root_node.find_all(BaseTag)
+        parser.reparse(edit)
+
+        expected = self.parser_cls(parser.raw_text)
+        self.assertEqual(expected.raw_text, parser.raw_text)
+        self.assertEqual(expected.root_node, parser.root_node)
+        self.assertEqual(
+            [node.location for node in expected.root_node.walk_tree()],
+            [node.location for node in parser.root_node.walk_tree()],
+        )
+        # Text read from the source still matches after the edit
+        self.assertEqual(parser.raw_text, parser.root_node.render_raw())
+        self.assertEqual(
+            [node.location for node in expected.root_node.find_all(BaseTag)],
+            [node.location for node in parser.root_node.find_all(BaseTag)],
+        )
+        return old_tree, parser.root_node.tree
+
+    def test_locations(self):
+        parser = self.parser_cls("a[b]b\n[/b][line]c\n")
+        self.assertEqual(
+            [(0, 1), (1, 10), (4, 5), (5, 6), (10, 17), (16, 17), (17, 18)],
+            [node.location for node in parser.root_node.walk_tree()],
+        )
+
+    def test_reparse_inside_tag(self):
+        old_tree, new_tree = self._reparse(
+            "a[b]b[/b]c[b]d[/b]", tree_parser.TextEdit(5, 5, "[b]x[/b]")
+        )
+
+        self.assertIs(old_tree[0], new_tree[0])
+        self.assertIsNot(old_tree[1], new_tree[1])
+        self.assertIs(old_tree[2], new_tree[2])
+        self.assertIs(old_tree[3], new_tree[3])
+
+    def test_reparse_nested(self):
+        old_tree, new_tree = self._reparse(
+            "[b]a[b]b[/b][/b]", tree_parser.TextEdit(7, 8, "xyz")
+        )
+
+        self.assertIs(old_tree[0], new_tree[0])
+        self.assertEqual([RawText("xyz")], new_tree[0].tree[1].tree)
+
+    def test_reparse_at_root(self):
+        old_tree, new_tree = self._reparse(
+            "a[b]b[/b]", tree_parser.TextEdit(0, 1, "[b]")
+        )
+
+        self.assertIsNot(old_tree[1], new_tree[1])
+
+    def test_replaced_node_unchanged(self):
+        parser = self.parser_cls("aaa [b]hello[/b] bbb")
+        old_b = parser.root_node.tree[1]
+
+        parser.reparse(tree_parser.TextEdit(8, 8, "XYZXYZ"))
+
+        self.assertIsNot(old_b, parser.root_node.tree[1])
+        self.assertEqual("hello", old_b.tree[0].text)
+        self.assertEqual("[b]hello[/b]", old_b.render_raw())
+        self.assertIsNone(old_b._parent_node)
+        self.assertEqual("[b]hXYZXYZello[/b]", parser.root_node.tree[1].render_raw())
+
+    def test_repeated_reparse(self):
+        parser = self.parser_cls("a[b]b[/b]c[b]d[/b][line]e\n")
+        first, last = parser.root_node.tree[0], parser.root_node.tree[-2]
+
+        for edit in [
+            tree_parser.TextEdit(4, 4, "xx"),
+            tree_parser.TextEdit(6, 7, ""),
+            tree_parser.TextEdit(14, 14, "[b]y[/b]"),
+        ]:
+            parser.reparse(edit)
+        # Nodes after the edits are moved along when next used
+        self.assertIsNotNone(last._source.edit)
+
+        expected = self.parser_cls(parser.raw_text)
+        self.assertEqual("a[b]xx[/b]c[b][b]y[/b]d[/b][line]e\n", parser.raw_text)
+        self.assertEqual(
+            [node.location for node in expected.root_node.walk_tree()],
+            [node.location for node in parser.root_node.walk_tree()],
+        )
+        self.assertIs(first, parser.root_node.tree[0])
+        self.assertEqual("a", first.text)
+        self.assertIs(last, parser.root_node.tree[-2])
+        self.assertEqual("[line]", last.start_text)
+        self.assertEqual((27, 34), last.location)
+        self.assertEqual(parser.raw_text, parser.root_node.render_raw())
+
+    def test_reparse_breaks_tag(self):
+        self._reparse("[b]a[/b]b", tree_parser.TextEdit(4, 4, "[/b]"))
+        self._reparse("[b]a[/b]b", tree_parser.TextEdit(3, 3, "[b]"))
+
+    def test_reparse_close_on_newline_ancestor(self):
+        self._reparse("[line][b]a[/b]\nb", tree_parser.TextEdit(10, 10, "\n"))
+
+    def test_reparse_after_recovery(self):
+        self._reparse("[line]a[b]b[/b]", tree_parser.TextEdit(11, 11, "\n"))
+
+    def test_reparse_unterminated_tag(self):
+        self._reparse('[b]a[/b][b x="]"]', tree_parser.TextEdit(4, 4, '[b x="'))